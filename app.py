@@ -1,51 +1,56 @@
+import importlib
+import time
+
+_t0 = time.perf_counter()
+
 import streamlit as st
 
-import time
+from backend.jobs import get_scheduler, log
 
-from backend.jobs import start_job, jobs, logs
-from tabs.tab_dacphysics import dacphysics_tab
-from tabs.tab_HVramp import HVramp_tab
+STARTUP_TARGET_S = 1.5 # First render of a session above this is logged as a warning
 
 st.set_page_config(layout="wide", page_title='HypeX Operations')
 st.title("HypeX Operations UI v0.1")
 
+get_scheduler()# Start the job scheduler (re-queues jobs interrupted by a restart)
+
+
+def render(module, function, fragment=False):
+    '''Import a tab module on first use and run its tab function'''
+    tab = getattr(importlib.import_module(module), function)
+    if fragment:
+        tab = st.fragment(tab)
+    tab()
+
 
 # -------------------------
 # MAIN FUNCTIONAL TABS (1) Calculator (2) HV Ramp (2) Data Interpreation/Morph (3) Analysis
 # -------------------------
+#Tabs track which one is open, so only the open tab runs (and imports its backend). The HV ramp tab is the
+#exception: its checkboxes are the operator's record of the ramp and must keep their state while another tab is open.
 tab_dacphysics, tab_HVramp, tab_interpret, tab_analysis = st.tabs([
     "Calculator",
     "HV Ramp-Up/Down procedure",
     "Data Interpretation",
     "Analysis"
-])
+], key="main_tab", on_change="rerun")
 
 
+#Calculator and HV ramp run as fragments: touching their widgets reruns only that tab, and nothing else reruns them
 with tab_dacphysics:
-    dacphysics_tab()
+    if tab_dacphysics.open:
+        render("tabs.tab_dacphysics", "dacphysics_tab", fragment=True)
 
 with tab_HVramp:
-    HVramp_tab()
+    render("tabs.tab_HVramp", "HVramp_tab", fragment=True)
 
 with tab_interpret:
-    st.subheader("Data Interpretation")
-    if st.button("Run interpretation"):
-        start_job(
-            name="interpretation",
-            target=run_interpretation,
-            input_path="raw.dat",
-            output_path="interpreted.txt"
-        )
+    if tab_interpret.open:
+        render("tabs.tab_interpret", "interpret_tab")
 
 with tab_analysis:
-    st.subheader("Analysis")
-    if st.button("Run analysis"):
-        start_job(
-            name="analysis",
-            target=run_analysis,
-            parquet_path="data.parquet",
-            clustering_gap=50
-        )
+    if tab_analysis.open:
+        render("tabs.tab_analyzedata", "analyzedata_tab")
 
 # -------------------------
 # PERSISTENT CLI / STATUS
@@ -53,20 +58,11 @@ with tab_analysis:
 st.markdown("---")
 
 with st.expander("Background Jobs & Logs", expanded=True):
+    render("tabs.tab_jobs", "jobs_panel")
 
-    st.markdown("### Jobs")
-    if not jobs:
-        st.write("No jobs running.")
-    else:
-        for name, info in jobs.items():
-            st.write(f"**{name}** → {info['status']}")
-
-    st.markdown("### Logs")
-    if logs:
-        st.code("\n".join(logs[-15:]))
-    else:
-        st.write("No logs yet.")
-
-# Simple refresh loop for cli updates
-time.sleep(0.5)
-st.rerun()
\ No newline at end of file
+#Time to the first complete render of a session (imports included), measured once per session
+if "startup_s" not in st.session_state:
+    st.session_state.startup_s = time.perf_counter() - _t0
+    slow = st.session_state.startup_s > STARTUP_TARGET_S
+    log(f"dashboard: first render in {st.session_state.startup_s:.2f} s" + (f" (target {STARTUP_TARGET_S:g} s)" if slow else ""),
+        level="WARNING" if slow else "DEBUG", seconds=st.session_state.startup_s)
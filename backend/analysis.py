@@ -0,0 +1,263 @@
+#backend/analysis.py
+'''Event building: ToA-ordered hits -> GridPix clusters with per-cluster summaries (Parquet)'''
+
+import csv
+import hashlib
+import os
+import time
+import uuid
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from backend.jobs import log, JobStats
+from backend.interpretation import FTOA_PER_COARSE, sort_hits
+from backend.totcalib import hits_to_electrons
+from backend.resultcache import ResultCache, code_version
+from backend.hvarchive import INDEX_DIR, LOG_DIR
+from backend.hvtimeline import HV_FIELDS, GainCurve, HVTimeline, to_ns
+
+RADIUS = 5 # Cell size in pixels for spatial adjacency (GridPix tracks are sparse, neighbouring electrons are a few pixels apart)
+BATCH_ROWS = 1 << 22 # Hits read from the Parquet file at once
+HIT_COLUMNS = ["col", "row", "toa", "tot"]
+
+CLUSTER_SCHEMA = pa.schema([
+    ("cluster_id", pa.uint64()),
+    ("size", pa.uint32()),
+    ("tot_sum", pa.uint64()),
+    ("charge_sum", pa.float32()),# Electrons from the per-pixel ToT calibration, NaN without one
+    ("col_centroid", pa.float32()),
+    ("row_centroid", pa.float32()),
+    ("length", pa.float32()),# Bounding box diagonal in pixels
+    ("toa_start", pa.uint64()),
+    ("toa_span", pa.uint64()),# Same unit as the hit ToA (1.5625 ns)
+])
+
+
+def connected_components(n_nodes, a, b):
+    '''Label the connected components of an undirected graph given as edge arrays (a[i], b[i]).
+    Vectorized hook-and-jump: every pass hooks each root to the smallest root it touches, then pointer jumping
+    flattens the trees, so the number of passes grows with log(component size), not with the number of edges.'''
+    labels = np.arange(n_nodes)
+    while len(a):
+        la, lb = labels[a], labels[b]
+        differ = la != lb
+        if not differ.any():
+            break
+        la, lb = la[differ], lb[differ]
+        low = np.minimum(la, lb)
+        np.minimum.at(labels, la, low)
+        np.minimum.at(labels, lb, low)
+        while True:# Pointer jumping until every node points at its root
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        a, b = a[differ], b[differ]
+    return labels
+
+
+def label_hits(col, row, toa, gap, radius=RADIUS):
+    '''Cluster index for every hit of a ToA-sorted block. Hits belong to one cluster when they are in the same
+    time group (consecutive hits less than `gap` apart) and are connected through neighbouring radius x radius cells.'''
+    if len(toa) == 0:
+        return np.zeros(0, dtype=np.int64), 0
+    group = np.zeros(len(toa), dtype=np.int64)
+    np.cumsum(np.diff(toa.astype(np.int64)) > gap, out=group[1:])
+    cx = col.astype(np.int64) // radius
+    cy = row.astype(np.int64) // radius
+    cells, cell_of_hit = np.unique((group << 16) | (cx << 8) | cy, return_inverse=True)
+
+    # Edges to the 4 "forward" neighbour cells (the other 4 are covered from the other side)
+    n_cells_side = 255 // radius + 1
+    ccx, ccy = (cells >> 8) & 0xFF, cells & 0xFF
+    edges_a, edges_b = [], []
+    for dx, dy in ((0, 1), (1, -1), (1, 0), (1, 1)):
+        valid = (ccx + dx < n_cells_side) & (ccy + dy >= 0) & (ccy + dy < n_cells_side)
+        neighbour = cells + (dx << 8) + dy
+        pos = np.searchsorted(cells, neighbour)
+        found = valid & (pos < len(cells))
+        found[found] = cells[pos[found]] == neighbour[found]
+        edges_a.append(np.flatnonzero(found))
+        edges_b.append(pos[found])
+    labels = connected_components(len(cells), np.concatenate(edges_a), np.concatenate(edges_b))
+    roots, cluster = np.unique(labels[cell_of_hit.ravel()], return_inverse=True)
+    return cluster.ravel(), len(roots)
+
+
+def summarize_clusters(cluster, n_clusters, col, row, toa, tot, first_id=0, charge=None):
+    '''Per-cluster size, total ToT (and charge), centroid, track length and ToA span as a dict of columns (see CLUSTER_SCHEMA)'''
+    order = np.argsort(cluster, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(cluster[order]) != 0])
+    col, row = col[order].astype(np.float64), row[order].astype(np.float64)
+    toa = toa[order].astype(np.int64)
+    size = np.diff(np.r_[starts, len(order)])
+    toa_start = np.minimum.reduceat(toa, starts)
+    return {
+        "cluster_id": np.arange(first_id, first_id + n_clusters, dtype=np.uint64),
+        "size": size.astype(np.uint32),
+        "tot_sum": np.add.reduceat(tot[order].astype(np.uint64), starts),
+        "charge_sum": (np.full(n_clusters, np.nan) if charge is None else np.add.reduceat(charge[order], starts)).astype(np.float32),
+        "col_centroid": (np.add.reduceat(col, starts) / size).astype(np.float32),
+        "row_centroid": (np.add.reduceat(row, starts) / size).astype(np.float32),
+        "length": np.hypot(
+            np.maximum.reduceat(col, starts) - np.minimum.reduceat(col, starts),
+            np.maximum.reduceat(row, starts) - np.minimum.reduceat(row, starts),
+        ).astype(np.float32),
+        "toa_start": np.maximum(toa_start, 0).astype(np.uint64),
+        "toa_span": (np.maximum.reduceat(toa, starts) - toa_start).astype(np.uint64),
+    }
+
+
+class Clusterer:
+    '''Streaming event builder. Blocks of ToA-sorted hits are pushed in order; the hits after the last time gap of
+    a block may belong to an event that continues in the next block, so they are carried over.'''
+
+    def __init__(self, clustering_gap=50, radius=RADIUS, calibration=None):
+        self.gap = clustering_gap * FTOA_PER_COARSE # clustering_gap is given in 25 ns clock cycles
+        self.radius = radius
+        self.calibration = calibration # (4, 256, 256) ToT calibration maps from backend.totcalib, optional
+        self.carry = None
+        self.n_clusters = 0
+        self.n_hits = 0
+
+    def _cluster(self, hits):
+        cluster, n = label_hits(hits["col"], hits["row"], hits["toa"], self.gap, self.radius)
+        charge = None
+        if self.calibration is not None:
+            charge = hits_to_electrons(self.calibration, hits["col"], hits["row"], hits["tot"])
+        summary = summarize_clusters(cluster, n, hits["col"], hits["row"], hits["toa"], hits["tot"], self.n_clusters, charge)
+        self.n_clusters += n
+        return summary
+
+    def push(self, hits):
+        '''Add a block of hits, returns the summaries of all clusters that are complete'''
+        hits = {name: hits[name] for name in HIT_COLUMNS}
+        self.n_hits += len(hits["toa"])
+        if self.carry is not None:
+            hits = sort_hits({name: np.concatenate([self.carry[name], hits[name]]) for name in HIT_COLUMNS})
+        toa = hits["toa"].astype(np.int64)
+        gaps = np.flatnonzero(np.diff(toa) > self.gap)
+        if len(gaps) == 0:# Everything could still be one event
+            self.carry = hits
+            return None
+        cut = gaps[-1] + 1
+        self.carry = {name: values[cut:] for name, values in hits.items()}
+        return self._cluster({name: values[:cut] for name, values in hits.items()})
+
+    def flush(self):
+        carry, self.carry = self.carry, None
+        if carry is None or not len(carry["toa"]):
+            return None
+        return self._cluster(carry)
+
+
+def iter_hit_batches(parquet_path, batch_rows=BATCH_ROWS, columns=HIT_COLUMNS):
+    '''Yield dicts of NumPy columns from an interpreted hit Parquet file'''
+    with pq.ParquetFile(parquet_path) as f:
+        for batch in f.iter_batches(batch_size=batch_rows, columns=columns):
+            yield {name: column.to_numpy() for name, column in zip(batch.schema.names, batch.columns)}
+
+
+def _write_gain(path, rows):
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ["Vgrid", "Vanode", "Vcathode"])
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+def run_analysis(parquet_path, clustering_gap=50, radius=RADIUS, output_path=None, calibration=None, run_start=None,
+                 hv_log_dir=LOG_DIR, cache=True, job=None):
+    '''Cluster the hits of an interpreted Parquet file into events and write the cluster summaries to Parquet.
+    calibration: ToT calibration maps (array or .npy path from backend.totcalib) to sum cluster charge in electrons
+    run_start: local wall-clock time (ISO string) of ToA 0. With it, every cluster is tagged with the HV step and
+    voltages logged in hv_log_dir at its time, and the gain-vs-voltage table is written to <output>_gain.csv.
+    With cache, a run on the same hit file with the same parameters and code is restored from the result cache.'''
+    stats = job.stats if job is not None else JobStats(enabled=False)
+    if output_path is None:
+        output_path = os.path.splitext(parquet_path)[0] + "_clusters.parquet"
+    outputs = {"clusters.parquet": output_path}
+    inputs = [parquet_path]
+    calibration_file = isinstance(calibration, (str, os.PathLike))
+    if calibration_file:
+        inputs.append(calibration)
+        calibration = np.load(calibration)
+    schema, timeline = CLUSTER_SCHEMA, None
+    if run_start is not None:
+        timeline = HVTimeline.from_log_dir(hv_log_dir)
+        gain = GainCurve(timeline, calibrated=calibration is not None)
+        run_start_ns = to_ns(run_start)
+        schema = pa.schema(list(CLUSTER_SCHEMA) + HV_FIELDS)
+        gain_path = os.path.splitext(output_path)[0] + "_gain.csv"
+        outputs["gain.csv"] = gain_path
+        inputs.append(os.path.join(hv_log_dir, INDEX_DIR, "events.parquet"))
+    if cache:
+        result_cache = ResultCache()
+        params = {"clustering_gap": clustering_gap, "radius": radius, "run_start": run_start}
+        if calibration is not None and not calibration_file:
+            params["calibration"] = hashlib.sha1(np.ascontiguousarray(calibration).tobytes()).hexdigest()
+        code = code_version(__name__, "backend.interpretation", "backend.totcalib", "backend.dacphysics", "backend.hvtimeline")
+        key = result_cache.key("analysis", inputs, params, code)
+        result = result_cache.get(key, outputs)
+        if result is not None:
+            log(f"analysis: {parquet_path} with gap {clustering_gap}, radius {radius} restored from the result cache")
+            if job is not None:
+                job.progress(1.0, "from cache")
+            return result | {"parquet_path": str(parquet_path), "output_path": str(output_path), "cached": True}
+    log(f"analysis: clustering {parquet_path} (gap {clustering_gap} × 25 ns, radius {radius} px)")
+
+    clusterer = Clusterer(clustering_gap, radius, calibration)
+    n_rows = pq.read_metadata(parquet_path).num_rows
+    t0 = time.perf_counter()
+    tmp_path = f"{output_path}.{uuid.uuid4().hex[:8]}.part"
+    try:
+        with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+            def write(summary):
+                if summary is None:
+                    return
+                if timeline is not None:
+                    with stats.stage("hv tag"):
+                        index = timeline.tag(summary, run_start_ns)
+                        summary.update(timeline.lookup(index))
+                        gain.add(summary, index)
+                with stats.stage("write"):
+                    writer.write_table(pa.Table.from_pydict(summary, schema=schema))
+
+            for hits in stats.timed("read", iter_hit_batches(parquet_path)):
+                with stats.stage("cluster"):
+                    summary = clusterer.push(hits)
+                write(summary)
+                if job is not None:
+                    job.progress(clusterer.n_hits / max(n_rows, 1))
+                    job.check()
+            with stats.stage("cluster"):
+                summary = clusterer.flush()
+            write(summary)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    stats.count(hits=clusterer.n_hits, clusters=clusterer.n_clusters)
+    dt = max(time.perf_counter() - t0, 1e-9)
+    result = {
+        "parquet_path": str(parquet_path),
+        "output_path": str(output_path),
+        "hits": clusterer.n_hits,
+        "clusters": clusterer.n_clusters,
+        "seconds": dt,
+        "hits_per_s": clusterer.n_hits / dt,
+    }
+    if timeline is not None:
+        result["gain_path"] = gain_path
+        result["gain"] = gain.rows()
+        _write_gain(gain_path, result["gain"])
+        log(f"analysis: {len(result['gain'])} HV settings in the run → {gain_path}")
+    log(f"analysis: {clusterer.n_clusters} clusters from {clusterer.n_hits} hits in {dt:.1f} s → {result['hits_per_s']:.3g} hits/s",
+        hits=clusterer.n_hits, clusters=clusterer.n_clusters, seconds=dt, hits_per_s=result["hits_per_s"])
+    if cache:
+        result_cache.put(key, outputs, result)
+    return result
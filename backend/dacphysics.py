@@ -1,45 +1,79 @@
 #backend/dacphysics.py
-'''DAC / Pulse Amplitude / Electrons conversion utilities'''
+'''DAC / Pulse Amplitude / Electrons conversion utilities
+
+All converters accept Python scalars or NumPy arrays (any shape, e.g. per-hit values or 256x256 pixel maps).
+Calibration parameters broadcast the same way, so a per-pixel slope/intercept map can be passed directly,
+or gathered per hit with pixel_lookup(). Scalar inputs give scalar results.'''
+
+import numpy as np
 
 E_CHARGE = 1.602e-19 # Charge of electron in Coloumbs
 VTP_DAC_STEP_MV = 2.5 # Test Pulse DAC step in mV
+VTPF_DAC_MAX = 511 # VTP Fine DAC is 9 bit
+
+def _result(x):
+    '''Unwrap 0-d arrays so scalar inputs give scalar outputs'''
+    return x[()] if isinstance(x, np.ndarray) and x.ndim == 0 else x
+
+def pixel_lookup(calib, col, row):
+    '''Per-hit calibration values from a 256x256 [col, row] map (scalars are passed through)'''
+    calib = np.asarray(calib)
+    return calib[col, row] if calib.ndim == 2 else _result(calib)
 
 def vtp_to_electrons(pH_mV, C_fF):
     '''Convert test pulse height (mV) and input capacitance (fF) to number of electrons'''
-    pH_V = pH_mV * 1e-3  # Convert mV to V
-    C_F = C_fF * 1e-15   # Convert fF to F
+    pH_V = np.asarray(pH_mV, dtype=np.float64) * 1e-3  # Convert mV to V
+    C_F = np.asarray(C_fF, dtype=np.float64) * 1e-15   # Convert fF to F
     electrons = (pH_V * C_F) / E_CHARGE
-    return electrons
+    return _result(electrons)
 
 def electrons_to_vtp(electrons, C_fF):
     '''Convert number of electrons and input capacitance (fF) to test pulse height (mV)'''
-    C_F = C_fF * 1e-15   # Convert fF to F
-    pH_V = (electrons * E_CHARGE) / C_F
+    C_F = np.asarray(C_fF, dtype=np.float64) * 1e-15   # Convert fF to F
+    pH_V = (np.asarray(electrons, dtype=np.float64) * E_CHARGE) / C_F
     pH_mV = pH_V * 1e3   # Convert V to mV
-    return pH_mV
+    return _result(pH_mV)
 
 def thlDAC_to_electrons(thl_DAC, slope=0.078, intercept=1289):
-    '''Convert Threshold DAC value to number of electrons using calibration parameters'''
-    electrons = (thl_DAC - intercept) / slope
-    return electrons
+    '''Convert Threshold DAC value to number of electrons using calibration parameters (scalars or per-pixel maps)'''
+    electrons = (np.asarray(thl_DAC, dtype=np.float64) - intercept) / slope
+    return _result(electrons)
 
 def electrons_to_thlDAC(electrons, slope=0.078, intercept=1289):
-    '''Convert number of electrons to Threshold DAC value using calibration parameters'''
-    thl_DAC = (electrons * slope) + intercept
-    return thl_DAC
+    '''Convert number of electrons to Threshold DAC value using calibration parameters (scalars or per-pixel maps)'''
+    thl_DAC = (np.asarray(electrons, dtype=np.float64) * slope) + intercept
+    return _result(thl_DAC)
 
 def vtpDAC_to_electrons(vtpF_DAC, vtpC_DAC, C_fF=3.0):
     '''Convert VTP Fine and Coarse DAC values to number of electrons'''
-    total_vtp_mV = (vtpF_DAC * VTP_DAC_STEP_MV) - (vtpC_DAC * 2 * VTP_DAC_STEP_MV)
+    total_vtp_mV = (np.asarray(vtpF_DAC, dtype=np.float64) * VTP_DAC_STEP_MV) - (np.asarray(vtpC_DAC, dtype=np.float64) * 2 * VTP_DAC_STEP_MV)
     electrons = vtp_to_electrons(total_vtp_mV, C_fF)
     return electrons
 
 def electrons_to_vtpFDAC(electrons, vtpC_DAC=100, C_fF=3.0):
-    '''Convert number of electrons to VTP Fine DAC value given Coarse DAC value'''
+    '''Convert number of electrons to VTP Fine DAC value given Coarse DAC value. Returns (vtpF_DAC, out_of_range):
+    values outside 0-VTPF_DAC_MAX (consider changing the Coarse DAC) and non-finite inputs are flagged in
+    out_of_range, their DAC value is clipped to the range (0 for NaN) so the rest of an array stays usable.'''
     total_vtp_mV = electrons_to_vtp(electrons, C_fF)
-    vtpF_DAC = (total_vtp_mV + (vtpC_DAC * 2 * VTP_DAC_STEP_MV)) / VTP_DAC_STEP_MV
-    if 511 < vtpF_DAC < 0:
-        raise ValueError("Calculated VTP Fine DAC value out of range (0-511), consider changing VTP Coarse DAC value.")
-    else:
-        return int(round(vtpF_DAC))
-    
\ No newline at end of file
+    vtpF_DAC = np.rint((total_vtp_mV + (np.asarray(vtpC_DAC, dtype=np.float64) * 2 * VTP_DAC_STEP_MV)) / VTP_DAC_STEP_MV)
+    with np.errstate(invalid="ignore"):
+        out_of_range = ~np.isfinite(vtpF_DAC) | (vtpF_DAC < 0) | (vtpF_DAC > VTPF_DAC_MAX)
+    vtpF_DAC = np.clip(np.nan_to_num(vtpF_DAC, nan=0.0), 0, VTPF_DAC_MAX).astype(np.int64)
+    if not np.ndim(vtpF_DAC):
+        return int(vtpF_DAC), bool(out_of_range)
+    return vtpF_DAC, out_of_range
+
+def electrons_to_tot(electrons, a, b, c, t):
+    '''ToT surrogate function a*x + b - c/(x - t) of the injected charge x (electrons); parameters can be per-pixel maps'''
+    x = np.asarray(electrons, dtype=np.float64)
+    return _result(a * x + b - c / (x - t))
+
+def tot_to_electrons(tot, a, b, c, t):
+    '''Invert the ToT surrogate function: the charge (electrons) above the pole t that gives this ToT'''
+    tot = np.asarray(tot, dtype=np.float64)
+    a = np.asarray(a, dtype=np.float64)
+    p = b - a * t - tot # a*x^2 + p*x + q = 0
+    q = t * (tot - b) - c
+    with np.errstate(invalid="ignore", divide="ignore"):
+        electrons = (-p + np.sqrt(p * p - 4 * a * q)) / (2 * a)
+    return _result(electrons)
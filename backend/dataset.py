@@ -0,0 +1,213 @@
+#backend/dataset.py
+'''Out-of-core analysis of many interpreted runs: a directory or glob of hit Parquet files is streamed run by run
+
+Only the hit columns are read and the ToT range and time window are pushed down to the Parquet scan, so row
+groups outside the time window (the files are ToA-ordered) are skipped without being decoded. Every run is
+clustered batch by batch and reduced to fixed-size spectra, so memory stays bounded by one batch whatever the
+number and size of the runs. Spectra are summed per source (55Fe, Cu, Mo, ... taken from the parent directory
+name unless given explicitly) for combined fits.'''
+
+import csv
+import glob
+import os
+import time
+
+import numpy as np
+import pyarrow.dataset as ds
+
+from backend.jobs import log, JobStats
+from backend.analysis import BATCH_ROWS, HIT_COLUMNS, RADIUS, Clusterer
+from backend.follow import PART_NAME
+from backend.interpretation import TOA_NS
+from backend.resultcache import CACHE_DIR
+from backend.livehist import (TOT_BINS, CLUSTER_TOT_BINS, CLUSTER_TOT_MAX, CLUSTER_CHARGE_BINS, CLUSTER_CHARGE_MAX_E,
+                              MIN_PEAK_SIZE, hist_peak)
+
+SPECTRA_NAME = "spectra.npz"
+RUNS_NAME = "runs.csv"
+SOURCES_NAME = "sources.csv"
+
+
+def find_runs(source):
+    '''Hit Parquet files of a directory (recursively) or of a glob pattern. Cluster and result cache files are left
+    out; the hits-NNNNN parts of a follow-mode output directory are one run, given as the directory.'''
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, "**", "*.parquet"), recursive=True)
+    else:
+        paths = glob.glob(source, recursive=True)
+    runs = set()
+    for path in paths:
+        name = os.path.basename(path)
+        if CACHE_DIR in os.path.normpath(path).split(os.sep)[:-1] or name.endswith("_clusters.parquet") or name.startswith("clusters-"):
+            continue
+        runs.add(os.path.dirname(path) if PART_NAME.fullmatch(name) else path)
+    return sorted(runs)
+
+
+def run_files(run):
+    '''Parquet files of a run from find_runs(): the file itself, or the hit parts of a follow-mode directory'''
+    if os.path.isdir(run):
+        return sorted(os.path.join(run, name) for name in os.listdir(run) if PART_NAME.fullmatch(name) and name.startswith("hits-"))
+    return [run]
+
+
+def run_source(path, sources=None):
+    '''Source label of a run: sources[run name] if given, else the name of the directory holding the file'''
+    run = os.path.splitext(os.path.basename(path))[0]
+    if sources and run in sources:
+        return sources[run]
+    return os.path.basename(os.path.dirname(os.path.abspath(path))) or "unknown"
+
+
+def hit_filter(tot_range=None, time_window=None):
+    '''Dataset filter expression for a ToT range [min, max] and a time window [start, stop) in seconds of detector time'''
+    expression = None
+    conditions = []
+    if tot_range is not None:
+        low, high = tot_range
+        if low is not None:
+            conditions.append(ds.field("tot") >= low)
+        if high is not None:
+            conditions.append(ds.field("tot") <= high)
+    if time_window is not None:
+        start, stop = time_window
+        if start is not None:
+            conditions.append(ds.field("toa") >= int(start * 1e9 / TOA_NS))
+        if stop is not None:
+            conditions.append(ds.field("toa") < int(stop * 1e9 / TOA_NS))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def iter_filtered_batches(path, expression=None, batch_rows=BATCH_ROWS, columns=HIT_COLUMNS):
+    '''Dicts of NumPy columns from one run (see run_files), read with column projection and the filter pushed down to the scan'''
+    scanner = ds.dataset(run_files(path), format="parquet").scanner(columns=columns, filter=expression, batch_size=batch_rows, use_threads=False)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield {name: column.to_numpy() for name, column in zip(batch.schema.names, batch.columns)}
+
+
+class RunSpectra:
+    '''Fixed-size accumulators of one run (or the sum of several): hit ToT, cluster ToT sum and cluster charge'''
+
+    def __init__(self):
+        self.tot_hist = np.zeros(TOT_BINS, dtype=np.int64)
+        self.cluster_tot_hist = np.zeros(CLUSTER_TOT_BINS, dtype=np.int64)
+        self.cluster_charge_hist = np.zeros(CLUSTER_CHARGE_BINS, dtype=np.int64)
+        self.hits = 0
+        self.clusters = 0
+        self.sizes = 0 # Sum of cluster sizes of the clusters used for the spectra
+
+    def add_hits(self, hits):
+        self.tot_hist += np.bincount(np.minimum(hits["tot"], TOT_BINS - 1), minlength=TOT_BINS)
+        self.hits += len(hits["tot"])
+
+    def add_clusters(self, clusters):
+        if clusters is None:
+            return
+        self.clusters += len(clusters["size"])
+        big = clusters["size"] >= MIN_PEAK_SIZE # Noise and fragments stay out of the peak spectra
+        tot_bins = np.minimum(clusters["tot_sum"][big] * CLUSTER_TOT_BINS // CLUSTER_TOT_MAX, CLUSTER_TOT_BINS - 1).astype(np.intp)
+        self.cluster_tot_hist += np.bincount(tot_bins, minlength=CLUSTER_TOT_BINS)
+        charge = clusters["charge_sum"][big]
+        charge = charge[np.isfinite(charge)]
+        charge_bins = np.clip(charge * (CLUSTER_CHARGE_BINS / CLUSTER_CHARGE_MAX_E), 0, CLUSTER_CHARGE_BINS - 1).astype(np.intp)
+        self.cluster_charge_hist += np.bincount(charge_bins, minlength=CLUSTER_CHARGE_BINS)
+        self.sizes += int(clusters["size"].sum())
+
+    def merge(self, other):
+        for name in ("tot_hist", "cluster_tot_hist", "cluster_charge_hist"):
+            getattr(self, name)[:] += getattr(other, name)
+        self.hits += other.hits
+        self.clusters += other.clusters
+        self.sizes += other.sizes
+
+    def summary(self):
+        '''Counts and the main cluster peak (charge if calibrated, else ToT sum)'''
+        if self.cluster_charge_hist.any():
+            peak, resolution = hist_peak(self.cluster_charge_hist, np.linspace(0, CLUSTER_CHARGE_MAX_E, CLUSTER_CHARGE_BINS + 1))
+            unit = "e-"
+        else:
+            peak, resolution = hist_peak(self.cluster_tot_hist, np.linspace(0, CLUSTER_TOT_MAX, CLUSTER_TOT_BINS + 1))
+            unit = "ToT"
+        return {
+            "hits": self.hits,
+            "clusters": self.clusters,
+            "hits_per_cluster": self.hits / self.clusters if self.clusters else float("nan"),
+            "peak": peak,
+            "peak_unit": unit,
+            "fwhm_resolution": resolution,
+        }
+
+
+def analyze_run(path, expression=None, clustering_gap=50, radius=RADIUS, calibration=None, stats=None):
+    '''Cluster one run (a hit file or follow-mode directory) batch by batch and return its RunSpectra'''
+    stats = stats or JobStats(enabled=False)
+    spectra = RunSpectra()
+    clusterer = Clusterer(clustering_gap, radius, calibration)
+    for hits in stats.timed("read", iter_filtered_batches(path, expression)):
+        spectra.add_hits(hits)
+        with stats.stage("cluster"):
+            spectra.add_clusters(clusterer.push(hits))
+    with stats.stage("cluster"):
+        spectra.add_clusters(clusterer.flush())
+    return spectra
+
+
+def _write_csv(path, rows):
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ["run"])
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+def run_dataset_analysis(source, output_dir="dataset_analysis", tot_range=None, time_window=None, clustering_gap=50,
+                         radius=RADIUS, calibration=None, sources=None, job=None):
+    '''Job target: cluster every run of a directory or glob of interpreted hit files out-of-core and aggregate the
+    spectra per run and per source. tot_range: [min, max] ToT, time_window: [start, stop) s of detector time (either
+    end may be None). Writes runs.csv, sources.csv and spectra.npz (the per-source spectra) to output_dir.'''
+    stats = job.stats if job is not None else JobStats(enabled=False)
+    paths = find_runs(source)
+    if not paths:
+        raise FileNotFoundError(f"No interpreted hit files in {source}")
+    if isinstance(calibration, (str, os.PathLike)):
+        calibration = np.load(calibration)
+    expression = hit_filter(tot_range, time_window)
+    log(f"dataset: {len(paths)} runs from {source}" + (f", filter {expression}" if expression is not None else ""))
+
+    t0 = time.perf_counter()
+    runs, by_source = [], {}
+    for k, path in enumerate(paths):
+        if job is not None:
+            job.check()
+        spectra = analyze_run(path, expression, clustering_gap, radius, calibration, stats)
+        label = run_source(path, sources)
+        by_source.setdefault(label, RunSpectra()).merge(spectra)
+        row = {"run": os.path.splitext(os.path.basename(path))[0], "source": label, "path": path} | spectra.summary()
+        runs.append(row)
+        log(f"dataset: {row['run']} ({label}) → {row['hits']} hits, {row['clusters']} clusters", level="DEBUG",
+            hits=row["hits"], clusters=row["clusters"])
+        if job is not None:
+            job.progress((k + 1) / len(paths), f"{k + 1}/{len(paths)} runs")
+    stats.count(runs=len(paths), hits=sum(row["hits"] for row in runs))
+
+    sources_rows = [{"source": label, "runs": sum(row["source"] == label for row in runs)} | spectra.summary()
+                    for label, spectra in sorted(by_source.items())]
+    os.makedirs(output_dir, exist_ok=True)
+    with stats.stage("write"):
+        _write_csv(os.path.join(output_dir, RUNS_NAME), runs)
+        _write_csv(os.path.join(output_dir, SOURCES_NAME), sources_rows)
+        arrays = {}
+        for label, spectra in by_source.items():
+            for name in ("tot_hist", "cluster_tot_hist", "cluster_charge_hist"):
+                arrays[f"{label}/{name}"] = getattr(spectra, name)
+        tmp = os.path.join(output_dir, f".{SPECTRA_NAME}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, os.path.join(output_dir, SPECTRA_NAME))
+    dt = time.perf_counter() - t0
+    log(f"dataset: {len(paths)} runs, {len(by_source)} sources in {dt:.1f} s → {output_dir}", runs=len(paths), seconds=dt)
+    return {"source": str(source), "output_dir": str(output_dir), "seconds": dt, "runs": runs, "sources": sources_rows}
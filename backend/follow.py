@@ -0,0 +1,160 @@
+#backend/follow.py
+'''Follow mode: incremental interpretation + clustering of a raw file that the DAQ is still writing'''
+
+import os
+import re
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from backend.jobs import log
+from backend.interpretation import CHUNK_WORDS, HitDecoder, OrderedHitWriter, hits_to_table, iter_raw_chunks
+from backend.analysis import CLUSTER_SCHEMA, RADIUS, Clusterer
+from backend.livehist import LiveHistograms
+
+SNAPSHOT_NAME = "live.npz" # Histogram snapshot in output_dir, rewritten after every pass
+PART_NAME = re.compile(r"(hits|clusters)-\d{5}\.parquet") # Part files written by every pass
+
+followers = {} # input_path -> RunFollower of the runs being followed, read by the dashboard for live plots
+_followers_lock = threading.Lock()
+
+
+class RunFollower:
+    '''Remembers where the last pass stopped (byte offset, decoder, ToA merge and clustering state) so each
+    poll() only decodes the bytes appended since. Every pass writes its hits and completed clusters as new
+    part files in output_dir (readable as one dataset), updates the running histograms and saves their snapshot.
+    The parts and snapshot of an earlier follow into the same output_dir are removed first, so the dataset holds one run.'''
+
+    def __init__(self, input_path, output_dir, clustering_gap=50, radius=RADIUS):
+        self.input_path = input_path
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self._clear_output()
+        self.offset_words = 0
+        self.decoder = HitDecoder()
+        self.ordered = OrderedHitWriter(self._add_hits)
+        self.clusterer = Clusterer(clustering_gap, radius)
+        self.n_parts = 0
+        self.stop_event = threading.Event()
+        self.histograms = LiveHistograms()
+        self.snapshot_path = os.path.join(output_dir, SNAPSHOT_NAME)
+        self.last_pass = None
+
+        self._hit_tables = []
+        self._cluster_tables = []
+
+    def _clear_output(self):
+        old = [name for name in os.listdir(self.output_dir) if PART_NAME.fullmatch(name) or name == SNAPSHOT_NAME]
+        for name in old:
+            os.remove(os.path.join(self.output_dir, name))
+        if old:
+            log(f"follow: removed {len(old)} files of an earlier follow from {self.output_dir}")
+
+    def _add_hits(self, hits):
+        '''Sink of the ToA merge: hits are final here, feed histograms and the clusterer'''
+        self._hit_tables.append(hits_to_table(hits))
+        self.histograms.add_hits(hits)
+        self._add_clusters(self.clusterer.push(hits))
+
+    def _add_clusters(self, clusters):
+        if clusters is None:
+            return
+        self._cluster_tables.append(pa.Table.from_pydict(clusters, schema=CLUSTER_SCHEMA))
+        self.histograms.add_clusters(clusters)
+
+    @property
+    def n_hits(self):
+        return self.histograms.n_hits
+
+    @property
+    def n_clusters(self):
+        return self.histograms.n_clusters
+
+    def _write_part(self):
+        '''Write what this pass produced as the next part file pair'''
+        if self._hit_tables:
+            pq.write_table(pa.concat_tables(self._hit_tables), os.path.join(self.output_dir, f"hits-{self.n_parts:05d}.parquet"), compression="zstd")
+        if self._cluster_tables:
+            pq.write_table(pa.concat_tables(self._cluster_tables), os.path.join(self.output_dir, f"clusters-{self.n_parts:05d}.parquet"), compression="zstd")
+        if self._hit_tables or self._cluster_tables:
+            self.n_parts += 1
+        self._hit_tables, self._cluster_tables = [], []
+
+    def poll(self):
+        '''Process the bytes appended since the last pass. Returns the number of new bytes decoded.'''
+        n_words = os.path.getsize(self.input_path) // 8 # A half-written packet at the end waits for the next pass
+        if n_words <= self.offset_words:
+            return 0
+        t0 = time.perf_counter()
+        for words in iter_raw_chunks(self.input_path, CHUNK_WORDS, self.offset_words, n_words):
+            self.ordered.push(self.decoder.decode(words))
+        new_bytes = (n_words - self.offset_words) * 8
+        self.offset_words = n_words
+        self._write_part()
+        self.histograms.save(self.snapshot_path)
+        self.last_pass = {"bytes": new_bytes, "seconds": time.perf_counter() - t0, "time": time.time()}
+        return new_bytes
+
+    def finish(self):
+        '''Flush the held-back hits and the open event once the file is complete'''
+        self.ordered.flush()
+        self._add_clusters(self.clusterer.flush())
+        self._write_part()
+        self.histograms.save(self.snapshot_path)
+
+    def snapshot(self):
+        '''Copies of the running histograms for the dashboard'''
+        return self.histograms.snapshot() | {"bytes": self.offset_words * 8, "last_pass": self.last_pass}
+
+
+def run_follow(input_path, output_dir, clustering_gap=50, radius=RADIUS, poll_interval=1.0, idle_timeout=60.0, job=None):
+    '''Job target: follow a growing raw file until it has not grown for idle_timeout seconds, stop_follow() is called
+    or the job is cancelled. All three end the run cleanly: the remaining hits and the open event are written out.
+    A file that is already followed, or an output_dir another follower writes to, is refused (ValueError).'''
+    with _followers_lock:
+        if input_path in followers:
+            raise ValueError(f"{input_path} is already being followed")
+        if any(os.path.abspath(other.output_dir) == os.path.abspath(output_dir) for other in followers.values()):
+            raise ValueError(f"{output_dir} is already written by another follower")
+        follower = RunFollower(input_path, output_dir, clustering_gap, radius)
+        followers[input_path] = follower
+    try:
+        return _follow(follower, poll_interval, idle_timeout, job)
+    finally:
+        with _followers_lock:
+            followers.pop(input_path, None)
+
+
+def _follow(follower, poll_interval, idle_timeout, job):
+    '''Poll loop of run_follow'''
+    input_path, output_dir = follower.input_path, follower.output_dir
+    log(f"follow: watching {input_path} → {output_dir}")
+
+    last_growth = time.monotonic()
+    while not follower.stop_event.is_set() and not (job is not None and job.cancelled()):
+        if os.path.exists(input_path) and follower.poll():
+            last_growth = time.monotonic()
+            p = follower.last_pass
+            log(f"follow: +{p['bytes'] / 1e6:.1f} MB in {p['seconds']:.2f} s, {follower.n_hits} hits, {follower.n_clusters} clusters",
+                level="DEBUG", bytes=p["bytes"], seconds=p["seconds"], hits=follower.n_hits, clusters=follower.n_clusters)
+            if job is not None:
+                job.progress(0.0, f"{follower.offset_words * 8 / 1e6:.1f} MB, {follower.n_hits} hits")
+        elif time.monotonic() - last_growth > idle_timeout:
+            log(f"follow: {input_path} idle for {idle_timeout:.0f} s, stopping")
+            break
+        follower.stop_event.wait(poll_interval)
+
+    if os.path.exists(input_path):
+        follower.poll()
+    follower.finish()
+    log(f"follow: done, {follower.n_hits} hits, {follower.n_clusters} clusters in {follower.n_parts} parts")
+    return follower.snapshot() | {"output_dir": output_dir}
+
+
+def stop_follow(input_path):
+    with _followers_lock:
+        follower = followers.get(input_path)
+    if follower is not None:
+        follower.stop_event.set()
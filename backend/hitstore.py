@@ -0,0 +1,192 @@
+#backend/hitstore.py
+'''Compact binary hit files with random access by time
+
+<name>.hits holds ToA-ordered hits as fixed-width packed records (HIT_DTYPE, 13 bytes per hit), in chunks of
+CHUNK_HITS hits. <name>.hits.idx.npy is the sidecar index: one INDEX_DTYPE row per chunk with its byte range,
+number of hits, ToA range and compression. Uncompressed chunks are read as zero-copy views of a numpy.memmap of
+the data file; zstd-compressed chunks (about 3x smaller) are decompressed one chunk at a time. A time-window query
+binary-searches the index and touches only the chunks overlapping the window, so showing one cluster of a
+multi-GB run reads one or two chunks.'''
+
+import os
+import uuid
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+HIT_DTYPE = np.dtype([("chip", "u1"), ("col", "u1"), ("row", "u1"), ("toa", "<u8"), ("tot", "<u2")]) # Packed, no padding
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),# Byte offset of the chunk in the data file
+    ("nbytes", "<u8"),# Stored size (compressed size for compressed chunks)
+    ("n_hits", "<u8"),
+    ("toa_min", "<u8"),
+    ("toa_max", "<u8"),
+    ("compressed", "u1"),
+])
+CHUNK_HITS = 1 << 18 # 3.25 MB per uncompressed chunk
+COMPRESSION = "zstd"
+INDEX_SUFFIX = ".idx.npy"
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def to_records(hits):
+    '''Packed record array from a dict of hit columns (chip defaults to 0)'''
+    records = np.empty(len(hits["toa"]), dtype=HIT_DTYPE)
+    for name in HIT_DTYPE.names:
+        records[name] = hits[name] if name in hits else 0
+    return records
+
+
+class HitWriter:
+    '''Append ToA-ordered hit blocks; chunks of chunk_hits records are written as they fill up. The data file and
+    the index only appear under their names on close(), so readers never see a half-written run.'''
+
+    def __init__(self, path, chunk_hits=CHUNK_HITS, compress=False):
+        self.path = path
+        self.chunk_hits = chunk_hits
+        self.compress = compress
+        self.tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.part"
+        self._file = open(self.tmp_path, "wb")
+        self._pending = []
+        self._n_pending = 0
+        self._index = []
+        self.n_hits = 0
+
+    def write(self, hits):
+        '''Add a block of hits (dict of columns or HIT_DTYPE records), in ToA order after the previous blocks'''
+        records = hits if isinstance(hits, np.ndarray) else to_records(hits)
+        if not len(records):
+            return
+        self._pending.append(records)
+        self._n_pending += len(records)
+        self.n_hits += len(records)
+        if self._n_pending >= self.chunk_hits:
+            pending = np.concatenate(self._pending)
+            full = len(pending) // self.chunk_hits * self.chunk_hits
+            for start in range(0, full, self.chunk_hits):
+                self._write_chunk(pending[start:start + self.chunk_hits])
+            self._pending = [pending[full:]]
+            self._n_pending = len(pending) - full
+
+    def _write_chunk(self, records):
+        data = records.tobytes()
+        if self.compress:
+            data = pa.compress(data, codec=COMPRESSION, asbytes=True)
+        self._index.append((self._file.tell(), len(data), len(records), records["toa"][0], records["toa"][-1], self.compress))
+        self._file.write(data)
+
+    def close(self):
+        if self._n_pending:
+            self._write_chunk(np.concatenate(self._pending))
+        self._pending, self._n_pending = [], 0
+        self._file.close()
+        index = np.array(self._index, dtype=INDEX_DTYPE)
+        tmp_index = f"{index_path(self.path)}.{uuid.uuid4().hex[:8]}.part"
+        with open(tmp_index, "wb") as f:
+            np.save(f, index)
+        os.replace(self.tmp_path, self.path)
+        os.replace(tmp_index, index_path(self.path))
+
+    def abort(self):
+        '''Drop everything written so far'''
+        self._file.close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class HitStore:
+    '''Read access to a .hits file: chunks by number, hits by time window, the hits of one cluster'''
+
+    def __init__(self, path):
+        self.path = path
+        self.index = np.load(index_path(path))
+        size = os.path.getsize(path)
+        self._data = np.memmap(path, dtype=np.uint8, mode="r") if size else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return int(self.index["n_hits"].sum())
+
+    @property
+    def n_chunks(self):
+        return len(self.index)
+
+    def chunk(self, i):
+        '''Records of chunk i: a view into the memory map, or a decompressed copy'''
+        entry = self.index[i]
+        start, stop = int(entry["offset"]), int(entry["offset"] + entry["nbytes"])
+        if entry["compressed"]:
+            raw = pa.decompress(self._data[start:stop], decompressed_size=int(entry["n_hits"]) * HIT_DTYPE.itemsize,
+                                codec=COMPRESSION, asbytes=True)
+            return np.frombuffer(raw, dtype=HIT_DTYPE)
+        return self._data[start:stop].view(HIT_DTYPE)
+
+    def chunks_for(self, toa_start, toa_stop):
+        '''Numbers of the chunks that can hold hits with toa_start <= toa < toa_stop'''
+        first = np.searchsorted(self.index["toa_max"], toa_start, side="left")
+        stop = np.searchsorted(self.index["toa_min"], toa_stop, side="left")
+        return range(int(first), int(max(stop, first)))
+
+    def query(self, toa_start, toa_stop):
+        '''Hits with toa_start <= toa < toa_stop (ToA in TOA_NS units), reading only the overlapping chunks'''
+        parts = []
+        for i in self.chunks_for(toa_start, toa_stop):
+            records = self.chunk(i)
+            lo, hi = np.searchsorted(records["toa"], [toa_start, toa_stop])
+            parts.append(records[lo:hi])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=HIT_DTYPE)
+
+    def cluster_hits(self, cluster, margin=0, radius=None):
+        '''Hits of one cluster (a row of a *_clusters.parquet file as a dict: toa_start, toa_span, size and centroid)
+        for an event display. All hits of the cluster lie in its time window and, within it, in one time group, so
+        the cluster is the group of window hits connected through radius x radius cells (the clustering's radius,
+        default analysis.RADIUS) with the cluster's size and centroid. margin > 0 adds the other hits of the window
+        within margin pixels of the cluster's bounding box, as context.'''
+        from backend.analysis import RADIUS, label_hits # Imported here: backend.analysis depends on this module
+        toa_start = int(cluster["toa_start"])
+        hits = self.query(toa_start, toa_start + int(cluster["toa_span"]) + 1)
+        if not len(hits):
+            return hits
+        group, n_groups = label_hits(hits["col"], hits["row"], hits["toa"], np.iinfo(np.int64).max, radius or RADIUS)
+        size = np.bincount(group, minlength=n_groups)
+        col = np.bincount(group, hits["col"], n_groups) / size
+        row = np.bincount(group, hits["row"], n_groups) / size
+        distance = np.hypot(col - float(cluster["col_centroid"]), row - float(cluster["row_centroid"]))
+        distance[size != int(cluster["size"])] += np.inf
+        own = group == np.argmin(distance)
+        if margin <= 0:
+            return hits[own]
+        col, row = hits["col"].astype(np.int64), hits["row"].astype(np.int64)
+        near = ((col >= col[own].min() - margin) & (col <= col[own].max() + margin)
+                & (row >= row[own].min() - margin) & (row <= row[own].max() + margin))
+        return hits[own | near]
+
+
+def read_cluster(clusters_path, i):
+    '''Row i of a *_clusters.parquet file as a dict, reading only the row group that holds it'''
+    with pq.ParquetFile(clusters_path) as f:
+        for group in range(f.num_row_groups):
+            n = f.metadata.row_group(group).num_rows
+            if i < n:
+                return f.read_row_group(group).slice(i, 1).to_pylist()[0]
+            i -= n
+    raise IndexError("cluster index out of range")
+
+
+def convert(parquet_path, hits_path, chunk_hits=CHUNK_HITS, compress=False):
+    '''Write an interpreted hit Parquet file as a .hits file. Returns the number of hits.'''
+    with HitWriter(hits_path, chunk_hits, compress) as writer, pq.ParquetFile(parquet_path) as f:
+        for batch in f.iter_batches(columns=list(HIT_DTYPE.names)):
+            writer.write({name: column.to_numpy() for name, column in zip(batch.schema.names, batch.columns)})
+    return writer.n_hits
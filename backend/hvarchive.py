@@ -0,0 +1,247 @@
+#backend/hvarchive.py
+'''Indexed archive of all HV ramp logs
+
+ingest() parses every hv_log_*.csv (header metadata + rows) into two Parquet tables under <log_dir>/.index/:
+sessions.parquet (one row per log file) and events.parquet (all rows, sorted by session and time). Files are
+re-parsed only when their mtime or size changed. HVArchive keeps the tables in memory for fast queries.'''
+
+import csv
+import glob
+import os
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from backend.jobs import log
+from backend.hvlog import LOG_PATTERN, recover_logs
+
+LOG_DIR = "hv_ramp_logs"
+INDEX_DIR = ".index"
+INDEX_VERSION = b"2" # Bumped when parsing changes (2: max_step from operator switch-ons); older indexes are rebuilt
+RAMP_CHANNELS = ("CH1", "CH2", "CH3")
+VOLTAGE_COLUMN = {"CH3": 0, "CH2": 1, "CH1": 2} # Channel -> index in (Vgrid, Vanode, Vcathode)
+
+SESSION_SCHEMA = pa.schema([
+    ("session", pa.string()),# Log file name
+    ("start_time", pa.timestamp("ms")),
+    ("end_time", pa.timestamp("ms")),
+    ("operator", pa.string()),
+    ("setup", pa.string()),
+    ("max_step", pa.int16()),# Highest ramp step with a channel switched on by the operator, -1 if none
+    ("n_rows", pa.int32()),
+    ("mtime", pa.float64()),
+    ("size", pa.int64()),
+])
+
+EVENT_SCHEMA = pa.schema([
+    ("session", pa.string()),# Parquet dictionary-encodes the repeated names on disk
+    ("timestamp", pa.timestamp("ms")),
+    ("step", pa.int16()),
+    ("channel", pa.string()),
+    ("checked", pa.bool_()),
+    ("Vgrid", pa.float32()),
+    ("Vanode", pa.float32()),
+    ("Vcathode", pa.float32()),
+    ("note", pa.string()),
+])
+
+HEADER_FIELDS = {"# Start time:": "start_time", "# Operator(s):": "operator", "# Setup:": "setup"}
+
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def manual_switch_on(session, step, channel, checked, voltages):
+    '''Mask of the rows where the operator switched a channel on: checked ramp-channel rows of a channel whose
+    voltage changes at that step. The UI auto-checks the channels that keep their voltage, those rows are not
+    operator actions and say nothing about when a step was reached.
+
+    session: integer code per row, voltages: (n, 3) step targets of each row. The change is taken against the
+    targets of the closest lower step logged in the same session (0 V if there is none); plan voltages only
+    grow with the step, so a skipped step in between does not hide a change.'''
+    step = np.asarray(step, dtype=np.int64)
+    channel = np.asarray(channel, dtype="U8")
+    ramp = np.isin(channel, RAMP_CHANNELS)
+    on = ramp & (pa.array(checked, pa.bool_()).fill_null(False).to_numpy(zero_copy_only=False))
+    if not on.any():
+        return on
+    session = np.asarray(session, dtype=np.int64)
+    key = session * 65536 + step + 32768
+    keys, first = np.unique(key[ramp], return_index=True)
+    targets = np.asarray(voltages, dtype=np.float64)[ramp][first]
+    column = np.zeros(len(step), dtype=np.intp)
+    for name, index in VOLTAGE_COLUMN.items():
+        column[channel == name] = index
+    lower = np.searchsorted(keys, key) - 1 # Closest lower logged step
+    known = (lower >= 0) & (keys[np.maximum(lower, 0)] // 65536 == session)
+    previous = np.where(known, targets[np.maximum(lower, 0), column], 0.0)
+    current = np.asarray(voltages, dtype=np.float64)[np.arange(len(step)), column]
+    return on & (current != previous)
+
+
+def parse_log(path):
+    '''Parse one hv_log CSV into (session dict, event column dict). Torn or malformed rows are skipped.'''
+    meta = {"start_time": None, "operator": "", "setup": ""}
+    events = {name: [] for name in EVENT_SCHEMA.names if name != "session"}
+    with open(path, newline="") as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            for prefix, field in HEADER_FIELDS.items():
+                if line.startswith(prefix):
+                    meta[field] = line[len(prefix):].strip()
+        for row in csv.reader(f):# The column header line has been consumed by the loop above
+            if len(row) != 8:
+                continue
+            try:
+                timestamp = datetime.fromisoformat(row[0])
+                step = int(row[1])
+            except ValueError:
+                continue
+            events["timestamp"].append(timestamp)
+            events["step"].append(step)
+            events["channel"].append(row[2])
+            events["checked"].append({"True": True, "False": False}.get(row[3]))
+            events["Vgrid"].append(_float(row[4]))
+            events["Vanode"].append(_float(row[5]))
+            events["Vcathode"].append(_float(row[6]))
+            events["note"].append(row[7])
+
+    n = len(events["step"])
+    voltages = np.stack([pa.array(events[name], pa.float64()).to_numpy(zero_copy_only=False) for name in ("Vgrid", "Vanode", "Vcathode")], axis=1)
+    manual = manual_switch_on(np.zeros(n), events["step"], events["channel"], events["checked"], voltages)
+    steps = np.asarray(events["step"])[manual] if n else []
+    stat = os.stat(path)
+    session = {
+        "session": os.path.basename(path),
+        "start_time": datetime.fromisoformat(meta["start_time"]) if meta["start_time"] else None,
+        "end_time": max(events["timestamp"]) if events["timestamp"] else None,
+        "operator": meta["operator"],
+        "setup": meta["setup"],
+        "max_step": int(steps.max()) if len(steps) else -1,
+        "n_rows": len(events["step"]),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+    }
+    return session, events
+
+
+def _events_table(session_name, events):
+    n = len(events["step"])
+    columns = dict(events, session=[session_name] * n)
+    table = pa.Table.from_pydict({name: columns[name] for name in EVENT_SCHEMA.names})
+    return table.cast(EVENT_SCHEMA)
+
+
+def ingest(log_dir=LOG_DIR):
+    '''Bring the index of log_dir up to date. Returns the number of (re)parsed files.'''
+    index_dir = os.path.join(log_dir, INDEX_DIR)
+    sessions_path = os.path.join(index_dir, "sessions.parquet")
+    events_path = os.path.join(index_dir, "events.parquet")
+    os.makedirs(index_dir, exist_ok=True)
+
+    known = {}
+    indexed = os.path.exists(sessions_path) and os.path.exists(events_path)
+    if indexed:
+        old_sessions = pq.read_table(sessions_path)
+        indexed = (old_sessions.schema.metadata or {}).get(b"index_version") == INDEX_VERSION
+    if indexed:
+        known = {s["session"]: s for s in old_sessions.to_pylist()}
+        old_events = pq.read_table(events_path)
+    else:
+        old_events = EVENT_SCHEMA.empty_table()
+
+    for path, dropped in recover_logs(log_dir).items():
+        log(f"hv archive: cut a torn last line ({dropped} bytes) off {path}", level="WARNING")
+    files = {os.path.basename(p): p for p in glob.glob(os.path.join(log_dir, LOG_PATTERN))}
+    keep, parsed_sessions, parsed_events = [], [], []
+    for name, path in sorted(files.items()):
+        stat = os.stat(path)
+        previous = known.get(name)
+        if previous is not None and previous["mtime"] == stat.st_mtime and previous["size"] == stat.st_size:
+            keep.append(name)
+            continue
+        session, events = parse_log(path)
+        parsed_sessions.append(session)
+        parsed_events.append(_events_table(name, events))
+
+    if indexed and not parsed_sessions and len(keep) == len(known):
+        return 0 # Index is current (no new, changed or deleted files)
+
+    kept_sessions = [known[name] for name in keep]
+    kept_events = old_events.filter(pc.is_in(old_events["session"], pa.array(keep, pa.string())))
+    sessions = pa.Table.from_pylist(kept_sessions + parsed_sessions, schema=SESSION_SCHEMA).sort_by("start_time")
+    sessions = sessions.replace_schema_metadata({b"index_version": INDEX_VERSION})
+    events = pa.concat_tables([kept_events.cast(EVENT_SCHEMA)] + parsed_events)
+    events = events.sort_by([("session", "ascending"), ("timestamp", "ascending")])
+
+    for table, path in ((sessions, sessions_path), (events, events_path)):
+        tmp = path + ".tmp"
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, path)
+    log(f"hv archive: indexed {len(parsed_sessions)} new/changed log(s), {sessions.num_rows} sessions, {events.num_rows} rows")
+    return len(parsed_sessions)
+
+
+class HVArchive:
+    '''In-memory view of the index with the common queries'''
+
+    def __init__(self, log_dir=LOG_DIR, update=True):
+        if update:
+            ingest(log_dir)
+        index_dir = os.path.join(log_dir, INDEX_DIR)
+        self.sessions = pq.read_table(os.path.join(index_dir, "sessions.parquet"))
+        self.events = pq.read_table(os.path.join(index_dir, "events.parquet"))
+
+    def find_sessions(self, setup=None, operator=None, min_step=None, since=None):
+        '''Sessions whose setup/operator contain the given text (case-insensitive), that reached min_step,
+        started after `since` (datetime)'''
+        mask = pa.array(np.ones(self.sessions.num_rows, dtype=bool))
+        if setup:
+            mask = pc.and_(mask, pc.match_substring(self.sessions["setup"], setup, ignore_case=True))
+        if operator:
+            mask = pc.and_(mask, pc.match_substring(self.sessions["operator"], operator, ignore_case=True))
+        if min_step is not None:
+            mask = pc.and_(mask, pc.greater_equal(self.sessions["max_step"], min_step))
+        if since is not None:
+            mask = pc.and_(mask, pc.greater_equal(self.sessions["start_time"], pa.scalar(since, pa.timestamp("ms"))))
+        return self.sessions.filter(mask)
+
+    def time_per_step(self, sessions=None):
+        '''Seconds spent per ramp step, summed over `sessions` (a table from find_sessions, default all): from the
+        step's last operator switch-on (see manual_switch_on) to that of the next step. Steps not followed by the next
+        step in the same session and non-positive intervals (steps redone out of order) are left out.
+        Returns (steps, total_seconds, n_sessions) arrays.'''
+        events = self.events
+        if sessions is not None:
+            events = events.filter(pc.is_in(events["session"], sessions["session"]))
+        events = events.filter(pc.is_in(events["channel"], pa.array(RAMP_CHANNELS)))
+        empty = np.zeros(0, dtype=np.int16), np.zeros(0), np.zeros(0, dtype=np.int64)
+        if events.num_rows == 0:
+            return empty
+        _, session = np.unique(events["session"].to_numpy(zero_copy_only=False), return_inverse=True)
+        step = events["step"].to_numpy().astype(np.int64)
+        voltages = np.stack([events[name].to_numpy(zero_copy_only=False) for name in ("Vgrid", "Vanode", "Vcathode")], axis=1)
+        manual = manual_switch_on(session, step, events["channel"].to_numpy(zero_copy_only=False),
+                                  events["checked"].to_numpy(zero_copy_only=False), voltages)
+        if not manual.any():
+            return empty
+        # Last switch-on per (session, step), ordered by session and step
+        key = session[manual] * 65536 + step[manual] + 32768
+        time_s = events["timestamp"].cast(pa.int64()).to_numpy()[manual] / 1e3
+        order = np.lexsort((time_s, key))
+        key, time_s = key[order], time_s[order]
+        last = np.r_[key[1:] != key[:-1], True]
+        key, reached = key[last], time_s[last]
+        following = np.diff(key) == 1 # Next step of the same session
+        duration = np.diff(reached)
+        use = following & (duration > 0)
+        steps, index = np.unique((key[:-1][use] % 65536 - 32768).astype(np.int16), return_inverse=True)
+        return steps, np.bincount(index, weights=duration[use]), np.bincount(index)
@@ -0,0 +1,139 @@
+#backend/hvlog.py
+'''Buffered, crash-safe HV ramp log writer
+
+One HVLogWriter per logging session keeps the CSV file open, buffers rows in memory and writes + fsyncs them
+from a background thread every flush_interval seconds (and on flush()/close()). The file is an append-only
+journal in the usual hv_log_*.csv format: a crash can at worst leave a torn last line. Every session writes a new
+file, so a starting writer (and the archive index, hvarchive.ingest) runs recover_logs() over the whole log
+directory, cutting such lines off every log that no writer of this process has open.'''
+
+import atexit
+import csv
+import glob
+import io
+import os
+import threading
+from datetime import datetime
+
+HV_LOG_COLUMNS = ["timestamp", "step", "channel", "checked", "Vgrid", "Vanode", "Vcathode", "Note"]
+FLUSH_INTERVAL_S = 1.0
+LOG_PATTERN = "hv_log_*.csv"
+
+_open_paths = set() # Absolute paths of the logs open in a writer of this process, never recovered under it
+
+
+def recover(path):
+    '''Drop a torn (newline-less) last line left by a crash. Returns the number of bytes removed.'''
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return 0
+        tail = min(size, 1 << 16)
+        f.seek(size - tail)
+        last_newline = f.read(tail).rfind(b"\n")
+        keep = size - tail + last_newline + 1 if last_newline >= 0 else 0
+        f.truncate(keep)
+        f.flush()
+        os.fsync(f.fileno())
+        return size - keep
+
+
+def recover_logs(log_dir):
+    '''recover() every log of log_dir that is not open in a writer. Returns {path: bytes removed} of the repaired ones.'''
+    repaired = {}
+    for path in sorted(glob.glob(os.path.join(log_dir, LOG_PATTERN))):
+        if os.path.abspath(path) in _open_paths:
+            continue
+        try:
+            dropped = recover(path)
+        except OSError:# Removed meanwhile, or not writable: left as it is
+            continue
+        if dropped:
+            repaired[path] = dropped
+    return repaired
+
+
+def write_header(f, start_time, operator, setup_info):
+    f.write("# HV Ramp Log\n")
+    f.write(f"# Start time: {start_time.isoformat(timespec='seconds')}\n")
+    f.write(f"# Operator(s): {operator}\n")
+    f.write(f"# Setup: {setup_info.replace(chr(10), ' | ')}\n")
+    f.write("#\n")
+    f.write(",".join(HV_LOG_COLUMNS) + "\n")
+
+
+class HVLogWriter:
+    '''Session log writer. log() only appends to an in-memory buffer, so it is cheap enough for automated
+    high-rate entries (e.g. power-supply readback every 100 ms) as well as UI events.'''
+
+    def __init__(self, path, operator="", setup_info="", flush_interval=FLUSH_INTERVAL_S):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._lock = threading.Lock() # Guards the buffer
+        self._io_lock = threading.Lock() # Serializes writes to the file
+        self._stop = threading.Event()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)# The log directory is created with the first session, not at import
+        _open_paths.add(os.path.abspath(path))
+        self.recovered_logs = recover_logs(os.path.dirname(path) or ".")# Logs of earlier sessions cut off by a crash
+        if os.path.exists(path) and os.path.getsize(path) > 0:# Re-opened session: continue the journal
+            dropped = recover(path)
+            self.recovered_bytes = dropped
+            self._file = open(path, "a", newline="")
+        else:
+            self.recovered_bytes = 0
+            self._file = open(path, "w", newline="")
+            write_header(self._file, datetime.now(), operator, setup_info)
+            self._sync()
+
+        self._thread = threading.Thread(target=self._flush_loop, name="hv-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, step, channel, checked, vgrid, vanode, vcathode, note="", timestamp=None, timespec="seconds"):
+        '''Queue one row. Automated entries can pass timespec="milliseconds" for sub-second timestamps.'''
+        timestamp = timestamp or datetime.now()
+        row = [timestamp.isoformat(timespec=timespec), f"{step:02d}", channel, checked, vgrid, vanode, vcathode, note]
+        with self._lock:
+            self._rows.append(row)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def flush(self):
+        '''Write and fsync everything buffered so far'''
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        with self._io_lock:
+            if self._file.closed:
+                return
+            self._file.write(buffer.getvalue()) # One write per batch, rows are never interleaved
+            self._sync()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        '''Flush the remaining rows and close the file (called on Stop logging and at interpreter exit)'''
+        if self._file.closed:
+            return
+        self._stop.set()
+        self.flush()
+        with self._io_lock:
+            self._file.close()
+        _open_paths.discard(os.path.abspath(self.path))
+        atexit.unregister(self.close)
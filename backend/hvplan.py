@@ -0,0 +1,156 @@
+#backend/hvplan.py
+'''HV ramp plans: the step voltages of a detector as one (n_steps, 3) array with everything the UI and the executor
+need precomputed once (checkbox disable masks, per-step voltage changes and expected durations for both directions).
+
+Alternative plans are CSV files in hv_plans/ with the columns step,Vgrid_CH3,Vanode_CH2,Vcathode_CH1. Optional
+"# key: value" header lines override the name and the limits, e.g. "# max_grid_anode_V: 120".'''
+
+import glob
+import os
+
+import numpy as np
+
+PLAN_DIR = "hv_plans"
+PLAN_COLUMNS = ("Vgrid_CH3", "Vanode_CH2", "Vcathode_CH1") # Column order of RampPlan.voltages
+CHANNEL_INDEX = {"CH3": 0, "CH2": 1, "CH1": 2}
+MAX_GRID_ANODE_V = 100 # Vanode - Vgrid, amplification field across the grid
+MAX_CATHODE_GRID_V = 2200 # Vcathode - Vgrid, drift field
+MAX_STEP_V = 50 # Largest change of one channel within a step
+RAMP_RATE_UP_V_PER_S = 5.0 # Used for the expected step durations
+RAMP_RATE_DOWN_V_PER_S = 10.0
+SETTLE_S = 10.0 # Wait after every channel move
+
+#Default GridPix ramp
+DEFAULT_VOLTAGES = np.array([
+    [0, 50, 100, 150, 200, 250, 275, 300, 325, 325, 325, 325, 325, 325, 325,
+     325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 335, 345,
+     355, 365, 375, 385, 395, 405, 410, 410, 410, 410, 410, 410, 410, 410, 410,
+     410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 410,
+     410, 410, 410],
+    [0, 50, 100, 150, 200, 250, 275, 300, 325, 325, 325, 325, 325, 325, 325,
+     325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 335, 345,
+     355, 365, 375, 385, 395, 405, 410, 420, 430, 440, 450, 460, 460, 460, 460,
+     460, 460, 460, 460, 460, 460, 460, 460, 460, 460, 460, 460, 460, 460, 470,
+     480, 490, 510],
+    [50, 100, 150, 200, 250, 300, 325, 350, 375, 425, 475, 525, 575, 625, 675,
+     725, 775, 825, 875, 925, 975, 1025, 1075, 1125, 1175, 1225, 1275, 1325, 1325, 1325,
+     1325, 1325, 1325, 1325, 1325, 1325, 1325, 1375, 1425, 1475, 1525, 1575, 1625, 1675, 1725,
+     1775, 1825, 1875, 1925, 1975, 2025, 2075, 2125, 2175, 2225, 2275, 2325, 2375, 2425, 2470,
+     2480, 2490, 2510],
+], dtype=np.int16).T
+
+
+class RampPlan:
+    '''One ramp plan. voltages[i] = (Vgrid, Vanode, Vcathode) of step i+1; all derived arrays are (n_steps, 3) or (n_steps,).
+
+    disable_up[i, c]: channel c does not change when step i+1 is checked (auto-checked in the UI)
+    disable_down[i, c]: channel c keeps its voltage into the next step (auto-unchecked when ramping down)
+    delta[i, c]: voltage change of channel c when ramping up into step i+1 (from 0 V below step 1)
+    duration_up/down[i]: expected seconds for step i+1, channels moved one after the other at the ramp rate plus settle time'''
+
+    def __init__(self, voltages, name="default", limits=None, ramp_rate_up=RAMP_RATE_UP_V_PER_S,
+                 ramp_rate_down=RAMP_RATE_DOWN_V_PER_S, settle_s=SETTLE_S):
+        self.name = name
+        self.voltages = np.asarray(voltages, dtype=np.int16).reshape(-1, 3)
+        self.voltages.flags.writeable = False
+        self.limits = {"max_grid_anode_V": MAX_GRID_ANODE_V, "max_cathode_grid_V": MAX_CATHODE_GRID_V,
+                       "max_step_V": MAX_STEP_V} | (limits or {})
+        self.steps = np.arange(1, len(self.voltages) + 1)
+
+        v = self.voltages.astype(np.int32)
+        same = v[1:] == v[:-1]
+        no_change = np.zeros((1, 3), dtype=bool)
+        self.disable_up = np.vstack([no_change, same])
+        self.disable_down = np.vstack([same, no_change])
+        self.delta = np.diff(v, axis=0, prepend=0)
+        moved = self.delta != 0
+        self.duration_up = (np.abs(self.delta) / ramp_rate_up + moved * settle_s).sum(axis=1)
+        self.duration_down = (np.abs(self.delta) / ramp_rate_down + moved * settle_s).sum(axis=1)
+
+    def __len__(self):
+        return len(self.voltages)
+
+    def channel(self, channel):
+        '''Voltages of "CH1"/"CH2"/"CH3" over all steps'''
+        return self.voltages[:, CHANNEL_INDEX[channel]]
+
+    def validate(self):
+        '''List of limit violations (empty if the plan is fine)'''
+        v = self.voltages.astype(np.int32)
+        grid, anode, cathode = v[:, 0], v[:, 1], v[:, 2]
+        checks = (
+            ((v < 0).any(axis=1), "negative voltage"),
+            (anode < grid, "Vanode below Vgrid"),
+            (anode - grid > self.limits["max_grid_anode_V"], f"Vanode - Vgrid above {self.limits['max_grid_anode_V']} V"),
+            (cathode - grid > self.limits["max_cathode_grid_V"], f"Vcathode - Vgrid above {self.limits['max_cathode_grid_V']} V"),
+            ((np.abs(self.delta) > self.limits["max_step_V"]).any(axis=1), f"channel change above {self.limits['max_step_V']} V"),
+        )
+        problems = []
+        for bad, message in checks:
+            if bad.any():
+                problems.append(f"{message} at step(s) {', '.join(str(s) for s in self.steps[bad])}")
+        return problems
+
+    def to_dict(self):
+        '''{"step", "Vgrid_CH3", "Vanode_CH2", "Vcathode_CH1"} lists plus name and limits, the JSON-serializable
+        form passed to run_hv_ramp'''
+        plan = {"step": self.steps.tolist()}
+        for c, key in enumerate(PLAN_COLUMNS):
+            plan[key] = self.voltages[:, c].tolist()
+        return plan | {"name": self.name, "limits": dict(self.limits)}
+
+    @classmethod
+    def from_dict(cls, plan):
+        '''Inverse of to_dict(); name and limits are optional (defaults). Raises ValueError on a malformed plan.'''
+        missing = [key for key in PLAN_COLUMNS if key not in plan]
+        if missing:
+            raise ValueError(f"plan: missing column(s) {', '.join(missing)}")
+        lengths = {len(plan[key]) for key in PLAN_COLUMNS}
+        if len(lengths) != 1 or not lengths.pop():
+            raise ValueError("plan: the voltage columns must be non-empty and of equal length")
+        voltages = np.stack([np.asarray(plan[key], dtype=np.int32) for key in PLAN_COLUMNS], axis=1)
+        if np.abs(voltages).max() > np.iinfo(np.int16).max:
+            raise ValueError("plan: voltage out of range")
+        if "step" in plan:
+            voltages = voltages[np.argsort(np.asarray(plan["step"]), kind="stable")]
+        return cls(voltages, name=plan.get("name", "job plan"), limits=plan.get("limits"))
+
+
+def default_plan():
+    return RampPlan(DEFAULT_VOLTAGES, name="default")
+
+
+def load_plan(path):
+    '''Read a plan CSV. Raises ValueError when the file is malformed or the plan violates its limits.'''
+    meta = {}
+    with open(path) as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        if line.startswith("#") and ":" in line:
+            key, _, value = line[1:].partition(":")
+            meta[key.strip()] = value.strip()
+    rows = [line for line in lines if line.strip() and not line.startswith("#")]
+    if not rows:
+        raise ValueError(f"{path}: empty plan")
+    header = [name.strip() for name in rows[0].split(",")]
+    missing = [name for name in ("step",) + PLAN_COLUMNS if name not in header]
+    if missing:
+        raise ValueError(f"{path}: missing column(s) {', '.join(missing)}")
+    table = np.array([[int(float(x)) for x in row.split(",")] for row in rows[1:]], dtype=np.int32).reshape(-1, len(header))
+    table = table[np.argsort(table[:, header.index("step")], kind="stable")]
+    voltages = table[:, [header.index(name) for name in PLAN_COLUMNS]]
+
+    limits = {key: float(meta[key]) for key in ("max_grid_anode_V", "max_cathode_grid_V", "max_step_V") if key in meta}
+    plan = RampPlan(voltages, name=meta.get("name", os.path.splitext(os.path.basename(path))[0]), limits=limits)
+    problems = plan.validate()
+    if problems:
+        raise ValueError(f"{path}: " + "; ".join(problems))
+    return plan
+
+
+def list_plans(plan_dir=PLAN_DIR):
+    '''{plan name: CSV path} of the plan files, "default" maps to None (built-in plan)'''
+    plans = {"default": None}
+    for path in sorted(glob.glob(os.path.join(plan_dir, "*.csv"))):
+        plans[os.path.splitext(os.path.basename(path))[0]] = path
+    return plans
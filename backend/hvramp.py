@@ -0,0 +1,261 @@
+#backend/hvramp.py
+'''Automated HV ramp: power-supply driver interface, simulated supply and a ramp executor'''
+
+import threading
+import time
+from datetime import datetime
+
+from backend.jobs import log, JobCancelled
+from backend.hvlog import HVLogWriter
+from backend.hvplan import RampPlan
+
+CHANNELS = ("CH3", "CH2", "CH1") # Ramp-up order within a step (Vgrid, Vanode, Vcathode), reversed for ramp-down
+PLAN_KEYS = {"CH3": "Vgrid_CH3", "CH2": "Vanode_CH2", "CH1": "Vcathode_CH1"}
+POLL_INTERVAL_S = 0.1
+SETTLE_TOLERANCE_V = 2.0
+SETTLE_READS = 5 # Consecutive readbacks within tolerance for a channel to count as settled
+STEP_TIMEOUT_S = 120.0
+CURRENT_LIMIT_UA = 5.0
+
+
+class RampAborted(Exception):
+    '''Raised by the executor after an over-current, a settle timeout or a stop request'''
+
+
+class PowerSupply:
+    '''Driver interface. A real supply implements set_voltage() and read(); off() sets every channel to 0 V.'''
+
+    def set_voltage(self, channel, volts):
+        raise NotImplementedError
+
+    def read(self):
+        '''Return {channel: (voltage_V, current_uA)} for all channels'''
+        raise NotImplementedError
+
+    def off(self):
+        for channel in CHANNELS:
+            self.set_voltage(channel, 0)
+
+
+class SimulatedSupply(PowerSupply):
+    '''Offline supply model: each channel slews linearly to its setpoint, the current is a leakage term V/R plus
+    a charging term C*dV/dt. trip_at_V makes a channel draw trip_current_uA above that voltage (over-current test).'''
+
+    def __init__(self, slew_V_per_s=50.0, leakage_Mohm=2000.0, capacitance_nF=0.1, trip_at_V=None, trip_current_uA=50.0):
+        self.slew = slew_V_per_s
+        self.leakage = leakage_Mohm
+        self.capacitance = capacitance_nF
+        self.trip_at = trip_at_V or {}
+        self.trip_current = trip_current_uA
+        self.voltage = {channel: 0.0 for channel in CHANNELS}
+        self.setpoint = dict(self.voltage)
+        self.rate = dict(self.voltage)
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _advance(self):
+        now = time.monotonic()
+        dt, self._t = now - self._t, now
+        for channel in CHANNELS:
+            delta = self.setpoint[channel] - self.voltage[channel]
+            step = max(-self.slew * dt, min(self.slew * dt, delta))
+            self.voltage[channel] += step
+            self.rate[channel] = step / dt if dt > 0 else 0.0
+
+    def set_voltage(self, channel, volts):
+        with self._lock:
+            self._advance()
+            self.setpoint[channel] = float(volts)
+
+    def read(self):
+        with self._lock:
+            self._advance()
+            readback = {}
+            for channel in CHANNELS:
+                v = self.voltage[channel]
+                current = v / self.leakage + self.capacitance * 1e-3 * abs(self.rate[channel]) # uA
+                if channel in self.trip_at and v >= self.trip_at[channel]:
+                    current += self.trip_current
+                readback[channel] = (v, current)
+            return readback
+
+
+class RampExecutor:
+    '''Walks an HV plan (dict of Vgrid_CH3/Vanode_CH2/Vcathode_CH1 lists, like hv_steps) up or down.
+
+    Within every step the channels are set in the procedure order (CH3, CH2, CH1 up; CH1, CH2, CH3 down), channels
+    whose voltage does not change are skipped, and each set waits until the readback has settled. A poller thread
+    reads the supply every poll_interval, streams the readback into the log and aborts on over-current.'''
+
+    def __init__(self, supply, plan, writer=None, direction="up", poll_interval=POLL_INTERVAL_S,
+                 settle_tolerance=SETTLE_TOLERANCE_V, settle_reads=SETTLE_READS, step_timeout=STEP_TIMEOUT_S,
+                 current_limit_uA=CURRENT_LIMIT_UA):
+        self.supply = supply
+        self.plan = {channel: list(plan[key]) for channel, key in PLAN_KEYS.items()}
+        self.writer = writer
+        self.direction = direction
+        self.poll_interval = poll_interval
+        self.settle_tolerance = settle_tolerance
+        self.settle_reads = settle_reads
+        self.step_timeout = step_timeout
+        self.current_limit = current_limit_uA
+        self.step = 0
+        self.readback = None
+        self.abort_reason = None
+        self.reads = 0 # Number of readbacks so far, tells _settle a fresh readback from a timed-out wait
+        self._stop = threading.Event()
+        self._new_read = threading.Condition()
+
+    def _poll(self):
+        while not self._stop.is_set():
+            try:
+                readback = self.supply.read()
+            except Exception as e:# Without readback nothing is monitored any more: stop the ramp
+                self.abort(f"supply readback failed: {type(e).__name__}: {e}")
+                return
+            with self._new_read:
+                self.readback = readback
+                self.reads += 1
+                self._new_read.notify_all()
+            if self.writer is not None:
+                self.writer.log(
+                    self.step, "READBACK", None,
+                    round(readback["CH3"][0], 1), round(readback["CH2"][0], 1), round(readback["CH1"][0], 1),
+                    note=" ".join(f"I_{channel}={readback[channel][1]:.3f}uA" for channel in CHANNELS),
+                    timespec="milliseconds",
+                )
+            tripped = [channel for channel in CHANNELS if readback[channel][1] > self.current_limit]
+            if tripped and self.abort_reason is None:
+                self.abort(f"over-current on {', '.join(tripped)} ({max(readback[c][1] for c in tripped):.2f} uA)")
+            time.sleep(self.poll_interval)
+
+    def abort(self, reason):
+        '''Stop the ramp (from any thread). The supply is switched off by run().'''
+        self.abort_reason = reason
+        with self._new_read:
+            self._new_read.notify_all()
+
+    def _settle(self, channel, target):
+        '''Block until `channel` reads back within tolerance of target for settle_reads consecutive fresh polls'''
+        deadline = time.monotonic() + self.step_timeout
+        in_tolerance = 0
+        with self._new_read:
+            seen = self.reads
+            while in_tolerance < self.settle_reads:
+                if self.abort_reason is not None:
+                    raise RampAborted(self.abort_reason)
+                if time.monotonic() > deadline:
+                    self.abort_reason = f"{channel} did not settle at {target} V within {self.step_timeout:.0f} s"
+                    raise RampAborted(self.abort_reason)
+                self._new_read.wait(self.poll_interval * 5)
+                if self.reads == seen:# Woken by abort() or timed out: the last readback was already counted
+                    continue
+                seen = self.reads
+                voltage = self.readback[channel][0] if self.readback else None
+                in_tolerance = in_tolerance + 1 if voltage is not None and abs(voltage - target) <= self.settle_tolerance else 0
+
+    def _moves(self):
+        '''(step number, plan index, channel, target voltage) in execution order, unchanged channels skipped'''
+        n = len(self.plan["CH3"])
+        if self.direction == "up":
+            for i in range(n):
+                for channel in CHANNELS:
+                    if i == 0 or self.plan[channel][i] != self.plan[channel][i - 1]:
+                        yield i + 1, i, channel, self.plan[channel][i]
+        else:# Unchecking step i goes back to the voltage of step i-1 (0 V below step 1)
+            for i in reversed(range(n)):
+                for channel in reversed(CHANNELS):
+                    target = self.plan[channel][i - 1] if i > 0 else 0
+                    if i == 0 or self.plan[channel][i] != self.plan[channel][i - 1]:
+                        yield i + 1, i, channel, target
+
+    def run(self, cancelled=lambda: False, progress=lambda fraction: None):
+        '''Execute the ramp. Returns a summary dict; raises RampAborted after switching the supply off.'''
+        poller = threading.Thread(target=self._poll, name="hv-readback", daemon=True)
+        poller.start()
+        t0 = time.monotonic()
+        plan_moves = list(self._moves())
+        moves = 0
+        try:
+            for step, i, channel, target in plan_moves:
+                if cancelled():
+                    self.abort("stopped by operator")
+                if self.abort_reason is not None:# Stopped, or tripped after the last move settled: no further move
+                    raise RampAborted(self.abort_reason)
+                self.step = step
+                self.supply.set_voltage(channel, target)
+                self._settle(channel, target)
+                moves += 1
+                progress(moves / len(plan_moves))
+                if self.writer is not None:
+                    self.writer.log(step, channel, self.direction == "up",
+                                    self.plan["CH3"][i], self.plan["CH2"][i], self.plan["CH1"][i], note="auto")
+        except RampAborted:
+            off_error = None
+            try:
+                self.supply.off()
+            except Exception as e:# Still log the abort, with the failure, before giving up
+                off_error = e
+                self.abort_reason = f"{self.abort_reason}; switching the supply off failed: {type(e).__name__}: {e}"
+            if self.writer is not None:
+                self.writer.log(self.step, "ABORT", None, 0, 0, 0, note=self.abort_reason)
+            if off_error is not None:
+                raise RampAborted(self.abort_reason) from off_error
+            raise
+        finally:
+            self._stop.set()
+            poller.join(self.step_timeout)# A driver call that hangs must not keep the job alive, the thread is a daemon
+            if self.writer is not None:
+                self.writer.flush()
+        return {"direction": self.direction, "steps": len(self.plan["CH3"]), "moves": moves, "seconds": time.monotonic() - t0}
+
+
+def register_supply(name, factory):
+    '''Make a power-supply driver available to run_hv_ramp(supply=name). factory(**supply_options) -> PowerSupply'''
+    SUPPLIES[name] = factory
+
+
+def make_supply(supply, supply_options=None):
+    '''PowerSupply from a registered driver name or a factory callable'''
+    factory = supply if callable(supply) else SUPPLIES.get(supply)
+    if factory is None:
+        raise ValueError(f"Unknown power supply '{supply}', registered: {', '.join(sorted(SUPPLIES))}")
+    return factory(**(supply_options or {}))
+
+
+SUPPLIES = {"simulated": SimulatedSupply} # Driver name -> factory, hardware drivers add themselves with register_supply()
+
+
+def run_hv_ramp(plan, direction="up", log_dir="hv_ramp_logs", operator="automated ramp", setup_info="",
+                supply="simulated", supply_options=None, job=None):
+    '''Job target: ramp the supply through `plan` and log every step and the readback to a new hv_log file.
+    supply: registered driver name (see register_supply) or factory callable, called with supply_options.
+    The plan is checked against its limits first; a plan with violations is refused before the supply is touched.'''
+    ramp_plan = RampPlan.from_dict(plan)
+    problems = ramp_plan.validate()
+    if problems:
+        raise ValueError(f"Refusing to ramp with plan '{ramp_plan.name}': " + "; ".join(problems))
+    plan = ramp_plan.to_dict()
+    supply = make_supply(supply, supply_options)
+    if direction == "down" and isinstance(supply, SimulatedSupply):# The simulated supply starts at the top of the plan
+        for channel, key in PLAN_KEYS.items():
+            supply.voltage[channel] = supply.setpoint[channel] = float(plan[key][-1])
+
+    ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    writer = HVLogWriter(f"{log_dir}/hv_log_{ts}.csv", operator=operator, setup_info=setup_info)
+    executor = RampExecutor(supply, plan, writer, direction)
+    log(f"hv ramp: {direction} through {len(plan['Vgrid_CH3'])} steps, logging to {writer.path}")
+    try:
+        if job is not None:
+            summary = executor.run(cancelled=job.cancelled, progress=job.progress)
+        else:
+            summary = executor.run()
+    except RampAborted as e:
+        log(f"hv ramp: ABORTED at step {executor.step:02d} → {e}", level="WARNING")
+        if job is not None and job.cancelled():
+            raise JobCancelled() from e
+        raise
+    finally:
+        writer.close()
+    log(f"hv ramp: {direction} done, {summary['moves']} channel moves in {summary['seconds']:.0f} s")
+    return summary | {"log_file": writer.path}
@@ -0,0 +1,183 @@
+#backend/hvtimeline.py
+'''HV state as a function of time, from the HV ramp logs, to tag clusters with the voltages they were taken at
+
+HVTimeline turns the archived log rows into intervals: every row that changes a voltage starts a new interval
+holding the ramp step and the Vgrid/Vanode/Vcathode in force from then on. A checked manual row sets its own
+channel (CH3 grid, CH2 anode, CH1 cathode; the other voltages in the row are the step's targets, not yet applied)
+to its step's voltage, an unchecked one drops that channel back to the voltage of step i-1 (0 V below step 1),
+as when ramping down. A READBACK row of the automated ramp sets all three, an ABORT row switches all off.
+A channel not set yet in a session is unknown (NaN). A session's last state ends at its final row: the HV
+after that (the next day, or before the next session) is unknown, step -1 and NaN voltages.
+
+Lookups are one np.searchsorted over the sorted interval starts (an as-of join), so tagging costs the same per
+cluster whatever the number of log rows. GainCurve accumulates cluster spectra per distinct voltage setting in
+fixed-size histograms and reports the main peak per setting: gain versus voltage out of a single analysis pass.'''
+
+import numpy as np
+import pyarrow as pa
+
+from backend.hvarchive import HVArchive, LOG_DIR
+from backend.livehist import (TOA_NS, CLUSTER_TOT_BINS, CLUSTER_TOT_MAX, CLUSTER_CHARGE_BINS, CLUSTER_CHARGE_MAX_E,
+                              MIN_PEAK_SIZE, hist_peak)
+
+VOLTAGES = ("Vgrid", "Vanode", "Vcathode")
+CHANNEL_OF = {"Vgrid": "CH3", "Vanode": "CH2", "Vcathode": "CH1"}
+READBACK = "READBACK"
+ABORT = "ABORT"
+STEP_KEY = 1 << 16 # Sort key of (session, step) pairs: session number * STEP_KEY + step
+FE55_EV = 5895.0 # 55Fe K-alpha line
+W_EV = 26.0 # Mean energy per ion pair, argon-based mixtures
+HV_FIELDS = [pa.field("hv_step", pa.int16()), pa.field("Vgrid", pa.float32()), pa.field("Vanode", pa.float32()), pa.field("Vcathode", pa.float32())]
+
+
+def to_ns(timestamp):
+    '''Local wall-clock time (datetime, ISO string or datetime64) as int64 ns, the unit of the timeline'''
+    return np.datetime64(timestamp, "ns").astype(np.int64)
+
+
+def _previous_step_targets(session_id, step, targets, use):
+    '''Voltages of the closest lower step logged (by a row where use is True) in the same session as each row,
+    0 V if there is none: what unchecking the row's step goes back to'''
+    rows = np.flatnonzero(use)
+    if not len(rows):
+        return np.zeros_like(targets)
+    key = session_id * STEP_KEY + step
+    order = rows[np.argsort(key[rows], kind="stable")]
+    pos = np.searchsorted(key[order], key - 1, side="right") - 1
+    source = order[np.maximum(pos, 0)]
+    found = (pos >= 0) & (session_id[source] == session_id)
+    return np.where(found[:, None], targets[source], 0.0).astype(np.float32)
+
+
+class HVTimeline:
+    '''Sorted intervals of constant HV: start time (ns), step and the three voltages'''
+
+    def __init__(self, start_ns, step, voltages, session):
+        self.start_ns = start_ns
+        self.step = step
+        self.voltages = voltages # (n, 3) float32, columns as VOLTAGES
+        self.session = session
+        # Distinct settings (NaN as a value of its own) and the setting of every interval, for GainCurve
+        keys = np.nan_to_num(voltages, nan=-1.0)
+        self.settings, self.setting_of = np.unique(keys, axis=0, return_inverse=True)
+        self.setting_of = self.setting_of.ravel()
+        self.settings = np.where(self.settings == -1.0, np.nan, self.settings)
+
+    def __len__(self):
+        return len(self.start_ns)
+
+    @classmethod
+    def from_events(cls, events):
+        '''Build from an HV archive events table (sorted by session and time)'''
+        n = events.num_rows
+        session = events["session"].to_numpy(zero_copy_only=False)
+        time_ns = events["timestamp"].cast(pa.int64()).to_numpy() * 1_000_000 # Stored in ms
+        channel = events["channel"].to_numpy(zero_copy_only=False)
+        checked = events["checked"].fill_null(False).to_numpy(zero_copy_only=False).astype(bool)
+        step = events["step"].to_numpy().astype(np.int64)
+        targets = np.stack([events[name].to_numpy(zero_copy_only=False).astype(np.float32) for name in VOLTAGES], axis=1)
+        rows = np.arange(n)
+        session_start = np.zeros(n, dtype=np.int64) # Index of the first row of each row's session
+        new_session = np.r_[True, session[1:] != session[:-1]] if n else np.zeros(0, dtype=bool)
+        session_start[new_session] = rows[new_session]
+        session_start = np.maximum.accumulate(session_start) if n else session_start
+
+        def carry(update):
+            '''Index of the last row at or before each row (same session) where update is True, -1 if none'''
+            last = np.maximum.accumulate(np.where(update, rows, -1)) if n else rows
+            return np.where(last >= session_start, last, -1)
+
+        readback = channel == READBACK
+        abort = channel == ABORT
+        manual = np.isin(channel, list(CHANNEL_OF.values()))
+        unchecked = manual & ~checked
+        previous = _previous_step_targets(np.cumsum(new_session) - 1, step, targets, manual)
+        values = np.where(unchecked[:, None], previous, targets) # Voltage each row sets
+        values[abort] = 0.0
+        row_step = np.where(unchecked, step - 1, np.where(abort, 0, step))
+        voltages = np.full((n, 3), np.nan, dtype=np.float32)
+        changed = readback | abort
+        for k, name in enumerate(VOLTAGES):
+            update = readback | abort | (channel == CHANNEL_OF[name])
+            changed |= update
+            source = carry(update)
+            voltages[:, k] = np.where(source >= 0, values[np.maximum(source, 0), k], np.nan)
+        step_source = carry(changed)
+        hv_step = np.where(step_source >= 0, row_step[np.maximum(step_source, 0)], -1).astype(np.int16)
+
+        # Every session ends in an interval of unknown HV right after its final row
+        last = np.flatnonzero(np.r_[new_session[1:], True]) if n else rows
+        keep = np.flatnonzero(changed)
+        start_ns = np.concatenate([time_ns[keep], time_ns[last] + 1])
+        order = np.argsort(start_ns, kind="stable")
+        return cls(
+            start_ns[order],
+            np.concatenate([hv_step[keep], np.full(len(last), -1, dtype=np.int16)])[order],
+            np.concatenate([voltages[keep], np.full((len(last), 3), np.nan, dtype=np.float32)])[order],
+            np.concatenate([session[keep], session[last]])[order],
+        )
+
+    @classmethod
+    def from_log_dir(cls, log_dir=LOG_DIR):
+        '''Build from all HV logs of log_dir (the archive index is brought up to date first)'''
+        return cls.from_events(HVArchive(log_dir).events)
+
+    def index(self, time_ns):
+        '''Interval in force at each time (int64 ns array), -1 before the first logged change and between sessions'''
+        index = np.searchsorted(self.start_ns, np.asarray(time_ns, dtype=np.int64), side="right") - 1
+        if not len(self):
+            return index
+        return np.where(self.step[np.maximum(index, 0)] >= 0, index, -1)
+
+    def lookup(self, index):
+        '''Columns hv_step, Vgrid, Vanode, Vcathode for interval indices from index() (-1: step -1, NaN voltages)'''
+        if not len(self):
+            return {"hv_step": np.full(len(index), -1, dtype=np.int16)} | {name: np.full(len(index), np.nan, dtype=np.float32) for name in VOLTAGES}
+        valid = index >= 0
+        safe = np.maximum(index, 0)
+        columns = {"hv_step": np.where(valid, self.step[safe], -1).astype(np.int16)}
+        for k, name in enumerate(VOLTAGES):
+            columns[name] = np.where(valid, self.voltages[safe, k], np.nan).astype(np.float32)
+        return columns
+
+    def tag(self, clusters, run_start_ns):
+        '''Interval index of every cluster (dict with toa_start, in TOA_NS units since run_start_ns)'''
+        return self.index(run_start_ns + (clusters["toa_start"].astype(np.float64) * TOA_NS).astype(np.int64))
+
+
+class GainCurve:
+    '''Cluster charge (or ToT-sum) spectra per distinct HV setting of a timeline'''
+
+    def __init__(self, timeline, calibrated):
+        self.timeline = timeline
+        self.calibrated = calibrated
+        self.bins = CLUSTER_CHARGE_BINS if calibrated else CLUSTER_TOT_BINS
+        self.max_value = CLUSTER_CHARGE_MAX_E if calibrated else CLUSTER_TOT_MAX
+        self.hist = np.zeros((max(len(timeline.settings), 1), self.bins), dtype=np.int64)
+
+    def add(self, clusters, index):
+        '''Add cluster summaries with their interval indices from HVTimeline.tag()'''
+        values = clusters["charge_sum"] if self.calibrated else clusters["tot_sum"].astype(np.float64)
+        use = (index >= 0) & (clusters["size"] >= MIN_PEAK_SIZE) & np.isfinite(values)
+        if not use.any():
+            return
+        setting = self.timeline.setting_of[index[use]]
+        bins = np.clip(values[use] * (self.bins / self.max_value), 0, self.bins - 1).astype(np.intp)
+        self.hist += np.bincount(setting * self.bins + bins, minlength=self.hist.size).reshape(self.hist.shape)
+
+    def rows(self):
+        '''One row per setting with clusters: voltages, clusters in the peak spectrum, peak, FWHM and (calibrated) gain'''
+        edges = np.linspace(0, self.max_value, self.bins + 1)
+        rows = []
+        for setting in np.flatnonzero(self.hist.sum(axis=1)):
+            peak, resolution = hist_peak(self.hist[setting], edges)
+            row = {name: float(value) for name, value in zip(VOLTAGES, self.timeline.settings[setting])}
+            row |= {
+                "clusters": int(self.hist[setting].sum()),
+                "peak": peak,
+                "peak_unit": "e-" if self.calibrated else "ToT",
+                "fwhm_resolution": resolution,
+                "gain": peak / (FE55_EV / W_EV) if self.calibrated else float("nan"),
+            }
+            rows.append(row)
+        return rows
@@ -0,0 +1,423 @@
+#backend/interpretation.py
+'''Timepix3 raw data interpretation: 64-bit packet words -> hit table (Parquet)'''
+
+import mmap
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from backend.jobs import log, JobStats
+from backend.livehist import LiveHistograms, SNAPSHOT_INTERVAL_S
+from backend.resultcache import ResultCache, code_version
+from backend.hitstore import HitWriter
+
+TPX3_HEADER = 0x33585054 # b"TPX3" read as little-endian uint32, starts every chunk of a .tpx3 file
+PIXEL_PACKET = 0xB # Packet type (bits 63-60) of pixel data with ToA/ToT
+COARSE_BITS = 30 # 16-bit SPIDR time + 14-bit ToA, 25 ns clock
+COARSE_PERIOD = 1 << COARSE_BITS # Rollover of the coarse ToA (~26.8 s)
+FTOA_PER_COARSE = 16 # FToA ticks (1.5625 ns) per 25 ns clock
+TOA_NS = 25.0 / FTOA_PER_COARSE # Unit of the "toa" column in ns
+
+CHUNK_WORDS = 1 << 22 # 4 Mi packets = 32 MB of raw data decoded at once
+HEADER_SEARCH_WORDS = 1 << 14 # A .tpx3 chunk is at most 64 kB, so a header is always found within this many words
+
+HIT_SCHEMA = pa.schema([
+    ("chip", pa.uint8()),
+    ("col", pa.uint8()),
+    ("row", pa.uint8()),
+    ("toa", pa.uint64()),# Global time of arrival in 1.5625 ns units, rollover-extended
+    ("tot", pa.uint16()),# Time over threshold in 25 ns units
+    ("ftoa", pa.uint8()),
+])
+PART_COMPRESSION = "zstd" # Buffer compression of the per-range Arrow IPC files the workers hand to the parent
+
+
+def decode_pixels(words):
+    '''Split pixel packet words into column, row, coarse ToA (30 bit), ToT and FToA arrays'''
+    addr = (words >> 44) & 0xFFFF
+    dcol = (addr & 0xFE00) >> 8
+    spix = (addr & 0x01F8) >> 1
+    pix = addr & 0x7
+    col = (dcol + (pix >> 2)).astype(np.uint8)
+    row = (spix + (pix & 0x3)).astype(np.uint8)
+    coarse = ((words & 0xFFFF) << 14) | ((words >> 30) & 0x3FFF)
+    tot = ((words >> 20) & 0x3FF).astype(np.uint16)
+    ftoa = ((words >> 16) & 0xF).astype(np.uint8)
+    return col, row, coarse.astype(np.int64), tot, ftoa
+
+
+class HitDecoder:
+    '''Stateful packet decoder. Chip header context and ToA rollover are carried from one chunk to the next,
+    so a file can be fed in arbitrary packet-aligned pieces and gives the same hits as one big array.'''
+
+    def __init__(self, chip=0):
+        self.chip = chip # Chip index of the last header seen
+        self.first_coarse = {} # chip -> first coarse ToA seen
+        self.last_coarse = {} # chip -> last coarse ToA seen
+        self.epoch = {} # chip -> number of coarse ToA rollovers seen
+
+    def _chip_context(self, words):
+        '''Chip index in effect for every word (taken from the closest preceding TPX3 header)'''
+        is_header = (words & 0xFFFFFFFF) == TPX3_HEADER
+        if not is_header.any():
+            return np.full(len(words), self.chip, dtype=np.uint8)
+        header_chip = ((words >> 32) & 0xFF).astype(np.uint8)
+        last_header = np.maximum.accumulate(np.where(is_header, np.arange(len(words)), -1))
+        chip = np.where(last_header >= 0, header_chip[np.maximum(last_header, 0)], self.chip).astype(np.uint8)
+        self.chip = int(chip[-1])
+        return chip
+
+    def _extend_toa(self, coarse, chip):
+        '''Unwrap the 30-bit coarse ToA per chip. A jump of more than half a period backwards is a rollover,
+        a jump forwards by more than half a period is a late packet from before the last rollover.'''
+        extended = np.empty(len(coarse), dtype=np.int64)
+        chips = np.unique(chip).tolist()
+        for c in chips:
+            sel = slice(None) if len(chips) == 1 else chip == c
+            seq = coarse[sel]
+            d = np.diff(seq, prepend=self.last_coarse.get(c, seq[0]))
+            steps = (d < -(COARSE_PERIOD // 2)).astype(np.int64) - (d > COARSE_PERIOD // 2)
+            epochs = self.epoch.get(c, 0) + np.cumsum(steps)
+            extended[sel] = epochs * COARSE_PERIOD + seq
+            self.first_coarse.setdefault(c, int(seq[0]))
+            self.last_coarse[c] = int(seq[-1])
+            self.epoch[c] = int(epochs[-1])
+        return extended
+
+    def chain(self, first_coarse, last_coarse, epoch):
+        '''Continue this decoder's ToA unwrapping with the state of a decoder that started on the following
+        piece of the file. Returns the rollover count (per chip) to add to that piece's hits.'''
+        offsets = {}
+        for c, first in first_coarse.items():
+            if c in self.last_coarse:
+                d = first - self.last_coarse[c]
+                offsets[c] = self.epoch[c] + (d < -(COARSE_PERIOD // 2)) - (d > COARSE_PERIOD // 2)
+            else:
+                offsets[c] = 0
+                self.first_coarse[c] = first
+            self.last_coarse[c] = last_coarse[c]
+            self.epoch[c] = offsets[c] + epoch[c]
+        return offsets
+
+    def scan(self, words):
+        '''Advance the chip context and ToA rollover state over a block of raw words without building any hits'''
+        words = np.asarray(words, dtype=np.uint64)
+        chip = self._chip_context(words)
+        is_pixel = (words >> 60) == PIXEL_PACKET
+        words = words[is_pixel]
+        if len(words):
+            self._extend_toa((((words & 0xFFFF) << 14) | ((words >> 30) & 0x3FFF)).astype(np.int64), chip[is_pixel])
+
+    def decode(self, words):
+        '''Decode a packet-aligned block of raw words into a dict of hit columns (see HIT_SCHEMA)'''
+        words = np.asarray(words, dtype=np.uint64)
+        chip = self._chip_context(words)
+        is_pixel = (words >> 60) == PIXEL_PACKET
+        words, chip = words[is_pixel], chip[is_pixel]
+        col, row, coarse, tot, ftoa = decode_pixels(words)
+        toa = self._extend_toa(coarse, chip) * FTOA_PER_COARSE - ftoa
+        return {"chip": chip, "col": col, "row": row, "toa": toa, "tot": tot, "ftoa": ftoa}
+
+
+def take_hits(hits, index):
+    return {name: values[index] for name, values in hits.items()}
+
+
+def sort_hits(hits):
+    '''Stable sort of a hit dict by ToA (skipped when it is already in order)'''
+    toa = hits["toa"]
+    if len(toa) > 1 and (toa[1:] < toa[:-1]).any():
+        return take_hits(hits, np.argsort(toa, kind="stable"))
+    return hits
+
+
+def hits_to_table(hits):
+    hits = dict(hits, toa=np.maximum(hits["toa"], 0).astype(np.uint64))# Only the first 25 ns of a run can go below zero
+    return pa.Table.from_pydict(hits, schema=HIT_SCHEMA)
+
+
+class OrderedHitWriter:
+    '''Passes hit chunks on to `sink` (a callable taking a hit dict) in global ToA order. Chunks have to arrive
+    roughly in time order (as they do from a raw file): rows later than the start of the newest chunk are held
+    back and merged with it.'''
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.pending = None
+        self.rows = 0
+
+    def _write(self, hits):
+        if len(hits["toa"]):
+            self.sink(hits)
+            self.rows += len(hits["toa"])
+
+    def push(self, hits):
+        if not len(hits["toa"]):
+            return
+        hits = sort_hits(hits)
+        if self.pending is not None:
+            cut = np.searchsorted(self.pending["toa"], hits["toa"][0], side="right")
+            self._write(take_hits(self.pending, slice(None, cut)))
+            if cut < len(self.pending["toa"]):# Overlap with the new chunk
+                rest = take_hits(self.pending, slice(cut, None))
+                hits = sort_hits({name: np.concatenate([rest[name], hits[name]]) for name in hits})
+        self.pending = hits
+
+    def flush(self):
+        if self.pending is not None:
+            self._write(self.pending)
+            self.pending = None
+
+
+def iter_raw_chunks(input_path, chunk_words=CHUNK_WORDS, start_word=0, stop_word=None):
+    '''Yield consecutive uint64 views of a memory-mapped raw file. Pages of finished chunks are dropped
+    from the mapping, so resident memory stays at about one chunk regardless of the file size.'''
+    page_words = mmap.PAGESIZE // 8
+    chunk_words = max(page_words, chunk_words - chunk_words % page_words)# Keep chunk starts page aligned for madvise
+    with open(input_path, "rb") as f:
+        n_words = os.fstat(f.fileno()).st_size // 8
+        stop_word = n_words if stop_word is None else min(stop_word, n_words)
+        if stop_word <= start_word:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for first in range(start_word, stop_word, chunk_words):
+                count = min(chunk_words, stop_word - first)
+                words = np.frombuffer(mm, dtype="<u8", count=count, offset=first * 8)
+                yield words
+                del words
+                page_start = (first * 8) - (first * 8) % mmap.PAGESIZE
+                mm.madvise(mmap.MADV_DONTNEED, page_start, (first + count) * 8 - page_start)
+        finally:
+            try:
+                mm.close()
+            except BufferError:# The caller still holds the last chunk, the mapping goes away with it
+                pass
+
+
+def split_ranges(input_path, n_parts):
+    '''Split a raw file into about n_parts word ranges. Boundaries are moved forward to the next TPX3 chunk
+    header, so every range starts with its own chip context. Returns (start_word, stop_word, chip) tuples.'''
+    n_words = os.path.getsize(input_path) // 8
+    if n_words == 0:
+        return []
+    raw = np.memmap(input_path, dtype="<u8", mode="r", shape=(n_words,))
+    bounds = [0]
+    chips = [0]
+    for k in range(1, n_parts):
+        nominal = k * n_words // n_parts
+        window = raw[nominal:nominal + HEADER_SEARCH_WORDS]
+        headers = np.flatnonzero((window & 0xFFFFFFFF) == TPX3_HEADER)
+        if len(headers):
+            pos, chip = nominal + int(headers[0]), int((window[headers[0]] >> 32) & 0xFF)
+        else:# No headers in this file (or corrupt): packet aligned split, chip from the last header before it
+            back = raw[max(nominal - HEADER_SEARCH_WORDS, 0):nominal]
+            headers = np.flatnonzero((back & 0xFFFFFFFF) == TPX3_HEADER)
+            pos, chip = nominal, int((back[headers[-1]] >> 32) & 0xFF) if len(headers) else chips[-1]
+        if bounds[-1] < pos < n_words:
+            bounds.append(pos)
+            chips.append(chip)
+    del raw
+    bounds.append(n_words)
+    return [(bounds[k], bounds[k + 1], chips[k]) for k in range(len(chips))]
+
+
+def _scan_range(input_path, start_word, stop_word, chip, chunk_words):
+    '''Process pool worker: ToA rollover state of one word range, unwrapped as if the range were a file of its own'''
+    t0 = time.perf_counter()
+    decoder = HitDecoder(chip)
+    for words in iter_raw_chunks(input_path, chunk_words, start_word, stop_word):
+        decoder.scan(words)
+    return {"seconds": time.perf_counter() - t0, "first_coarse": decoder.first_coarse, "last_coarse": decoder.last_coarse,
+            "epoch": decoder.epoch}
+
+
+def _decode_range(input_path, start_word, stop_word, chip, epoch, part_path, chunk_words):
+    '''Process pool worker: decode one word range into a ToA-ordered, zstd-compressed Arrow IPC file, with the
+    range's live histograms. epoch: rollovers per chip before the range (from chaining the scans), so the ToA
+    written is the final one and the parent only has to merge the hits overlapping the range boundaries.'''
+    t0 = time.perf_counter()
+    decoder = HitDecoder(chip)
+    decoder.epoch = dict(epoch)
+    histograms = LiveHistograms()
+    options = pa.ipc.IpcWriteOptions(compression=PART_COMPRESSION)
+    with pa.ipc.new_file(part_path, HIT_SCHEMA, options=options) as writer:
+        def sink(hits):
+            writer.write_table(hits_to_table(hits))
+        ordered = OrderedHitWriter(sink)
+        for words in iter_raw_chunks(input_path, chunk_words, start_word, stop_word):
+            hits = decoder.decode(words)
+            histograms.add_hits(hits)
+            ordered.push(hits)
+        ordered.flush()
+    return {
+        "part_path": part_path,
+        "bytes": (stop_word - start_word) * 8,
+        "hits": ordered.rows,
+        "seconds": time.perf_counter() - t0,
+        "histograms": histograms.snapshot(),
+    }
+
+
+def _interpret_serial(input_path, ordered, histograms, chunk_words, report, stats):
+    decoder = HitDecoder()
+    for words in stats.timed("read", iter_raw_chunks(input_path, chunk_words)):
+        with stats.stage("decode"):
+            hits = decoder.decode(words)
+        with stats.stage("histograms"):
+            histograms.add_hits(hits)
+        with stats.stage("sort"):
+            ordered.push(hits)
+        report(words.nbytes)
+
+
+def _interpret_parallel(input_path, output_path, ordered, histograms, chunk_words, workers, report, pool, stats):
+    '''Two passes over the ranges on the pool: a scan for the ToA rollover state of each range, chained here in file
+    order, then the decoding with the chained rollover counts. Workers sort, histogram and compress their range;
+    this process reads the parts in order and writes them out, merging only where neighbouring ranges overlap.'''
+    n_words = os.path.getsize(input_path) // 8
+    n_parts = min(4 * workers, -(-n_words // chunk_words))# A few ranges per worker for load balancing
+    ranges = split_ranges(input_path, n_parts)
+    log(f"interpretation: {len(ranges)} ranges on {workers} worker processes")
+
+    chain = HitDecoder()
+    tmp_dir = tempfile.mkdtemp(prefix=".interpretation_", dir=os.path.dirname(os.path.abspath(output_path)))
+    scans = [pool.submit(_scan_range, input_path, start, stop, chip, chunk_words) for start, stop, chip in ranges]
+    decodes = []
+    try:
+        for k, (future, (start, stop, chip)) in enumerate(zip(scans, ranges)):# Each range is decoded as soon as its rollover count is known
+            with stats.stage("wait"):
+                state = future.result()
+            stats.add_time("scan (workers)", state["seconds"])
+            epoch = chain.chain(state["first_coarse"], state["last_coarse"], state["epoch"])
+            decodes.append(pool.submit(_decode_range, input_path, start, stop, chip, epoch,
+                                       os.path.join(tmp_dir, f"part_{k:05d}.arrow"), chunk_words))
+        for future in decodes:# Merge in file order while later ranges are still decoding
+            with stats.stage("wait"):
+                part = future.result()
+            stats.add_time("decode (workers)", part["seconds"])
+            with stats.stage("histograms"):
+                histograms.add_snapshot(part["histograms"])
+            with pa.OSFile(part["part_path"]) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    with stats.stage("read"):
+                        batch = reader.get_batch(i)# Decompressed into memory, nothing refers to the file afterwards
+                        hits = {name: column.to_numpy() for name, column in zip(batch.schema.names, batch.columns)}
+                    with stats.stage("sort"):
+                        ordered.push(hits)
+            os.remove(part["part_path"])
+            report(part["bytes"])
+    finally:
+        futures = scans + decodes
+        for future in futures:# Nothing left to wait for on failure or cancellation
+            future.cancel()
+        for future in futures:
+            if not future.cancelled():
+                future.exception()
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+def run_interpretation(input_path, output_path, chunk_words=CHUNK_WORDS, workers=None, snapshot_path=None, hits_path=None,
+                       compress_hits=False, cache=True, job=None):
+    '''Decode a Tpx3 raw file and stream the ToA-ordered hits into a Parquet file. Large files are split at
+    chunk headers and decoded on `workers` processes (default: all cores), small ones chunk by chunk in this thread.
+    Run as a scheduler job, the decoding uses the scheduler's shared process pool and can be cancelled.
+    Occupancy, ToT spectrum and hit rate are accumulated on the way and saved to snapshot_path
+    (default <output>_live.npz) every few seconds, for the dashboard to plot while the job runs.
+    hits_path: also write the hits as a compact .hits file (backend.hitstore) for time-window queries and event display.
+    With cache, an unchanged input file decoded by the same code is restored from the result cache.'''
+    stats = job.stats if job is not None else JobStats(enabled=False)
+    if snapshot_path is None:
+        snapshot_path = os.path.splitext(output_path)[0] + "_live.npz"
+    outputs = {"hits.parquet": output_path, "live.npz": snapshot_path}
+    if hits_path is not None:
+        outputs["hits.hits"] = hits_path
+        outputs["hits.idx.npy"] = hits_path + ".idx.npy"
+    if cache:
+        result_cache = ResultCache()
+        key = result_cache.key("interpretation", [input_path], {"compress_hits": compress_hits}, code_version(__name__, "backend.livehist", "backend.hitstore"))
+        summary = result_cache.get(key, outputs)
+        if summary is not None:
+            log(f"interpretation: {input_path} unchanged, {output_path} restored from the result cache")
+            if job is not None:
+                job.progress(1.0, "from cache")
+            return summary | {"input_path": str(input_path), "output_path": str(output_path), "snapshot_path": str(snapshot_path),
+                              "hits_path": hits_path and str(hits_path), "cached": True}
+    n_bytes = os.path.getsize(input_path)
+    if job is not None:
+        workers = min(workers or job.scheduler.pool_workers, job.scheduler.pool_workers)
+    workers = workers or os.cpu_count() or 1
+    log(f"interpretation: decoding {input_path} ({n_bytes / 1e6:.1f} MB)")
+
+    progress = {"bytes": 0, "next": 0.1}
+    histograms = LiveHistograms()
+    def report(done):
+        progress["bytes"] += done
+        histograms.save(snapshot_path, SNAPSHOT_INTERVAL_S)
+        if n_bytes and progress["bytes"] / n_bytes >= progress["next"]:# Progress every 10 %
+            log(f"interpretation: {100 * progress['bytes'] / n_bytes:.0f}%", level="DEBUG", bytes=progress["bytes"])
+            progress["next"] += 0.1
+        if job is not None:
+            job.progress(progress["bytes"] / max(n_bytes, 1))
+            job.check()
+
+    t0 = time.perf_counter()
+    tmp_path = f"{output_path}.{uuid.uuid4().hex[:8]}.part" # Only a complete file ever appears under output_path
+    hit_writer = HitWriter(hits_path, compress=compress_hits) if hits_path is not None else None
+    try:
+        with pq.ParquetWriter(tmp_path, HIT_SCHEMA, compression="zstd") as writer:
+            def sink(hits):
+                with stats.stage("write"):
+                    writer.write_table(hits_to_table(hits))
+                    if hit_writer is not None:
+                        hit_writer.write(hits)
+            ordered = OrderedHitWriter(sink)
+            if workers > 1 and n_bytes > 2 * chunk_words * 8:
+                if job is not None:
+                    _interpret_parallel(input_path, output_path, ordered, histograms, chunk_words, workers, report, job.process_pool(), stats)
+                else:
+                    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                        _interpret_parallel(input_path, output_path, ordered, histograms, chunk_words, workers, report, pool, stats)
+            else:
+                _interpret_serial(input_path, ordered, histograms, chunk_words, report, stats)
+            with stats.stage("sort"):
+                ordered.flush()
+        os.replace(tmp_path, output_path)
+        if hit_writer is not None:
+            hit_writer.close()
+            hit_writer = None
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if hit_writer is not None:
+            hit_writer.abort()
+
+    histograms.save(snapshot_path)
+    stats.count(bytes=progress["bytes"], hits=ordered.rows)
+    dt = max(time.perf_counter() - t0, 1e-9)
+    summary = {
+        "input_path": str(input_path),
+        "output_path": str(output_path),
+        "snapshot_path": str(snapshot_path),
+        "hits_path": hits_path and str(hits_path),
+        "bytes": progress["bytes"],
+        "hits": ordered.rows,
+        "seconds": dt,
+        "mb_per_s": progress["bytes"] / 1e6 / dt,
+        "hits_per_s": ordered.rows / dt,
+    }
+    log(f"interpretation: {ordered.rows} hits in {dt:.1f} s → {summary['mb_per_s']:.1f} MB/s, {summary['hits_per_s']:.3g} hits/s",
+        hits=ordered.rows, seconds=dt, mb_per_s=summary["mb_per_s"], hits_per_s=summary["hits_per_s"])
+    if cache:
+        result_cache.put(key, outputs, summary)
+    return summary
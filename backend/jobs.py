@@ -1,37 +1,479 @@
 #backend/jobs.py
-'''Job+Logging manager'''
+'''Job+Logging manager
 
+Jobs are queued in a Scheduler: a bounded number of supervisor threads run them in priority/FIFO order, CPU-bound
+stages share one process pool sized to the machine's cores, and every job's state is kept in a small SQLite file so
+queued and interrupted jobs submitted with resumable=True are picked up again after a dashboard restart. Other
+unfinished jobs (e.g. an HV ramp, which must not restart unattended) are marked interrupted instead.
+
+A target that takes a `job` keyword gets a JobContext for progress reporting, cooperative cancellation, the
+shared process pool and per-stage instrumentation (job.stats, recorded when the job is submitted with instrument=...). Targets must be importable module-level functions with JSON-serializable arguments.
+
+log() keeps structured records (time, job ID, level, message, numeric metrics) in a fixed-size ring buffer; a
+QueueListener thread spills them to a rotating file, so logging never waits on disk I/O.'''
+
+import atexit
+import cProfile
+import heapq
+import importlib
+import inspect
+import itertools
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import io
+import os
+import pstats
+import queue
+import resource
+import sqlite3
 import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-import logging
 
-jobs = {}
-logs = []
+JOB_DB = "jobs.sqlite"
+MAX_RUNNING = 2 # Jobs executing at the same time
+POOL_WORKERS = os.cpu_count() or 1 # Shared process pool for CPU-bound stages
+HISTORY = 50 # Finished jobs reloaded from the store on startup
+PROGRESS_DB_INTERVAL = 1.0 # Seconds between progress writes to the store
+LOG_CAPACITY = 10000 # Records kept in memory
+LOG_FILE = os.path.join("logs", "heastropix.log")
+LOG_FILE_BYTES = 5 << 20 # Rotate the spill file at this size
+LOG_FILE_BACKUPS = 5
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+LEVEL_ALIASES = {"WARN": "WARNING", "CRITICAL": "ERROR", "FATAL": "ERROR"} # Names of the logging module folded onto LEVELS
+INSTRUMENT = (None, "timers", "profile") # Off; stage timers, counters and peak memory; the same plus cProfile
+PROFILE_TOP = 25 # Functions kept from a job's cProfile output
+
+jobs = {} # job_id -> job record, read by the UI
+
+_versions = itertools.count(1)
+_version = 0
+
+def _changed():
+    global _version
+    _version = next(_versions)
+
+def version():
+    '''Counter that moves whenever a job's state, its progress or the log changes. The UI compares it with the
+    value it last rendered to skip redrawing when nothing happened.'''
+    return _version
+
+_records = deque(maxlen=LOG_CAPACITY) # Oldest records drop out in O(1)
+_records_lock = threading.Lock()
+_current = threading.local() # job_id of the job running in this thread, attached to its log records
+_spill_queue = queue.SimpleQueue()
+_spill_listener = None
+
+def format_record(record):
+    ts = datetime.fromtimestamp(record["ts"]).strftime("%H:%M:%S")
+    level = "" if record["level"] == "INFO" else f"{record['level']}: "
+    return f"[{ts}] {level}{record['msg']}"
+
+def normalize_level(level):
+    '''One of LEVELS for a level name in any case (logging module names accepted); ValueError for anything else'''
+    name = str(level).upper()
+    name = LEVEL_ALIASES.get(name, name)
+    if name not in LEVELS:
+        raise ValueError(f"Unknown log level {level!r}, use one of {', '.join(LEVELS)}")
+    return name
+
+def log(msg, level="INFO", job_id=None, **metrics):
+    '''Add a log record. Inside a job the job ID is filled in automatically; keyword arguments are kept as numeric
+    metrics (e.g. log("decoded", mb_per_s=120.5)). The level is normalized by normalize_level(), so a stored record
+    always has one of LEVELS.'''
+    level = normalize_level(level)
+    record = {
+        "ts": time.time(),
+        "job": job_id if job_id is not None else getattr(_current, "job_id", None),
+        "level": level,
+        "msg": msg,
+        "metrics": metrics,
+    }
+    with _records_lock:
+        _records.append(record)
+    if _spill_listener is not None:
+        _spill_queue.put(record)# Turned into a logging.LogRecord and written by the listener thread
+    _changed()# Every job state change is logged, so this covers those too
+
+def read_logs(job_id=None, level=None, limit=None):
+    '''Records of one job and/or at least `level`, oldest first, at most the `limit` newest'''
+    with _records_lock:
+        records = list(_records)
+    min_level = LEVELS.index(normalize_level(level)) if level is not None else 0
+    selected = []
+    for record in reversed(records):# Newest first, so a small limit stops early
+        if (job_id is None or record["job"] == job_id) and LEVELS.index(record["level"]) >= min_level:
+            selected.append(record)
+            if limit and len(selected) == limit:
+                break
+    return selected[::-1]
+
+class _LogLines:
+    '''Read-only view of the ring buffer as formatted lines, for code that used the old `logs` list'''
+
+    def __len__(self):
+        return len(_records)
+
+    def __getitem__(self, index):
+        with _records_lock:
+            records = list(_records)
+        if isinstance(index, slice):
+            return [format_record(r) for r in records[index]]
+        return format_record(records[index])
+
+    def __iter__(self):
+        return iter(self[:])
+
+logs = _LogLines()
+
+class _SpillListener(logging.handlers.QueueListener):
+    '''Converts the queued record dicts to LogRecords on the listener thread, off the logging caller's path'''
+
+    def prepare(self, record):
+        return logging.makeLogRecord({
+            "created": record["ts"], "msecs": record["ts"] % 1 * 1000, "levelno": getattr(logging, record["level"]),
+            "levelname": record["level"], "msg": record["msg"], "job": record["job"], "metrics": record["metrics"],
+        })
+
+def start_log_spill(path=LOG_FILE):
+    '''Write every log record to a rotating file from a background thread (idempotent)'''
+    global _spill_listener
+    if _spill_listener is not None:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_FILE_BYTES, backupCount=LOG_FILE_BACKUPS)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s job=%(job)s %(message)s %(metrics)s"))
+    _spill_listener = _SpillListener(_spill_queue, handler)
+    _spill_listener.start()
+    atexit.register(stop_log_spill)
+
+def stop_log_spill():
+    '''Write out the queued records and stop the spill thread'''
+    global _spill_listener
+    listener, _spill_listener = _spill_listener, None
+    if listener is not None:
+        listener.stop()
+
+
+class JobStats:
+    '''Wall-clock time per named stage and counters of one job. Stage times are exclusive: time spent in a nested
+    stage is counted only there. Disabled instances cost one attribute check per call, so targets can use them
+    unconditionally.'''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {} # name -> [seconds, calls]
+        self.counters = {}
+        self._open = [] # Time spent in nested stages, per open stage
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        self._open.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            nested = self._open.pop()
+            if self._open:
+                self._open[-1] += elapsed
+            self.add_time(name, elapsed - nested)
+
+    def add_time(self, name, seconds, calls=1):
+        if self.enabled:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+
+    def timed(self, name, iterable):
+        '''Yield from iterable, timing every step under `name` (e.g. reading chunks from a generator)'''
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
 
-def log(msg):
-    ts = datetime.now().strftime("%H:%M:%S")
-    logs.append(f"[{ts}] {msg}")
-    if len(logs) > 300:
-        del logs[0]
+    def count(self, **counters):
+        if self.enabled:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
 
-def start_job(name, target, *args, **kwargs):
-    def wrapper():
-        jobs[name]["status"] = "running"
+    def as_dict(self):
+        return {
+            "stages": {name: {"seconds": seconds, "calls": calls} for name, (seconds, calls) in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+
+class JobCancelled(Exception):
+    '''Raised inside a job target (by JobContext.check) when the job was cancelled'''
+
+
+class JobContext:
+    '''Handle passed to job targets that accept a `job` keyword'''
+
+    def __init__(self, scheduler, job_id):
+        self.scheduler = scheduler
+        self.job_id = job_id
+        self.cancel_event = threading.Event()
+        self._last_db_write = 0.0
+        self.stats = JobStats(enabled=jobs[job_id].get("instrument") is not None)
+
+    def progress(self, fraction, message=None):
+        '''Report progress (0..1) and an optional status message'''
+        record = jobs[self.job_id]
+        record["progress"] = float(fraction)
+        if message is not None:
+            record["message"] = message
+        _changed()
+        now = time.monotonic()
+        if now - self._last_db_write >= PROGRESS_DB_INTERVAL:
+            self._last_db_write = now
+            self.scheduler._store(self.job_id, "progress", "message")
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check(self):
+        '''Cancellation point: raises JobCancelled if the job was cancelled'''
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def process_pool(self):
+        return self.scheduler.process_pool()
+
+
+def _target_name(target):
+    return f"{target.__module__}:{target.__qualname__}"
+
+def _resolve_target(name):
+    module, _, qualname = name.partition(":")
+    obj = importlib.import_module(module)
+    for part in qualname.split("."):
+        obj = getattr(obj, part)
+    return obj
+
+def _to_json(value):
+    return json.dumps(value, default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o))
+
+
+class Scheduler:
+    '''Bounded priority queue of jobs with a persistent SQLite record of every job'''
+
+    COLUMNS = ("name", "target", "args", "kwargs", "priority", "status", "progress", "message",
+               "submitted", "started", "finished", "result", "error", "instrument", "stats", "resumable")
+    JSON_COLUMNS = ("args", "kwargs", "result", "stats")
+
+    def __init__(self, db_path=JOB_DB, max_running=MAX_RUNNING, pool_workers=POOL_WORKERS):
+        self.db_path = db_path
+        self.pool_workers = pool_workers
+        self._queue = [] # heap of (-priority, sequence, job_id)
+        self._sequence = itertools.count()
+        self._cv = threading.Condition()
+        self._db_lock = threading.Lock()
+        self._contexts = {} # job_id -> JobContext of queued/running jobs
+        self._pool = None
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, target TEXT, args TEXT, "
+            "kwargs TEXT, priority INTEGER, status TEXT, progress REAL, message TEXT, submitted TEXT, started TEXT, "
+            "finished TEXT, result TEXT, error TEXT, instrument TEXT, stats TEXT, resumable INTEGER)"
+        )
+        existing = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("instrument", "TEXT"), ("stats", "TEXT"), ("resumable", "INTEGER")):# Older job stores
+            if column not in existing:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._db.commit()
+        self._restore()
+        for i in range(max_running):
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True).start()
+
+    # ---- persistence ----
+    def _store(self, job_id, *fields):
+        record = jobs[job_id]
+        fields = fields or self.COLUMNS
+        values = [_to_json(record[f]) if f in self.JSON_COLUMNS else record[f] for f in fields]
+        with self._db_lock:
+            self._db.execute(f"UPDATE jobs SET {', '.join(f'{f} = ?' for f in fields)} WHERE id = ?", values + [job_id])
+            self._db.commit()
+
+    def _restore(self):
+        '''Reload recent history. Resumable jobs that were queued or interrupted by a restart are queued again, the
+        others are marked interrupted (they were submitted for the session that is gone)'''
+        with self._db_lock:
+            rows = self._db.execute(
+                f"SELECT id, {', '.join(self.COLUMNS)} FROM jobs WHERE status IN ('queued', 'running') "
+                f"OR id IN (SELECT id FROM jobs ORDER BY id DESC LIMIT {HISTORY}) ORDER BY id"
+            ).fetchall()
+        for row in rows:
+            record = dict(zip(("id",) + self.COLUMNS, row))
+            for f in self.JSON_COLUMNS:
+                record[f] = json.loads(record[f]) if record[f] is not None else None
+            jobs[record["id"]] = record
+            if record["status"] in ("queued", "running") and not record["resumable"]:
+                record.update(status="interrupted", finished=datetime.now().isoformat(timespec="seconds"),
+                              message=f"{'stopped' if record['status'] == 'running' else 'not started'} by a dashboard restart")
+                self._store(record["id"], "status", "message", "finished")
+                log(f"{record['name']} #{record['id']}: {record['message']}, not resumed", level="WARNING", job_id=record["id"])
+            elif record["status"] in ("queued", "running"):
+                if record["status"] == "running":
+                    record["message"] = "restarted after dashboard restart"
+                record.update(status="queued", progress=0.0)
+                self._store(record["id"], "status", "progress", "message")
+                self._enqueue(record["id"], record["priority"])
+                log(f"{record['name']} #{record['id']}: re-queued from job store", job_id=record["id"])
+
+    # ---- queue ----
+    def _enqueue(self, job_id, priority):
+        with self._cv:
+            self._contexts[job_id] = JobContext(self, job_id)
+            heapq.heappush(self._queue, (-priority, next(self._sequence), job_id))
+            self._cv.notify()
+
+    def submit(self, name, target, *args, priority=0, instrument=None, resumable=False, **kwargs):
+        '''Queue target(*args, **kwargs); higher priority runs first, FIFO among equals. Returns the job ID.
+        instrument: None, "timers" (stage timers, counters, peak memory) or "profile" (also cProfile), see INSTRUMENT
+        resumable: run the job again from the start if the dashboard restarts before it finished. Only for targets
+        that are safe to repeat (they rewrite their outputs atomically), never for anything driving hardware.'''
+        if instrument not in INSTRUMENT:
+            raise ValueError(f"instrument must be one of {INSTRUMENT}")
+        record = {
+            "name": name, "target": _target_name(target), "args": list(args), "kwargs": kwargs,
+            "priority": priority, "status": "queued", "progress": 0.0, "message": None,
+            "submitted": datetime.now().isoformat(timespec="seconds"), "started": None, "finished": None,
+            "result": None, "error": None, "instrument": instrument, "stats": None, "resumable": bool(resumable),
+        }
+        with self._db_lock:
+            cursor = self._db.execute(
+                f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                [_to_json(record[f]) if f in self.JSON_COLUMNS else record[f] for f in self.COLUMNS],
+            )
+            self._db.commit()
+            job_id = cursor.lastrowid
+        record["id"] = job_id
+        jobs[job_id] = record
+        self._enqueue(job_id, priority)
+        log(f"{name} #{job_id}: queued", job_id=job_id)
+        return job_id
+
+    def cancel(self, job_id):
+        '''Cancel a queued job, or ask a running one to stop at its next cancellation point'''
+        context = self._contexts.get(job_id)
+        if context is None:
+            return False
+        context.cancel_event.set()
+        record = jobs[job_id]
+        if record["status"] == "queued":
+            record.update(status="cancelled", finished=datetime.now().isoformat(timespec="seconds"))
+            self._store(job_id, "status", "finished")
+        else:
+            record["message"] = "cancelling…"
+        log(f"{record['name']} #{job_id}: cancel requested", job_id=job_id)
+        return True
+
+    def process_pool(self):
+        '''Process pool shared by all jobs, so parallel stages never use more than pool_workers cores in total'''
+        with self._cv:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.pool_workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    # ---- execution ----
+    def _worker(self):
+        while True:
+            with self._cv:
+                while not self._queue:
+                    self._cv.wait()
+                _, _, job_id = heapq.heappop(self._queue)
+                context = self._contexts[job_id]
+            if not context.cancelled():
+                self._run(job_id, context)
+            self._contexts.pop(job_id, None)
+
+    def _run(self, job_id, context):
+        record = jobs[job_id]
+        name = f"{record['name']} #{job_id}"
+        record.update(status="running", started=datetime.now().isoformat(timespec="seconds"))
+        self._store(job_id, "status", "started")
+        _current.job_id = job_id
         log(f"{name}: started")
+        profiler = cProfile.Profile() if record["instrument"] == "profile" else None
+        traced = record["instrument"] is not None and not tracemalloc.is_tracing()# Concurrent jobs share one tracer
+        if traced:
+            tracemalloc.start()
+        t0 = time.perf_counter()
         try:
-            result = target(*args, **kwargs)
-            jobs[name]["status"] = "done"
-            jobs[name]["result"] = result
-            log(f"{name}: finished successfully")
+            target = _resolve_target(record["target"])
+            kwargs = dict(record["kwargs"])
+            if "job" in inspect.signature(target).parameters:
+                kwargs["job"] = context
+            if profiler is not None:
+                profiler.enable()# Profiles this worker thread only
+            try:
+                result = target(*record["args"], **kwargs)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+            outcome = dict(status="done", result=result, progress=1.0)
+        except JobCancelled:
+            outcome = dict(status="cancelled")
         except Exception as e:
-            jobs[name]["status"] = "failed"
-            jobs[name]["error"] = str(e)
-            log(f"{name}: FAILED → {e}")
+            outcome = dict(status="failed", error=str(e))
+        finally:
+            _current.job_id = None
+        if record["instrument"] is not None:# Before the status changes, so a finished job always has its stats
+            record["stats"] = self._collect_stats(context.stats, time.perf_counter() - t0, traced, profiler)
+        record.update(outcome, finished=datetime.now().isoformat(timespec="seconds"))
+        if outcome["status"] == "done":
+            log(f"{name}: finished successfully", job_id=job_id)
+        elif outcome["status"] == "cancelled":
+            log(f"{name}: cancelled", job_id=job_id)
+        else:
+            log(f"{name}: FAILED → {outcome['error']}", level="ERROR", job_id=job_id)
+        self._store(job_id, "status", "progress", "message", "result", "error", "finished", "stats")
 
-    jobs[name] = {
-        "status": "queued",
-        "started": datetime.now()
-    }
+    @staticmethod
+    def _collect_stats(stats, seconds, traced, profiler):
+        collected = stats.as_dict() | {
+            "seconds": seconds,
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # Whole dashboard process, Linux KiB
+        }
+        if traced:
+            collected["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        if profiler is not None:
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            collected["profile"] = text.getvalue()
+        return collected
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    '''The process-wide scheduler, created on first use (worker processes importing this module never start one)'''
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            start_log_spill()
+            _scheduler = Scheduler()
+        return _scheduler
+
+def start_job(name, target, *args, priority=0, instrument=None, resumable=False, **kwargs):
+    return get_scheduler().submit(name, target, *args, priority=priority, instrument=instrument, resumable=resumable, **kwargs)
 
-    t = threading.Thread(target=wrapper, daemon=True)
-    t.start()
\ No newline at end of file
+def cancel_job(job_id):
+    return get_scheduler().cancel(job_id)
@@ -0,0 +1,208 @@
+#backend/livehist.py
+'''Running histograms of a run: pixel occupancy, ToT and cluster spectra, hit rate
+
+LiveHistograms is fed with the decoded hit blocks (and cluster summaries) as they are produced, so the dashboard
+never has to re-read the Parquet output. All arrays have a fixed size: the rate series keeps RATE_BINS bins and
+doubles its bin width when the run gets longer. save() writes an .npz snapshot atomically for the Streamlit
+process; view() reduces a snapshot to a few thousand values, so drawing costs the same for any run length.
+peak_resolution() and hist_peak() locate the main peak (e.g. the 55Fe line) of a spectrum and its relative FWHM.'''
+
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+TOA_NS = 1.5625 # Unit of the hit "toa" column, as backend.interpretation.TOA_NS (not imported, interpretation imports this module)
+N_PIXELS = 256
+TOT_BINS = 1024 # Full 10-bit ToT range
+CLUSTER_TOT_BINS = 512
+CLUSTER_TOT_MAX = 1 << 14
+CLUSTER_CHARGE_BINS = 512
+CLUSTER_CHARGE_MAX_E = 1e5 # Electrons, needs a ToT calibration
+RATE_BINS = 4096
+RATE_BIN_S = 1.0 # Initial hit-rate resolution (detector time)
+SNAPSHOT_INTERVAL_S = 2.0 # Minimum time between snapshot writes of a running job
+MIN_PEAK_SIZE = 5 # Clusters with fewer hits (noise, fragments) are left out of peak fits
+PEAK_BINS = 256
+PEAK_ITERATIONS = 8
+PEAK_WINDOW_SIGMA = 2.0 # Fit window around the peak, ± sigmas
+TRUNCATED_SIGMA = 0.8796 # RMS of a Gaussian cut at ±2 sigma, in sigmas
+FWHM_PER_SIGMA = 2.3548
+
+
+class LiveHistograms:
+    '''Fixed-size accumulators, safe to read from another thread while a job adds to them'''
+
+    def __init__(self, rate_bin_s=RATE_BIN_S):
+        self.occupancy = np.zeros((N_PIXELS, N_PIXELS), dtype=np.int64) # [col, row] like the calibration maps
+        self.tot_hist = np.zeros(TOT_BINS, dtype=np.int64)
+        self.cluster_tot_hist = np.zeros(CLUSTER_TOT_BINS, dtype=np.int64)
+        self.cluster_charge_hist = np.zeros(CLUSTER_CHARGE_BINS, dtype=np.int64)
+        self.rate = np.zeros(RATE_BINS, dtype=np.int64) # Hits per rate_bin_s, from detector time 0
+        self.rate_bin_s = rate_bin_s
+        self.n_hits = 0
+        self.n_clusters = 0
+        self.lock = threading.Lock()
+        self._last_save = 0.0
+
+    def _fold_rate(self, last_bin):
+        '''Merge pairs of rate bins until last_bin fits'''
+        while last_bin >= RATE_BINS:
+            self.rate = np.concatenate([self.rate.reshape(-1, 2).sum(axis=1), np.zeros(RATE_BINS // 2, dtype=np.int64)])
+            self.rate_bin_s *= 2
+            last_bin //= 2
+
+    def add_hits(self, hits):
+        '''Add a block of hits (dict with col, row, toa, tot arrays)'''
+        if not len(hits["toa"]):
+            return
+        col, row = hits["col"].astype(np.intp), hits["row"].astype(np.intp)
+        occupancy = np.bincount(col * N_PIXELS + row, minlength=N_PIXELS * N_PIXELS).reshape(N_PIXELS, N_PIXELS)
+        tot = np.bincount(np.minimum(hits["tot"], TOT_BINS - 1), minlength=TOT_BINS)
+        seconds = np.maximum(hits["toa"].astype(np.int64), 0) * (TOA_NS * 1e-9)
+        with self.lock:
+            self._fold_rate(int(seconds.max() / self.rate_bin_s))
+            rate = np.bincount((seconds / self.rate_bin_s).astype(np.intp), minlength=RATE_BINS)
+            self.occupancy += occupancy
+            self.tot_hist += tot
+            self.rate += rate
+            self.n_hits += len(hits["toa"])
+
+    def add_snapshot(self, snapshot):
+        '''Add the counts of another instance's snapshot() (e.g. one filled in a worker process)'''
+        rate, rate_bin_s = snapshot["rate"], snapshot["rate_bin_s"]
+        while rate_bin_s < self.rate_bin_s:# Bin widths only ever double from RATE_BIN_S, so one side folds onto the other
+            rate = np.concatenate([rate.reshape(-1, 2).sum(axis=1), np.zeros(RATE_BINS // 2, dtype=np.int64)])
+            rate_bin_s *= 2
+        with self.lock:
+            while self.rate_bin_s < rate_bin_s:
+                self._fold_rate(RATE_BINS)
+            self.rate += rate
+            self.occupancy += snapshot["occupancy"]
+            self.tot_hist += snapshot["tot_hist"]
+            self.cluster_tot_hist += snapshot["cluster_tot_hist"]
+            self.cluster_charge_hist += snapshot["cluster_charge_hist"]
+            self.n_hits += snapshot["hits"]
+            self.n_clusters += snapshot["clusters"]
+
+    def add_clusters(self, clusters):
+        '''Add cluster summaries (dict of columns, see backend.analysis.CLUSTER_SCHEMA)'''
+        if clusters is None or not len(clusters["size"]):
+            return
+        tot_bins = np.minimum(clusters["tot_sum"] * CLUSTER_TOT_BINS // CLUSTER_TOT_MAX, CLUSTER_TOT_BINS - 1).astype(np.intp)
+        charge = clusters["charge_sum"][np.isfinite(clusters["charge_sum"])]
+        charge_bins = np.clip(charge * (CLUSTER_CHARGE_BINS / CLUSTER_CHARGE_MAX_E), 0, CLUSTER_CHARGE_BINS - 1).astype(np.intp)
+        with self.lock:
+            self.cluster_tot_hist += np.bincount(tot_bins, minlength=CLUSTER_TOT_BINS)
+            self.cluster_charge_hist += np.bincount(charge_bins, minlength=CLUSTER_CHARGE_BINS)
+            self.n_clusters += len(clusters["size"])
+
+    def snapshot(self):
+        '''Copies of all accumulators'''
+        with self.lock:
+            return {
+                "hits": self.n_hits,
+                "clusters": self.n_clusters,
+                "occupancy": self.occupancy.copy(),
+                "tot_hist": self.tot_hist.copy(),
+                "cluster_tot_hist": self.cluster_tot_hist.copy(),
+                "cluster_charge_hist": self.cluster_charge_hist.copy(),
+                "rate": self.rate.copy(),
+                "rate_bin_s": self.rate_bin_s,
+            }
+
+    def save(self, path, min_interval=0.0):
+        '''Write a snapshot to `path` (.npz) via a temporary file, so readers never see a partial file.
+        With min_interval, calls closer together than that many seconds are skipped. Returns True if written.'''
+        now = time.monotonic()
+        if now - self._last_save < min_interval:
+            return False
+        self._last_save = now
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **self.snapshot())
+        os.replace(tmp, path)
+        return True
+
+
+def load_snapshot(path):
+    '''Read a snapshot written by LiveHistograms.save()'''
+    with np.load(path) as data:
+        snapshot = {name: data[name] for name in data.files}
+    for name in ("hits", "clusters", "rate_bin_s"):
+        snapshot[name] = snapshot[name].item()
+    return snapshot
+
+
+def _rebin(values, n_bins):
+    '''Sum neighbouring bins so that at most n_bins remain'''
+    factor = -(-len(values) // n_bins)
+    if factor <= 1:
+        return values, 1
+    padded = np.zeros(factor * -(-len(values) // factor), dtype=values.dtype)
+    padded[:len(values)] = values
+    return padded.reshape(-1, factor).sum(axis=1), factor
+
+
+def view(snapshot, pixel_bin=2, max_points=512):
+    '''Reduced arrays for plotting: occupancy summed over pixel_bin x pixel_bin pixels as a log-scaled uint8 image
+    ([row, col], row 0 at the top), spectra and the hit rate (hits/s, trailing empty bins dropped) with at most max_points values'''
+    occupancy = snapshot["occupancy"].reshape(N_PIXELS // pixel_bin, pixel_bin, N_PIXELS // pixel_bin, pixel_bin).sum(axis=(1, 3))
+    scaled = np.log1p(occupancy.T.astype(np.float64))
+    image = (255 * scaled / scaled.max()).astype(np.uint8) if scaled.max() > 0 else scaled.astype(np.uint8)
+
+    used = np.flatnonzero(snapshot["rate"])
+    rate = snapshot["rate"][:used[-1] + 1] if len(used) else snapshot["rate"][:0]
+    rate, factor = _rebin(rate, max_points)
+    tot_hist, _ = _rebin(snapshot["tot_hist"], max_points)
+    cluster_tot_hist, _ = _rebin(snapshot["cluster_tot_hist"], max_points)
+    cluster_charge_hist, _ = _rebin(snapshot["cluster_charge_hist"], max_points)
+    return {
+        "occupancy_image": image,
+        "rate": rate / (factor * snapshot["rate_bin_s"]),
+        "rate_bin_s": factor * snapshot["rate_bin_s"],
+        "tot_hist": tot_hist,
+        "cluster_tot_hist": cluster_tot_hist,
+        "cluster_charge_hist": cluster_charge_hist,
+    }
+
+
+def peak_resolution(values):
+    '''(peak position, relative FWHM) of the main peak: histogram maximum, then a few passes of mean and RMS in a
+    ±2 sigma window (RMS corrected for the truncation). (nan, nan) if there are too few values.'''
+    values = values[np.isfinite(values)]
+    if len(values) < PEAK_BINS:
+        return float("nan"), float("nan")
+    counts, edges = np.histogram(values, bins=PEAK_BINS, range=(0, np.percentile(values, 99.5)))
+    counts = np.convolve(counts, np.ones(5) / 5, mode="same") # Smooth so a single noisy bin does not win
+    mu = 0.5 * (edges[counts.argmax()] + edges[counts.argmax() + 1])
+    sigma = 0.1 * mu
+    for _ in range(PEAK_ITERATIONS):
+        window = values[np.abs(values - mu) < PEAK_WINDOW_SIGMA * sigma]
+        if len(window) < 2:
+            return float("nan"), float("nan")
+        mu, sigma = window.mean(), window.std() / TRUNCATED_SIGMA
+    return float(mu), float(FWHM_PER_SIGMA * sigma / mu)
+
+
+def hist_peak(counts, edges):
+    '''(peak position, relative FWHM) of the main peak of a histogram, like peak_resolution but on binned
+    data so that spectra of many runs can be summed first. (nan, nan) for an empty histogram.'''
+    counts = counts.astype(np.float64)
+    if counts[1:].sum() == 0:
+        return float("nan"), float("nan")
+    centers = 0.5 * (edges[:-1] + edges[1:])
+    smoothed = np.convolve(counts, np.ones(5) / 5, mode="same")
+    smoothed[0] = 0 # Underflow bin (clusters without charge)
+    mu = centers[smoothed.argmax()]
+    sigma = 0.1 * mu
+    for _ in range(PEAK_ITERATIONS):
+        window = np.abs(centers - mu) < PEAK_WINDOW_SIGMA * sigma
+        weight = counts[window].sum()
+        if weight == 0 or window.sum() < 2:
+            return float("nan"), float("nan")
+        mu = (counts[window] * centers[window]).sum() / weight
+        sigma = np.sqrt((counts[window] * (centers[window] - mu) ** 2).sum() / weight) / TRUNCATED_SIGMA
+    return float(mu), float(FWHM_PER_SIGMA * sigma / mu)
@@ -0,0 +1,164 @@
+#backend/resultcache.py
+'''Local cache of stage results (interpretation, analysis) so a repeated run with unchanged input, parameters and
+code restores its outputs instead of recomputing them
+
+An entry is keyed by the fingerprints of the input files (size, mtime and a hash of sampled blocks), the stage
+parameters and a hash of the source of the modules that compute it. result_cache/<key>/ holds the output files
+(hard links where possible, so caching costs no extra disk space until the originals are replaced) and meta.json
+with the stage summary. When the cache grows over its disk budget, the least recently used entries are removed.'''
+
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+from backend.jobs import log
+
+CACHE_DIR = "result_cache"
+CACHE_BUDGET_BYTES = 20 << 30
+SAMPLE_BLOCKS = 16 # Blocks hashed per file (first, last and evenly spaced in between)
+SAMPLE_BLOCK_BYTES = 1 << 16
+
+_code_versions = {}
+
+
+def fingerprint(path):
+    '''(size, mtime_ns, hash of sampled blocks) of a file: cheap even for multi-GB raw files'''
+    stat = os.stat(path)
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        last = max(stat.st_size - SAMPLE_BLOCK_BYTES, 0)
+        for offset in sorted(set(np.linspace(0, last, SAMPLE_BLOCKS).astype(np.int64).tolist())):
+            f.seek(offset)
+            h.update(f.read(SAMPLE_BLOCK_BYTES))
+    return [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+
+
+def code_version(*module_names):
+    '''Hash of the source files of the named modules; any edit to them invalidates the entries they produced'''
+    names = tuple(module_names)
+    if names not in _code_versions:
+        h = hashlib.sha1()
+        for name in names:
+            with open(inspect.getsourcefile(importlib.import_module(name)), "rb") as f:
+                h.update(f.read())
+        _code_versions[names] = h.hexdigest()[:16]
+    return _code_versions[names]
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:# Other file system, or no hard-link support
+        shutil.copy2(src, dst)
+
+
+class ResultCache:
+    '''Directory of cached stage outputs with LRU eviction under budget_bytes'''
+
+    def __init__(self, cache_dir=CACHE_DIR, budget_bytes=CACHE_BUDGET_BYTES):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+
+    def key(self, stage, inputs, params, code):
+        '''Entry key of `stage` run on the files `inputs` with `params` (JSON-serializable) and code version `code`'''
+        description = {
+            "stage": stage,
+            "inputs": [fingerprint(path) for path in inputs],
+            "params": params,
+            "code": code,
+        }
+        return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, key, "meta.json")
+
+    def _write_meta(self, key, meta):
+        path = self._meta_path(key)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+
+    def get(self, key, outputs):
+        '''Restore a cached entry: outputs maps output names to destination paths. Returns the stored summary,
+        or None on a miss (or if the entry is incomplete).'''
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        entry = os.path.join(self.cache_dir, key)
+        if set(outputs) - set(meta["outputs"]) or not all(os.path.exists(os.path.join(entry, name)) for name in outputs):
+            return None
+        for name, dst in outputs.items():
+            tmp = f"{dst}.{uuid.uuid4().hex[:8]}.part"
+            _link_or_copy(os.path.join(entry, name), tmp)
+            os.replace(tmp, dst)
+        meta["last_used"] = time.time()
+        self._write_meta(key, meta)
+        return meta["summary"]
+
+    def put(self, key, outputs, summary):
+        '''Store the files outputs (name -> path) and the summary dict under key, then evict down to the budget'''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = os.path.join(self.cache_dir, key)
+        tmp_entry = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex[:8]}")
+        os.makedirs(tmp_entry)
+        try:
+            for name, src in outputs.items():
+                _link_or_copy(src, os.path.join(tmp_entry, name))
+            now = time.time()
+            meta = {"outputs": sorted(outputs), "summary": summary, "created": now, "last_used": now, "size": _dir_size(tmp_entry)}
+            with open(os.path.join(tmp_entry, "meta.json"), "w") as f:
+                json.dump(meta, f, default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o))
+            old_entry = None
+            if os.path.isdir(entry):# Stored before without an output asked for now (get missed): replace it
+                old_entry = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex[:8]}.old")
+                os.rename(entry, old_entry)
+            os.rename(tmp_entry, entry)
+            if old_entry is not None:
+                shutil.rmtree(old_entry, ignore_errors=True)
+        except OSError:# Entry stored meanwhile by a concurrent job with the same key, or the disk is full
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        '''(key, meta) of every complete entry'''
+        if not os.path.isdir(self.cache_dir):
+            return []
+        result = []
+        for key in os.listdir(self.cache_dir):
+            if key.startswith("."):
+                continue
+            try:
+                with open(self._meta_path(key)) as f:
+                    result.append((key, json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def evict(self):
+        '''Remove least recently used entries until the cache fits the budget. Returns the number removed.'''
+        entries = sorted(self.entries(), key=lambda item: item[1]["last_used"])
+        total = sum(meta["size"] for _, meta in entries)
+        removed = 0
+        for key, meta in entries:
+            if total <= self.budget_bytes:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= meta["size"]
+            removed += 1
+        if removed:
+            log(f"result cache: evicted {removed} entries, {total / 2**30:.1f} GiB in use")
+        return removed
@@ -0,0 +1,208 @@
+#backend/sweep.py
+'''Parameter sweeps of the event building: one interpreted hit file clustered with every point of a parameter grid
+
+The hits are read from Parquet once into a shared memory block; every grid point is one task on the process pool
+that maps the block (no copy, no re-read) and runs the streaming Clusterer over it. Each task returns only a
+handful of numbers, so a sweep costs one read plus N clustering passes instead of N full pipelines.
+
+Grid parameters:
+    clustering_gap  ToA gap between events, 25 ns cycles
+    radius          spatial cell size in pixels
+    min_tot         offline threshold: hits with a lower ToT are dropped before clustering
+    thl             offline threshold as a THL DAC value, needs a ToT calibration (hit charge below
+                    dacphysics.thlDAC_to_electrons(thl) is dropped)
+
+Per grid point: number of clusters, cluster multiplicity (hits per cluster), relative energy resolution (FWHM) of
+the main peak of the cluster charge spectrum (ToT sum without a calibration), i.e. the 5.9 keV line of a 55Fe run,
+and the fraction of split tracks (clusters with a close neighbour in time and space, which a larger gap or
+radius would have merged).'''
+
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from backend.jobs import log, JobStats
+from backend.analysis import BATCH_ROWS, HIT_COLUMNS, RADIUS, Clusterer, iter_hit_batches
+from backend.dacphysics import thlDAC_to_electrons
+from backend.interpretation import TOA_NS
+from backend.livehist import MIN_PEAK_SIZE, peak_resolution
+from backend.totcalib import hits_to_electrons
+
+GRID_DEFAULTS = {"clustering_gap": 50, "radius": RADIUS, "min_tot": 0, "thl": None}
+SPLIT_WINDOW_NS = 1000.0 # Clusters starting this close after a neighbour ...
+SPLIT_DISTANCE_PX = 20.0 # ... with the centroid this close count as split tracks
+MIN_SPLIT_SIZE = 2 # Single-hit clusters (noise) are never counted as split tracks
+
+
+def expand_grid(grid):
+    '''List of parameter dicts, one per combination of the grid values (missing parameters at their defaults)'''
+    unknown = set(grid) - set(GRID_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+    names = list(GRID_DEFAULTS)
+    values = [list(grid.get(name) or [GRID_DEFAULTS[name]]) for name in names]
+    return [dict(zip(names, point)) for point in itertools.product(*values)]
+
+
+def split_fraction(toa_start, col, row, size):
+    '''Fraction of clusters (with at least MIN_SPLIT_SIZE hits) that start within SPLIT_WINDOW_NS of the previous
+    such cluster and lie within SPLIT_DISTANCE_PX of it'''
+    keep = size >= MIN_SPLIT_SIZE
+    if keep.sum() < 2:
+        return 0.0
+    order = np.argsort(toa_start[keep], kind="stable")
+    toa, col, row = toa_start[keep][order].astype(np.int64), col[keep][order], row[keep][order]
+    close = (np.diff(toa) * TOA_NS < SPLIT_WINDOW_NS) & (np.hypot(np.diff(col), np.diff(row)) < SPLIT_DISTANCE_PX)
+    return float(close.sum() / len(toa))
+
+
+def _share_hits(parquet_path, batch_rows=BATCH_ROWS):
+    '''Read the hit columns into one shared memory block. Returns the block and its layout:
+    (n_hits, [(column, dtype, byte offset)]), from which workers rebuild the arrays.'''
+    with pq.ParquetFile(parquet_path) as f:
+        n_hits = f.metadata.num_rows
+        schema = f.schema_arrow
+    layout, offset = [], 0
+    for name in HIT_COLUMNS:
+        dtype = np.dtype(schema.field(name).type.to_pandas_dtype())
+        layout.append((name, dtype.str, offset))
+        offset += -(-n_hits * dtype.itemsize // 8) * 8 # 8-byte aligned columns
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    try:
+        arrays = _views(block, n_hits, layout)
+        row = 0
+        for batch in iter_hit_batches(parquet_path, batch_rows):
+            n = len(batch["toa"])
+            for name in HIT_COLUMNS:
+                arrays[name][row:row + n] = batch[name]
+            row += n
+        del arrays# The block cannot be closed while views into it exist
+    except BaseException:# A failed read must not leave a run-sized segment behind in /dev/shm
+        block.close()
+        block.unlink()
+        raise
+    return block, (n_hits, layout)
+
+
+def _views(block, n_hits, layout):
+    return {name: np.ndarray(n_hits, dtype=dtype, buffer=block.buf, offset=offset) for name, dtype, offset in layout}
+
+
+def _sweep_point(block_name, hits_layout, point, calibration, batch_rows=BATCH_ROWS):
+    '''Process pool worker: cluster the shared hits with one grid point and reduce the clusters to the sweep metrics'''
+    t0 = time.perf_counter()
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        n_hits, layout = hits_layout
+        hits = _views(block, n_hits, layout)
+        min_charge = thlDAC_to_electrons(point["thl"]) if point["thl"] is not None else None
+        clusterer = Clusterer(point["clustering_gap"], point["radius"], calibration)
+        columns = {name: [] for name in ("size", "tot_sum", "charge_sum", "col_centroid", "row_centroid", "toa_start")}
+
+        def add(clusters):
+            if clusters is not None:
+                for name, values in columns.items():
+                    values.append(clusters[name])
+
+        n_kept = 0
+        for start in range(0, n_hits, batch_rows):
+            batch = {name: values[start:start + batch_rows] for name, values in hits.items()}
+            keep = batch["tot"] >= point["min_tot"]
+            if min_charge is not None:
+                keep &= hits_to_electrons(calibration, batch["col"], batch["row"], batch["tot"]) >= min_charge
+            batch = {name: values[keep] for name, values in batch.items()}# Copies, the carried-over hits must not point into the block
+            n_kept += len(batch["toa"])
+            add(clusterer.push(batch))
+        add(clusterer.flush())
+        del hits# The block cannot be closed while views into it exist
+    finally:
+        block.close()
+    columns = {name: np.concatenate(values) if values else np.zeros(0) for name, values in columns.items()}
+    size = columns["size"]
+    spectrum = columns["charge_sum"] if calibration is not None else columns["tot_sum"].astype(np.float64)
+    peak, resolution = peak_resolution(spectrum[size >= MIN_PEAK_SIZE])
+    return point | {
+        "hits": n_kept,
+        "clusters": len(size),
+        "hits_per_cluster": float(size.mean()) if len(size) else float("nan"),
+        "median_size": float(np.median(size)) if len(size) else float("nan"),
+        "peak": peak,
+        "peak_unit": "e-" if calibration is not None else "ToT",
+        "fwhm_resolution": resolution,
+        "split_fraction": split_fraction(columns["toa_start"], columns["col_centroid"], columns["row_centroid"], size),
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+def run_sweep(parquet_path, grid, calibration=None, output_path=None, workers=None, job=None):
+    '''Job target: cluster an interpreted hit file with every combination of the grid values (dict of parameter ->
+    list, see the module docstring) and write one row of metrics per point to output_path (default <input>_sweep.csv).
+    Run as a scheduler job, the points run on the scheduler's shared process pool.'''
+    stats = job.stats if job is not None else JobStats(enabled=False)
+    points = expand_grid(grid)
+    if isinstance(calibration, (str, os.PathLike)):
+        calibration = np.load(calibration)
+    if calibration is None and any(point["thl"] is not None for point in points):
+        raise ValueError("A THL sweep needs a ToT calibration (hit charge in electrons)")
+    if output_path is None:
+        output_path = os.path.splitext(parquet_path)[0] + "_sweep.csv"
+
+    t0 = time.perf_counter()
+    own_pool = None
+    futures, rows = [], []
+    with stats.stage("read"):
+        block, hits_layout = _share_hits(parquet_path)
+    try:# From here on the shared block is unlinked whatever happens
+        n_hits = hits_layout[0]
+        log(f"sweep: {len(points)} grid points over {n_hits} hits from {parquet_path}")
+        stats.count(hits=n_hits, points=len(points))
+        if job is not None:
+            pool = job.process_pool()
+        else:
+            own_pool = pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
+        futures = [pool.submit(_sweep_point, block.name, hits_layout, point, calibration) for point in points]
+        pending = set(futures)
+        while pending:
+            with stats.stage("wait"):
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                row = future.result()
+                stats.add_time("cluster (workers)", row["seconds"])
+                rows.append(row)
+                log(f"sweep: gap {row['clustering_gap']}, radius {row['radius']}, min ToT {row['min_tot']}, THL {row['thl']} → "
+                    f"{row['clusters']} clusters, {row['hits_per_cluster']:.1f} hits/cluster, FWHM {100 * row['fwhm_resolution']:.1f}%, "
+                    f"split {100 * row['split_fraction']:.1f}%", level="DEBUG", **{k: v for k, v in row.items() if k != "peak_unit"})
+            if job is not None:
+                job.progress(len(rows) / len(points), f"{len(rows)}/{len(points)} points")
+                job.check()
+    finally:
+        for future in futures:# Nothing left to wait for on failure or cancellation
+            future.cancel()
+        for future in futures:
+            if not future.cancelled():
+                future.exception()
+        if own_pool is not None:
+            own_pool.shutdown()
+        block.close()
+        block.unlink()
+
+    rows.sort(key=lambda row: [(row[name] is not None, row[name]) for name in GRID_DEFAULTS])
+    for row in rows:
+        del row["seconds"]
+    with stats.stage("write"):
+        tmp = output_path + ".tmp"
+        with open(tmp, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else list(GRID_DEFAULTS))
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp, output_path)
+    dt = time.perf_counter() - t0
+    log(f"sweep: {len(points)} points in {dt:.1f} s → {output_path}", points=len(points), seconds=dt)
+    return {"parquet_path": str(parquet_path), "output_path": str(output_path), "hits": n_hits, "seconds": dt, "points": rows}
@@ -0,0 +1,161 @@
+#backend/totcalib.py
+'''Per-pixel ToT -> charge calibration: batched surrogate fit of test-pulse scans and a binary parameter cache'''
+
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+from backend.jobs import log
+from backend.dacphysics import tot_to_electrons, pixel_lookup
+
+CALIB_DIR = "calib_cache"
+PARAMS = ("a", "b", "c", "t") # ToT = a*x + b - c/(x - t), x in electrons
+N_T_GRID = 64 # Candidate pole positions scanned per fit
+MIN_POINTS = 4 # Scan points a pixel needs for a fit (4 parameters)
+REFINE_STEPS = 30 # Golden-section steps of the pole after the grid scan (interval shrinks 0.618x per step)
+GOLDEN = (np.sqrt(5.0) - 1) / 2
+RIDGE = 1e-12 # Absolute ridge of the scaled normal equations, keeps pixels with degenerate scans solvable
+
+
+def scan_hash(charges, tot_mean):
+    '''Short content hash of a test-pulse scan, used as cache key together with the chip ID'''
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(charges, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(tot_mean, dtype=np.float32).tobytes())
+    return h.hexdigest()[:16]
+
+
+def cache_path(chip_id, hash_):
+    return os.path.join(CALIB_DIR, f"{chip_id}_{hash_}.npy")
+
+
+def _fit_pole(charges, y, valid, t):
+    '''Weighted least squares of (a, b, c) for every pixel with the pole t (scalar or one value per pixel).
+
+    The features are scaled to unit maximum per pixel before the 3x3 normal equations are formed (x is ~1e3-1e5
+    electrons, 1/(x - t) ~1e-3 and below), and a small absolute ridge keeps degenerate pixels solvable. Pixels with
+    fewer than MIN_POINTS usable points are not solved at all. The residual is computed from the fitted model,
+    not from the normal equations, so it does not cancel away for good fits.
+    Returns theta (n_pixels, 3), NaN where not fitted, and the residual sum of squares (inf where not fitted).'''
+    x = charges[:, None]
+    t = np.asarray(t, dtype=np.float64)
+    w = (valid & (x > t)).astype(np.float64)
+    pole = -w / np.where(x > t, x - t, 1.0)
+    fit = w.sum(axis=0) >= MIN_POINTS
+    sx = charges.max()
+    sp = np.abs(pole).max(axis=0)
+    sp[sp == 0] = 1.0
+    xs, ps, wy = w * (x / sx), pole / sp, w * y
+    # Scaled normal equations from the six distinct moments (features x/sx, 1, pole/sp)
+    m_xx, m_x, m_xp = (xs * (x / sx)).sum(axis=0), xs.sum(axis=0), (xs * ps).sum(axis=0)
+    m_1, m_p, m_pp = w.sum(axis=0), ps.sum(axis=0), (ps * ps).sum(axis=0)
+    lhs = np.stack([m_xx, m_x, m_xp, m_x, m_1, m_p, m_xp, m_p, m_pp], axis=-1)[fit].reshape(-1, 3, 3) + RIDGE * np.eye(3)
+    rhs = np.stack([(wy * (x / sx)).sum(axis=0), wy.sum(axis=0), (wy * ps).sum(axis=0)], axis=-1)[fit]
+    solved = np.linalg.solve(lhs, rhs[..., None])[..., 0] / np.stack([np.full(sp.shape, sx), np.ones_like(sp), sp], axis=-1)[fit]
+    theta = np.full((y.shape[1], 3), np.nan)
+    theta[fit] = solved
+    a, b, c = (np.where(fit, theta[:, j], 0.0) for j in range(3))
+    residual = y - (a * x + b) - c * pole # pole is 0 where w is 0, those points are weighted out anyway
+    sse = np.where(fit, (w * residual ** 2).sum(axis=0), np.inf)
+    return theta, sse
+
+
+def fit_tot_calibration(charges, tot_mean, t_grid=None):
+    '''Fit the ToT surrogate for every pixel at once.
+
+    charges: (n_points,) injected charge per scan point in electrons
+    tot_mean: (n_points, 256, 256) mean ToT per pixel and scan point, NaN where the pixel did not respond
+
+    For a fixed pole t the model is linear in (a, b, c), so each candidate t is one batched 3x3 weighted
+    least-squares solve over all pixels; the t with the smallest residual is kept per pixel and then refined by a
+    per-pixel golden-section search between its neighbours on the grid.
+    Returns a float32 array (4, 256, 256) with the a, b, c, t maps (NaN for pixels that could not be fitted).'''
+    charges = np.asarray(charges, dtype=np.float64)
+    shape = tot_mean.shape[1:]
+    y = np.asarray(tot_mean, dtype=np.float64).reshape(len(charges), -1) # (n_points, n_pixels)
+    valid = np.isfinite(y)
+    y = np.where(valid, y, 0.0)
+    if t_grid is None:# Pole must stay below the smallest injected charge
+        t_grid = np.linspace(0.0, 0.95 * charges.min(), N_T_GRID)
+    t_grid = np.asarray(t_grid, dtype=np.float64)
+
+    n_pixels = y.shape[1]
+    best_sse = np.full(n_pixels, np.inf)
+    best_k = np.zeros(n_pixels, dtype=np.intp)
+    for k, t in enumerate(t_grid):
+        _, sse = _fit_pole(charges, y, valid, t)
+        better = sse < best_sse
+        best_sse[better] = sse[better]
+        best_k[better] = k
+    fitted = np.isfinite(best_sse)
+
+    # Golden-section search of t on [previous, next grid point] around the best grid point of every pixel
+    low = t_grid[np.maximum(best_k - 1, 0)]
+    high = t_grid[np.minimum(best_k + 1, len(t_grid) - 1)]
+    inner_low = high - GOLDEN * (high - low)
+    inner_high = low + GOLDEN * (high - low)
+    sse_low = _fit_pole(charges, y, valid, inner_low)[1]
+    sse_high = _fit_pole(charges, y, valid, inner_high)[1]
+    for _ in range(REFINE_STEPS):
+        left = sse_low <= sse_high # Minimum in [low, inner_high]
+        high = np.where(left, inner_high, high)
+        low = np.where(left, low, inner_low)
+        inner_high, sse_high = np.where(left, inner_low, inner_high), np.where(left, sse_low, sse_high)
+        inner_low, sse_low = np.where(left, inner_low, inner_high), np.where(left, sse_low, sse_high)
+        probe = np.where(left, high - GOLDEN * (high - low), low + GOLDEN * (high - low))
+        sse_probe = _fit_pole(charges, y, valid, probe)[1]
+        inner_low, sse_low = np.where(left, probe, inner_low), np.where(left, sse_probe, sse_low)
+        inner_high, sse_high = np.where(left, inner_high, probe), np.where(left, sse_high, sse_probe)
+    t = 0.5 * (low + high)
+    theta, sse = _fit_pole(charges, y, valid, t)
+    keep_grid = ~(sse <= best_sse) # Never worse than the grid point
+    theta_grid, _ = _fit_pole(charges, y, valid, t_grid[best_k])
+    theta[keep_grid] = theta_grid[keep_grid]
+    t = np.where(keep_grid, t_grid[best_k], t)
+
+    best = np.full((4, n_pixels), np.nan)
+    best[:3, fitted] = theta[fitted].T
+    best[3, fitted] = t[fitted]
+    return best.reshape((4,) + shape).astype(np.float32)
+
+
+def load_or_fit(chip_id, charges, tot_mean):
+    '''Calibration maps for this chip and scan: read from the cache, or fitted and cached on first use'''
+    path = cache_path(chip_id, scan_hash(charges, tot_mean))
+    if os.path.exists(path):
+        log(f"totcalib: using cached calibration {path}")
+        return np.load(path)
+    params = fit_tot_calibration(charges, tot_mean)
+    os.makedirs(CALIB_DIR, exist_ok=True)
+    tmp = path + ".tmp.npy"
+    np.save(tmp, params)
+    os.replace(tmp, path)# Never leave a half-written cache file behind
+    log(f"totcalib: fitted {np.isfinite(params[0]).sum()} pixels, cached as {path}")
+    return params
+
+
+def load_calibration(chip_id, hash_=None):
+    '''Cached calibration maps of a chip; the most recent one if no scan hash is given'''
+    if hash_ is not None:
+        return np.load(cache_path(chip_id, hash_))
+    paths = glob.glob(os.path.join(CALIB_DIR, f"{chip_id}_*.npy"))
+    if not paths:
+        raise FileNotFoundError(f"No ToT calibration cached for chip {chip_id} in {CALIB_DIR}")
+    return np.load(max(paths, key=os.path.getmtime))
+
+
+def hits_to_electrons(params, col, row, tot):
+    '''Charge (electrons) of each hit from its ToT and the calibration of its pixel'''
+    a, b, c, t = (pixel_lookup(p, col, row) for p in params)
+    return tot_to_electrons(tot, a, b, c, t)
+
+
+def run_tot_calibration(scan_path, chip_id):
+    '''Job target: fit (or fetch from the cache) the calibration of a test-pulse scan stored as .npz
+    with "charge" (n_points,) in electrons and "tot" (n_points, 256, 256) mean ToT arrays'''
+    with np.load(scan_path) as scan:
+        charges, tot_mean = scan["charge"], scan["tot"]
+    params = load_or_fit(chip_id, charges, tot_mean)
+    return {"chip_id": chip_id, "path": cache_path(chip_id, scan_hash(charges, tot_mean)), "fitted_pixels": int(np.isfinite(params[0]).sum())}
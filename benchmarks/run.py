@@ -0,0 +1,247 @@
+#benchmarks/run.py
+'''Benchmark harness for the performance-critical paths
+
+Run from the repository root:
+    python -m benchmarks.run                      # all benchmarks, default sizes
+    python -m benchmarks.run --hits 2000000 --only decode cluster
+    python -m benchmarks.run --compare benchmarks/results/<previous>.json
+
+Every benchmark runs in a fresh process, so its peak RSS (including pool workers) is its own. Results are
+written to benchmarks/results/<date>_<git commit>.json together with the machine and library versions;
+--compare prints the throughput ratio against an earlier file and flags slowdowns.'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from benchmarks.synthetic import encode_raw, make_hits, write_raw
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+DEFAULT_HITS = 5_000_000
+CLUSTER_GAPS = (10, 50, 200) # clustering_gap values in 25 ns cycles
+PARALLEL_CHUNK_WORDS = 1 << 18 # Small enough that the default run is split over all workers
+HV_SESSIONS = 200
+HV_ROWS_PER_SESSION = 2000
+STARTUP_TARGET_S = 1.5 # Dashboard cold start, same target as app.STARTUP_TARGET_S
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SLOWDOWN_WARN = 0.9 # --compare flags benchmarks below this fraction of the previous throughput
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+# ---- benchmarks: each returns {"seconds", "hits" and/or "bytes", ...} ----
+def bench_decode(n_hits, hit_rate, tmp_dir, workers=1, chunk_words=None):
+    '''run_interpretation end to end (mmap, decode, ToA merge, Parquet write)'''
+    from backend.interpretation import CHUNK_WORDS, run_interpretation
+    raw_path = os.path.join(tmp_dir, "bench.dat")
+    write_raw(raw_path, n_hits, hit_rate=hit_rate)
+    summary, dt = _timed(run_interpretation, raw_path, os.path.join(tmp_dir, "bench.parquet"),
+                         chunk_words=chunk_words or CHUNK_WORDS, workers=workers, cache=False)
+    return {"seconds": dt, "hits": summary["hits"], "bytes": summary["bytes"], "workers": workers}
+
+def bench_decode_memory(n_hits, hit_rate, tmp_dir):
+    '''HitDecoder.decode on words already in memory (packet decoding and ToA extension only)'''
+    from backend.interpretation import CHUNK_WORDS, HitDecoder
+    raw = encode_raw(make_hits(n_hits, hit_rate=hit_rate))
+    decoder = HitDecoder()
+    t0 = time.perf_counter()
+    hits = sum(len(decoder.decode(raw[i:i + CHUNK_WORDS])["toa"]) for i in range(0, len(raw), CHUNK_WORDS))
+    return {"seconds": time.perf_counter() - t0, "hits": hits, "bytes": raw.nbytes}
+
+def bench_sort(n_hits, hit_rate, tmp_dir):
+    '''sort_hits on a ToA-shuffled block (worst case of the per-chunk sort)'''
+    from backend.interpretation import sort_hits
+    hits = make_hits(n_hits, hit_rate=hit_rate)
+    rng = np.random.default_rng(1)
+    order = rng.permutation(n_hits)
+    block = {"col": hits["col"][order], "row": hits["row"][order], "toa": hits["coarse"][order] * 16, "tot": hits["tot"][order]}
+    _, dt = _timed(sort_hits, block)
+    return {"seconds": dt, "hits": n_hits}
+
+def bench_cluster(n_hits, hit_rate, tmp_dir, clustering_gap=50):
+    '''Streaming Clusterer over ToA-sorted blocks of BATCH_ROWS hits'''
+    from backend.analysis import BATCH_ROWS, Clusterer
+    hits = make_hits(n_hits, hit_rate=hit_rate)
+    hits = {"col": hits["col"], "row": hits["row"], "toa": (hits["coarse"] * 16).astype(np.uint64), "tot": hits["tot"]}
+    clusterer = Clusterer(clustering_gap)
+    t0 = time.perf_counter()
+    for i in range(0, n_hits, BATCH_ROWS):
+        clusterer.push({name: values[i:i + BATCH_ROWS] for name, values in hits.items()})
+    clusterer.flush()
+    return {"seconds": time.perf_counter() - t0, "hits": n_hits, "clusters": clusterer.n_clusters, "clustering_gap": clustering_gap}
+
+def bench_dacphysics(n_hits, hit_rate, tmp_dir):
+    '''Per-hit ToT -> electrons with per-pixel maps, and the DAC conversions, on n_hits-long arrays'''
+    from backend.dacphysics import electrons_to_thlDAC, electrons_to_tot, electrons_to_vtpFDAC, thlDAC_to_electrons, vtpDAC_to_electrons
+    from backend.totcalib import hits_to_electrons
+    rng = np.random.default_rng(2)
+    params = np.stack([rng.normal(m, s, (256, 256)) for m, s in ((0.02, 0.001), (10, 1), (500, 50), (100, 5))]).astype(np.float32)
+    col, row = rng.integers(0, 256, n_hits).astype(np.uint8), rng.integers(0, 256, n_hits).astype(np.uint8)
+    tot = rng.integers(1, 1024, n_hits).astype(np.uint16)
+    electrons = rng.uniform(500, 20000, n_hits)
+    t0 = time.perf_counter()
+    hits_to_electrons(params, col, row, tot)
+    electrons_to_tot(electrons, *params[:, 10, 10])
+    thlDAC_to_electrons(electrons_to_thlDAC(electrons))
+    vtpDAC_to_electrons(rng.integers(0, 512, n_hits), 100)
+    electrons_to_vtpFDAC(electrons)# Part of the range is above the Fine DAC range and only gets flagged
+    return {"seconds": time.perf_counter() - t0, "hits": n_hits}
+
+def bench_hv_ingest(n_hits, hit_rate, tmp_dir, sessions=HV_SESSIONS, rows=HV_ROWS_PER_SESSION):
+    '''hvarchive.ingest of many session logs: cold index build, then an incremental update after one file changed'''
+    from backend.hvarchive import ingest
+    from backend.hvlog import HVLogWriter
+    rng = np.random.default_rng(3)
+    start = datetime(2025, 1, 1)
+    for s in range(sessions):
+        t = start + timedelta(days=s)
+        writer = HVLogWriter(os.path.join(tmp_dir, f"hv_log_{t:%Y-%m-%d_%H-%M-%S}.csv"), operator=f"op{s % 5}", setup_info=f"setup {s % 3}", flush_interval=3600)
+        for i in range(rows):
+            writer.log(i % 63 + 1, "READBACK" if i % 4 else f"CH{i % 3 + 1}", True, *rng.integers(0, 2500, 3).tolist(),
+                       timestamp=t + timedelta(seconds=i), timespec="milliseconds")
+        writer.close()
+    _, cold = _timed(ingest, tmp_dir)
+    with open(os.path.join(tmp_dir, f"hv_log_{start:%Y-%m-%d_%H-%M-%S}.csv"), "a") as f:
+        f.write(f"{start.isoformat()},01,NOTE,,0,0,0,touched\n")
+    _, incremental = _timed(ingest, tmp_dir)
+    size = sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir) if name.endswith(".csv"))
+    return {"seconds": cold, "bytes": size, "rows": sessions * rows, "incremental_seconds": incremental}
+
+STARTUP_SCRIPT = """
+import json, os, sys, time
+sys.path.insert(0, {repo!r})
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+if __name__ == "__main__":
+    at = AppTest.from_file({app!r}, default_timeout=60).run()
+    print(json.dumps({{"seconds": time.perf_counter() - t0, "exceptions": len(at.exception), "app_startup_s": at.session_state["startup_s"]}}), flush=True)
+    os._exit(0)# The scheduler threads of the app would keep the interpreter alive
+"""
+
+def bench_startup(n_hits, hit_rate, tmp_dir):
+    '''Dashboard cold start: a fresh interpreter importing Streamlit and rendering app.py once (working directory
+    tmp_dir, so the job store and logs start empty). n_hits is not used.'''
+    script = os.path.join(tmp_dir, "startup.py")
+    with open(script, "w") as f:
+        f.write(STARTUP_SCRIPT.format(repo=REPO_DIR, app=os.path.join(REPO_DIR, "app.py")))
+    out = subprocess.run([sys.executable, script], cwd=tmp_dir, capture_output=True, text=True, check=True, timeout=300).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result["over_target"] = result["seconds"] > STARTUP_TARGET_S
+    return result
+
+
+def benchmarks(n_hits, hit_rate):
+    '''name -> (function, kwargs) of every benchmark'''
+    table = {
+        "decode_memory": (bench_decode_memory, {}),
+        "decode_serial": (bench_decode, {"workers": 1}),
+        "decode_parallel": (bench_decode, {"workers": os.cpu_count() or 1, "chunk_words": PARALLEL_CHUNK_WORDS}),
+        "sort": (bench_sort, {}),
+        "dacphysics": (bench_dacphysics, {}),
+        "hv_ingest": (bench_hv_ingest, {}),
+        "startup": (bench_startup, {}),
+    }
+    for gap in CLUSTER_GAPS:
+        table[f"cluster_gap_{gap}"] = (bench_cluster, {"clustering_gap": gap})
+    return {name: (fn, dict(kwargs, n_hits=n_hits, hit_rate=hit_rate)) for name, (fn, kwargs) in table.items()}
+
+
+def _run_one(name, n_hits, hit_rate):
+    '''Child process: run one benchmark in its own temporary directory and add rates and peak RSS'''
+    fn, kwargs = benchmarks(n_hits, hit_rate)[name]
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory(prefix="heastropix_bench_") as tmp_dir:
+        result = fn(tmp_dir=tmp_dir, **kwargs)
+    dt = max(result["seconds"], 1e-9)
+    if "hits" in result:
+        result["hits_per_s"] = result["hits"] / dt
+    if "bytes" in result:
+        result["mb_per_s"] = result["bytes"] / 1e6 / dt
+    result["peak_rss_mb"] = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024 # Linux reports KiB
+    result["baseline_rss_mb"] = baseline_kb / 1024
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_path):
+    '''Print the throughput of every benchmark relative to an earlier results file'''
+    with open(previous_path) as f:
+        previous = json.load(f)["results"]
+    print(f"\nCompared with {previous_path}:")
+    for name, result in results.items():
+        old = previous.get(name)
+        if old is None:
+            continue
+        ratio = old["seconds"] / max(result["seconds"], 1e-9)
+        flag = "  <-- slower" if ratio < SLOWDOWN_WARN else ""
+        print(f"  {name:20s} {ratio:6.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hits", type=int, default=DEFAULT_HITS, help="hits per benchmark")
+    parser.add_argument("--rate", type=float, default=1e6, help="synthetic hit rate in hits/s (sets the track density in time)")
+    parser.add_argument("--only", nargs="*", help="run benchmarks whose name starts with one of these")
+    parser.add_argument("--out", help="results file (default benchmarks/results/<date>_<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    names = [name for name in benchmarks(args.hits, args.rate) if not args.only or any(name.startswith(o) for o in args.only)]
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:# Fresh process per benchmark for a clean peak RSS
+            result = pool.submit(_run_one, name, args.hits, args.rate).result()
+        results[name] = result
+        rates = ", ".join(f"{result[key]:.3g} {unit}" for key, unit in (("hits_per_s", "hits/s"), ("mb_per_s", "MB/s")) if key in result)
+        flag = f"  <-- above the {STARTUP_TARGET_S:g} s target" if result.get("over_target") else ""
+        print(f"{name:20s} {result['seconds']:8.3f} s  {rates}  peak RSS {result['peak_rss_mb']:.0f} MB{flag}")
+
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "commit": commit,
+            "hits": args.hits,
+            "hit_rate": args.rate,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "host": platform.node(),
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{datetime.now():%Y-%m-%d_%H-%M-%S}_{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
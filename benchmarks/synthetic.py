@@ -0,0 +1,83 @@
+#benchmarks/synthetic.py
+'''Synthetic Timepix3 data for the benchmarks: GridPix-like tracks (electrons scattered along a line, arriving
+within a short drift-time window) on top of uniform noise hits, encoded as a .tpx3-style raw file'''
+
+import numpy as np
+
+CHUNK_HITS = 4096 # Pixel packets between two TPX3 chunk headers
+
+
+def encode_pixels(col, row, coarse, tot, ftoa):
+    '''64-bit pixel packets (type 0xB) from hit arrays; coarse is the 30-bit (SPIDR time << 14 | ToA) clock count'''
+    col, row = col.astype(np.uint64), row.astype(np.uint64)
+    dcol = col // 2 * 2
+    spix = row // 4 * 4
+    pix = col % 2 * 4 + row % 4
+    addr = (dcol << np.uint64(8)) | (spix << np.uint64(1)) | pix
+    coarse = coarse.astype(np.uint64) % np.uint64(1 << 30)
+    return (
+        (np.uint64(0xB) << np.uint64(60)) | (addr << np.uint64(44)) | ((coarse & np.uint64(0x3FFF)) << np.uint64(30))
+        | (tot.astype(np.uint64) << np.uint64(20)) | (ftoa.astype(np.uint64) << np.uint64(16)) | (coarse >> np.uint64(14))
+    )
+
+
+def make_hits(n_hits, hit_rate=1e6, mean_track_hits=80, max_track_length=120.0, noise_fraction=0.05,
+              drift_spread=20, diffusion=1.0, seed=0):
+    '''Hit dict (col, row, coarse, tot, ftoa, event) sorted by time. Tracks arrive at random (Poisson) so that the
+    average rate is hit_rate hits/s; event is -1 for noise hits. drift_spread is in 25 ns clock cycles.'''
+    rng = np.random.default_rng(seed)
+    n_noise = int(n_hits * noise_fraction)
+    n_track = n_hits - n_noise
+    sizes = np.maximum(rng.poisson(mean_track_hits, 2 * (n_track // mean_track_hits) + 16), 1)
+    sizes = sizes[:np.searchsorted(np.cumsum(sizes), n_track) + 1]
+    event = np.repeat(np.arange(len(sizes)), sizes)[:n_track]
+
+    event_rate = hit_rate / mean_track_hits
+    start = np.cumsum(rng.exponential(1 / event_rate / 25e-9, len(sizes))).astype(np.int64) # Clock cycles
+    x0, y0 = rng.uniform(0, 256, len(sizes)), rng.uniform(0, 256, len(sizes))
+    angle = rng.uniform(0, np.pi, len(sizes))
+    length = rng.uniform(0, max_track_length, len(sizes))
+    along = rng.uniform(-0.5, 0.5, len(event)) * length[event]
+    col = x0[event] + along * np.cos(angle[event]) + rng.normal(0, diffusion, len(event))
+    row = y0[event] + along * np.sin(angle[event]) + rng.normal(0, diffusion, len(event))
+    coarse = start[event] + rng.integers(0, drift_spread + 1, len(event))
+
+    span = int(start[-1]) + drift_spread + 1
+    col = np.concatenate([col, rng.uniform(0, 256, n_noise)])
+    row = np.concatenate([row, rng.uniform(0, 256, n_noise)])
+    coarse = np.concatenate([coarse, rng.integers(0, span, n_noise)])
+    event = np.concatenate([event, np.full(n_noise, -1)])
+
+    order = np.argsort(coarse, kind="stable")
+    n = len(order)
+    return {
+        "col": np.clip(col[order], 0, 255).astype(np.uint8),
+        "row": np.clip(row[order], 0, 255).astype(np.uint8),
+        "coarse": coarse[order],
+        "tot": np.clip(rng.normal(40, 15, n), 1, 1023).astype(np.uint16),
+        "ftoa": rng.integers(0, 16, n).astype(np.uint8),
+        "event": event[order],
+    }
+
+
+def encode_raw(hits, n_chips=1, chunk_hits=CHUNK_HITS):
+    '''Raw word stream: chunks of chunk_hits pixel packets, each behind a TPX3 header (chips take turns)'''
+    words = encode_pixels(hits["col"], hits["row"], hits["coarse"], hits["tot"], hits["ftoa"])
+    n_chunks = -(-len(words) // chunk_hits)
+    chunk = np.arange(n_chunks, dtype=np.uint64)
+    sizes = np.minimum(chunk_hits, len(words) - chunk.astype(np.int64) * chunk_hits).astype(np.uint64)
+    headers = np.uint64(0x33585054) | ((chunk % np.uint64(n_chips)) << np.uint64(32)) | ((sizes * np.uint64(8)) << np.uint64(48))
+    raw = np.empty(len(words) + n_chunks, dtype="<u8")
+    header_pos = np.arange(n_chunks) * (chunk_hits + 1)
+    is_header = np.zeros(len(raw), dtype=bool)
+    is_header[header_pos] = True
+    raw[is_header] = headers
+    raw[~is_header] = words
+    return raw
+
+
+def write_raw(path, n_hits, **kwargs):
+    '''Generate n_hits track-like hits and write them as a raw file. Returns the hit dict (ground truth).'''
+    hits = make_hits(n_hits, **kwargs)
+    encode_raw(hits).tofile(path)
+    return hits
@@ -1,7 +1,11 @@
 import streamlit as st
-import csv
-from pathlib import Path
-from datetime import datetime
+import glob
+import os
+from datetime import datetime, timedelta
+from backend.hvlog import HVLogWriter
+from backend.hvplan import default_plan, list_plans, load_plan, PLAN_DIR
+from backend.hvramp import run_hv_ramp
+from backend.jobs import start_job
 
 # Return a colored bulb based on number of channels on
 def bulb(n_on: int) -> str:
@@ -15,61 +19,20 @@ def bulb(n_on: int) -> str:
         return "🟢"
 
 
-#Dictionary of HV steps   
-hv_steps = {
-    "step": list(range(1, 64)),
-    "Vgrid_CH3": [
-        0, 50, 100, 150, 200, 250, 275, 300, 325, 325, 325, 325, 325, 325, 325, 
-        325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 335, 345, 
-        355, 365, 375, 385, 395, 405, 410, 410, 410, 410, 410, 410, 410, 410, 410, 
-        410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 410, 
-        410, 410, 410
-    ],
-    "Vanode_CH2": [
-        0, 50, 100, 150, 200, 250, 275, 300, 325, 325, 325, 325, 325, 325, 325, 
-        325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 325, 335, 345, 
-        355, 365, 375, 385, 395, 405, 410, 420, 430, 440, 450, 460, 460, 460, 460, 
-        460, 460, 460, 460, 460, 460, 460, 460, 460, 460, 460, 460, 460, 460, 470, 
-        480, 490, 510
-    ],
-    "Vcathode_CH1": [
-        50, 100, 150, 200, 250, 300, 325, 350, 375, 425, 475, 525, 575, 625, 675,
-        725, 775, 825, 875, 925, 975, 1025, 1075, 1125, 1175, 1225, 1275, 1325, 1325, 1325, 
-        1325, 1325, 1325, 1325, 1325, 1325, 1325, 1375, 1425, 1475, 1525, 1575, 1625, 1675, 1725, 
-        1775, 1825, 1875, 1925, 1975, 2025, 2075, 2125, 2175, 2225, 2275, 2325, 2375, 2425, 2470, 
-        2480, 2490, 2510
-    ]
-}
-
-LOG_DIR = "hv_ramp_logs"
-Path(LOG_DIR).mkdir(parents=True, exist_ok=True)#Make log directory if not present
+LOG_DIR = "hv_ramp_logs"#Created by HVLogWriter when the first session starts logging
 
 def log_event(step, channel, checked, vgrid, vanode, vcathode, note=""):
     if not st.session_state.get("logging_active", False):
         return  # Do nothing if logging not started
     
-    log_file = st.session_state.get("log_file")
-    if log_file is None:
+    writer = st.session_state.get("log_writer")#Buffered writer of this session, flushes+fsyncs in the background
+    if writer is None:
         return
-    
-    file_exists = Path(log_file).exists()
-
-    with open(log_file, "a", newline="") as f:
-        writer = csv.writer(f)
-
-        writer.writerow([
-            datetime.now().isoformat(timespec="seconds"),
-            f"{step:02d}",
-            channel,
-            checked,
-            vgrid,
-            vanode,
-            vcathode,
-            note
-        ])
+
+    writer.log(step, channel, checked, vgrid, vanode, vcathode, note)
 
 #For logging, log when a step is completed (tracked by return variable of checkbox for each channel). Streamlit runs fresh on each interaction, mandatory to store previous state to track changes.
-def handle_checkbox_change(key, step, channel, checked, i):
+def handle_checkbox_change(key, step, channel, checked, vgrid, vanode, vcathode):
     prev_key = f"{key}_prev"# make a key for previous state from current session state
 
     if prev_key not in st.session_state:# If previous state key not present, inititalize it to current state (first time)
@@ -82,17 +45,60 @@ def handle_checkbox_change(key, step, channel, checked, i):
             step=step,
             channel=channel,
             checked=checked,
-            vgrid=hv_steps["Vgrid_CH3"][i],
-            vanode=hv_steps["Vanode_CH2"][i],
-            vcathode=hv_steps["Vcathode_CH1"][i],
+            vgrid=vgrid,
+            vanode=vanode,
+            vcathode=vcathode,
         )
         st.session_state[prev_key] = checked
 
-#Two functions to disble checkbox of same values in consecuitive stepss
-def same_as_previous(arr, i):
-    return i > 0 and arr[i] == arr[i - 1]
-def same_as_next(arr, i):
-    return i < len(arr) - 1 and arr[i] == arr[i + 1]
+#Archive of all session logs, rebuilt only when a log file was added or changed (signature = names, mtimes, sizes)
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_archive(log_dir, signature):
+    from backend.hvarchive import HVArchive#pyarrow is only imported once the archive is opened
+    return HVArchive(log_dir)
+
+def hv_archive_section():
+    with st.expander("📚 HV log archive (all sessions)", key="hv_archive", on_change="rerun") as archive_box:
+        if not archive_box.open:#Closed: skip the index update and the queries
+            return
+        signature = tuple(
+            (p, os.stat(p).st_mtime, os.stat(p).st_size) for p in sorted(glob.glob(f"{LOG_DIR}/hv_log_*.csv"))
+        )
+        archive = load_archive(LOG_DIR, signature)
+
+        col1, col2, col3 = st.columns(3)
+        setup_filter = col1.text_input("Setup contains", key="archive_setup")
+        min_step = col2.number_input("Reached step ≥", value=0, min_value=0, max_value=63, key="archive_min_step")
+        days = col3.number_input("Last N days (0 = all)", value=0, min_value=0, key="archive_days")
+
+        sessions = archive.find_sessions(
+            setup=setup_filter or None,
+            min_step=min_step or None,
+            since=(datetime.now() - timedelta(days=days)) if days else None
+        )
+        st.dataframe(
+            sessions.select(["session", "start_time", "operator", "setup", "max_step", "n_rows"]).to_pandas(),
+            hide_index=True
+        )
+        steps, seconds, n_sessions = archive.time_per_step(sessions)
+        if len(steps):
+            st.caption("Mean time per step [s] over the selected sessions")
+            st.bar_chart({"step": steps, "seconds": seconds / n_sessions}, x="step", y="seconds")
+
+#Ramp plan with precomputed disable masks/durations, reloaded only when the plan file changes
+@st.cache_resource(show_spinner=False)
+def get_plan(path, mtime):
+    return default_plan() if path is None else load_plan(path)
+
+def select_plan():
+    plans = list_plans(PLAN_DIR)
+    name = st.selectbox(f"Ramp plan (CSV files in {PLAN_DIR}/)", list(plans), key="hv_plan")
+    path = plans[name]
+    try:
+        return get_plan(path, os.path.getmtime(path) if path else None)
+    except (OSError, ValueError) as e:
+        st.error(f"Cannot use plan '{name}': {e}. Falling back to the default plan.")
+        return get_plan(None, None)
 
 # Show UI
 def HVramp_tab():
@@ -103,6 +109,8 @@ def HVramp_tab():
     #UI Log
     st.subheader("HV Ramp Logbook")
 
+    hv_archive_section()
+
     operator = st.text_input("Operator name(s). Ex: Alice Bob, Dinkan Pankila")
     setup_info = st.text_area(
         "Setup info Ex: WGW15-G6, ArDME8020, 160-40ccpm, 1.1 bar",
@@ -116,6 +124,9 @@ def HVramp_tab():
     if "log_file" not in st.session_state:
         st.session_state.log_file = None
 
+    if "log_writer" not in st.session_state:
+        st.session_state.log_writer = None
+
     col1, col2 = st.columns(2)
 
     with col1:
@@ -128,25 +139,28 @@ def HVramp_tab():
         ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")#Record the timestamp
         log_file = f"{LOG_DIR}/hv_log_{ts}.csv"#Logfile name with the timestamp
 
-        with open(log_file, "w", newline="") as f:#Open new file and write header info. Later to be incorporated into log_event() function by pasing additonal arguments setup_info and operator
-            f.write("# HV Ramp Log\n")
-            f.write(f"# Start time: {datetime.now().isoformat(timespec='seconds')}\n")
-            f.write(f"# Operator(s): {operator}\n")
-            f.write(f"# Setup: {setup_info.replace(chr(10), ' | ')}\n")
-            f.write("#\n")
-            f.write("timestamp,step,channel,checked,Vgrid,Vanode,Vcathode,Note\n")
-
+        #Writer keeps the file open for the whole session and writes the header info (operator, setup) itself
+        st.session_state.log_writer = HVLogWriter(log_file, operator=operator, setup_info=setup_info)
         st.session_state.log_file = log_file
         st.session_state.logging_active = True
         st.success(f"Logging started: {log_file}")
 
     if stop_logging:
         st.session_state.logging_active = False
+        if st.session_state.log_writer is not None:#Flush + fsync the remaining rows and close the file
+            st.session_state.log_writer.close()
+            st.session_state.log_writer = None
         st.success("Logging stopped")
 
 
     st.subheader("HV Ramp Procedure")
 
+    plan = select_plan()
+    st.caption(
+        f"{len(plan)} steps, expected duration ≈ {plan.duration_up.sum() / 60:.0f} min up / "
+        f"{plan.duration_down.sum() / 60:.0f} min down"
+    )
+
     edit_enabled = st.toggle(
         "🔓 Enable editing (HV operation in progress)",
         value=True
@@ -177,17 +191,10 @@ def HVramp_tab():
     is_ramp_up = st.session_state.get("ramp_direction", "⬆ Ramp Up (default)") == "⬆ Ramp Up (default)"
 
     # ---- steps ----
-    for i, step in enumerate(hv_steps["step"]):
-
-        # Disable checkbox if voltage is same as previous step RU or vice versa RD
-        if is_ramp_up:
-            disable_ch3 = same_as_previous(hv_steps["Vgrid_CH3"], i)
-            disable_ch2 = same_as_previous(hv_steps["Vanode_CH2"], i)
-            disable_ch1 = same_as_previous(hv_steps["Vcathode_CH1"], i)
-        else:  # ramp down
-            disable_ch3 = same_as_next(hv_steps["Vgrid_CH3"], i)
-            disable_ch2 = same_as_next(hv_steps["Vanode_CH2"], i)
-            disable_ch1 = same_as_next(hv_steps["Vcathode_CH1"], i)
+    disable = plan.disable_up if is_ramp_up else plan.disable_down# Checkbox disabled if voltage is same as previous step RU or vice versa RD
+    for i, step in enumerate(plan.steps.tolist()):
+        vgrid, vanode, vcathode = plan.voltages[i].tolist()
+        disable_ch3, disable_ch2, disable_ch1 = disable[i].tolist()
 
         cols = st.columns([1, 2.5, 2.5, 2.5, 1, 3, 1])#Col sizes
 
@@ -203,12 +210,12 @@ def HVramp_tab():
                 else:  #Auto-uncheck the box if reccuring value
                     st.session_state[key_ch3] = False
             ch3 = st.checkbox(
-                f"CH3 → **{hv_steps['Vgrid_CH3'][i]} V**",
+                f"CH3 → **{vgrid} V**",
                 key=f"s{step:02d}_ch3",
                 disabled=(not edit_enabled) or disable_ch3
             )
             handle_checkbox_change(
-                key_ch3, step, "CH3", ch3, i
+                key_ch3, step, "CH3", ch3, vgrid, vanode, vcathode
             )
 
         with cols[2]:# CH2 Anode
@@ -219,12 +226,12 @@ def HVramp_tab():
                 else:  #Auto-uncheck the box if reccuring value
                     st.session_state[key_ch2] = False
             ch2 = st.checkbox(
-                f"CH2 → **{hv_steps['Vanode_CH2'][i]} V**",
+                f"CH2 → **{vanode} V**",
                 key=f"s{step:02d}_ch2",
                 disabled=(not edit_enabled) or disable_ch2
             )
             handle_checkbox_change(
-                key_ch2, step, "CH2", ch2, i
+                key_ch2, step, "CH2", ch2, vgrid, vanode, vcathode
             )
 
         with cols[3]:#CH1 Cathode
@@ -235,12 +242,12 @@ def HVramp_tab():
                 else:  #Auto-uncheck the box if reccuring value
                     st.session_state[key_ch1] = False
             ch1 = st.checkbox(
-                f"CH1 → **{hv_steps['Vcathode_CH1'][i]} V**",
+                f"CH1 → **{vcathode} V**",
                 key=f"s{step:02d}_ch1",
                 disabled=(not edit_enabled) or disable_ch1
             )
             handle_checkbox_change(
-                key_ch1, step, "CH1", ch1, i
+                key_ch1, step, "CH1", ch1, vgrid, vanode, vcathode
             )
 
         # ---- compute state and change bulb color----
@@ -269,9 +276,9 @@ def HVramp_tab():
                         step=step,
                         channel="NOTE",
                         checked=(n_on == 3),# if all three channels in this step are checked
-                        vgrid=hv_steps["Vgrid_CH3"][i],
-                        vanode=hv_steps["Vanode_CH2"][i],
-                        vcathode=hv_steps["Vcathode_CH1"][i],
+                        vgrid=vgrid,
+                        vanode=vanode,
+                        vcathode=vcathode,
                         note=note_text
                     )
                     st.toast(f"Note logged for step {step:02d}!", icon="📝")
@@ -302,7 +309,7 @@ def HVramp_tab():
         # Manual voltage inputs
         vgrid_ft = cols[1].number_input(
             "CH3 (Vgrid)",
-            value=hv_steps["Vgrid_CH3"][-1],
+            value=int(plan.channel("CH3")[-1]),
             step=5,
             disabled=not fine_tune_enabled,
             key="ft_vgrid"
@@ -310,7 +317,7 @@ def HVramp_tab():
 
         vanode_ft = cols[2].number_input(
             "CH2 (Vanode)",
-            value=hv_steps["Vanode_CH2"][-1],
+            value=int(plan.channel("CH2")[-1]),
             step=5,
             disabled=not fine_tune_enabled,
             key="ft_vanode"
@@ -318,7 +325,7 @@ def HVramp_tab():
 
         vcathode_ft = cols[3].number_input(
             "CH1 (Vcathode)",
-            value=hv_steps["Vcathode_CH1"][-1],
+            value=int(plan.channel("CH1")[-1]),
             step=5,
             disabled=not fine_tune_enabled,
             key="ft_vcathode"
@@ -359,6 +366,22 @@ def HVramp_tab():
             st.toast("HV fine tune logged", icon="📝")#Display a short success message for csv save
             st.session_state.ft_note_active = ""
 
+    #Automated ramp through the selected plan against the simulated supply, runs as a background job with its own log file
+    st.subheader("🤖 Automated Ramp (simulated supply)")
+    col1, col2 = st.columns(2)
+    for col, direction, label in ((col1, "up", "⬆ Run automated ramp-up"), (col2, "down", "⬇ Run automated ramp-down")):
+        if col.button(label, key=f"auto_ramp_{direction}"):
+            start_job(
+                name=f"hv ramp {direction}",
+                target=run_hv_ramp,
+                plan=plan.to_dict(),
+                direction=direction,
+                log_dir=LOG_DIR,
+                operator=operator or "automated ramp",
+                setup_info=setup_info
+            )
+            st.toast(f"Automated ramp-{direction} queued, see Background Jobs & Logs", icon="🤖")
+
     ramp_direction = st.radio(
     "Ramp direction",
     ["⬆ Ramp Up (default)", "⬇ Ramp Down"],
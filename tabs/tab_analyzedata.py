@@ -0,0 +1,152 @@
+#tabs/tab_analyzedata.py
+import os
+
+import streamlit as st
+
+from backend.jobs import start_job, jobs, INSTRUMENT
+from backend.interpretation import TOA_NS
+from backend.analysis import run_analysis
+from backend.sweep import run_sweep
+from backend.dataset import run_dataset_analysis
+from backend.follow import followers
+from backend.livehist import load_snapshot, view
+from backend.hitstore import HitStore, read_cluster
+from tabs.tab_jobs import INSTRUMENT_LABELS
+
+LIVE_POLL_S = 2.0 # Refresh of the live follow-mode plots
+INTERPRETATION_SNAPSHOT = "interpreted_live.npz" # Histograms saved by the interpretation job
+
+
+def int_list(text):
+    return [int(v) for v in text.replace(",", " ").split()]
+
+
+#The memory map and chunk index of a .hits file are opened once per file version
+@st.cache_resource(show_spinner=False, max_entries=2)
+def open_hit_store(path, mtime):
+    return HitStore(path)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def snapshot_view(path, mtime, pixel_bin):
+    snapshot = load_snapshot(path)
+    return snapshot["hits"], snapshot["clusters"], view(snapshot, pixel_bin)
+
+def draw_histograms(title, hits, clusters, live):
+    st.markdown(f"**{title}** → {hits} hits, {clusters} clusters")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.caption("Occupancy (log scale)")
+        st.image(live["occupancy_image"], width="stretch")
+    with col2:
+        st.caption(f"Hit rate [hits/s], {live['rate_bin_s']:g} s bins")
+        st.line_chart(live["rate"])
+    with col3:
+        st.caption("ToT spectrum")
+        st.bar_chart(live["tot_hist"])
+        if clusters:
+            st.caption("Cluster ToT spectrum")
+            st.bar_chart(live["cluster_tot_hist"])
+
+
+def analyzedata_tab():
+    st.subheader("Analysis")
+    instrument = st.selectbox("Instrumentation", INSTRUMENT, format_func=INSTRUMENT_LABELS.get, key="analysis_instrument")
+    run_start = st.text_input("Run start (local time, e.g. 2025-12-19T18:34:23) to tag clusters with the logged HV", "")
+    if st.button("Run analysis"):
+        start_job(
+            name="analysis",
+            target=run_analysis,
+            parquet_path="interpreted.parquet",
+            clustering_gap=50,
+            run_start=run_start.strip() or None,
+            resumable=True,
+            instrument=instrument
+        )
+    analyses = [info for _, info in sorted(jobs.items(), reverse=True) if info["name"] == "analysis" and info["status"] == "done"]
+    if analyses and analyses[0]["result"].get("gain"):
+        st.caption(f"Gain vs HV setting: {analyses[0]['result']['gain_path']}")
+        st.dataframe(analyses[0]["result"]["gain"], hide_index=True)
+
+    #Parameter sweep: the hits are loaded once, every grid point is one clustering pass on the process pool
+    with st.expander("Parameter sweep"):
+        col1, col2, col3, col4 = st.columns(4)
+        gaps = col1.text_input("clustering_gap [25 ns]", "10, 25, 50, 100, 200")
+        radii = col2.text_input("radius [pixels]", "5")
+        min_tots = col3.text_input("min ToT", "0")
+        thls = col4.text_input("THL [DAC] (needs calibration)", "")
+        calibration = st.text_input("ToT calibration (.npy, optional)", "")
+        if st.button("Run sweep"):
+            try:
+                grid = {"clustering_gap": int_list(gaps), "radius": int_list(radii), "min_tot": int_list(min_tots), "thl": int_list(thls)}
+            except ValueError:
+                st.error("Grid values must be integers separated by commas")
+            else:
+                start_job(
+                    name="sweep",
+                    target=run_sweep,
+                    parquet_path="interpreted.parquet",
+                    grid=grid,
+                    calibration=calibration or None
+                )
+        sweeps = [info for _, info in sorted(jobs.items(), reverse=True) if info["name"] == "sweep" and info["status"] == "done"]
+        if sweeps:
+            st.caption(f"Latest sweep: {sweeps[0]['result']['output_path']}")
+            st.dataframe(sweeps[0]["result"]["points"], hide_index=True)
+
+    #Multi-run analysis: many interpreted runs streamed one batch at a time, spectra summed per run and per source
+    with st.expander("Multi-run analysis"):
+        dataset_source = st.text_input("Runs (directory or glob of interpreted .parquet files)", "data")
+        col1, col2, col3, col4 = st.columns(4)
+        tot_min = col1.number_input("min ToT", 0, 1023, 0)
+        tot_max = col2.number_input("max ToT", 0, 1023, 1023)
+        t_start = col3.number_input("from [s]", 0.0, value=0.0)
+        t_stop = col4.number_input("to [s] (0: end of run)", 0.0, value=0.0)
+        if st.button("Run multi-run analysis"):
+            start_job(
+                name="dataset",
+                target=run_dataset_analysis,
+                source=dataset_source,
+                tot_range=[tot_min, tot_max],
+                time_window=[t_start, t_stop or None],
+                clustering_gap=50
+            )
+        datasets = [info for _, info in sorted(jobs.items(), reverse=True) if info["name"] == "dataset" and info["status"] == "done"]
+        if datasets:
+            st.caption(f"Latest multi-run analysis: {datasets[0]['result']['output_dir']}")
+            st.dataframe(datasets[0]["result"]["sources"], hide_index=True)
+            st.dataframe(datasets[0]["result"]["runs"], hide_index=True)
+
+    #Event display: one cluster's hits from the compact .hits file, only the chunks around its time are read
+    with st.expander("Event display"):
+        if os.path.exists("interpreted.hits") and os.path.exists("interpreted_clusters.parquet"):
+            cluster_index = st.number_input("Cluster", 0, value=0, step=1)
+            try:
+                cluster = read_cluster("interpreted_clusters.parquet", int(cluster_index))
+            except IndexError:
+                st.error("No cluster with this index")
+            else:
+                hits = open_hit_store("interpreted.hits", os.path.getmtime("interpreted.hits")).cluster_hits(cluster, margin=2)
+                st.caption(f"{cluster['size']} hits, ToT sum {cluster['tot_sum']}, length {cluster['length']:.1f} px")
+                delay = (hits["toa"] - int(cluster["toa_start"])).astype(float) * TOA_NS
+                st.scatter_chart({"col": hits["col"], "row": hits["row"], "ToA [ns]": delay},
+                                 x="col", y="row", color="ToA [ns]")
+        else:
+            st.write("Run the interpretation and the analysis first.")
+
+    #Live histograms (occupancy, spectra, rate) of a followed run or of the interpretation job, refreshed on their
+    #own while either runs. Only the fixed-size, rebinned arrays are drawn, never the hits.
+    pixel_bin = st.select_slider("Occupancy binning [pixels]", options=[1, 2, 4, 8], value=2)
+
+    interpreting = any(j["name"] == "interpretation" and j["status"] in ("queued", "running") for j in jobs.values())
+
+    @st.fragment(run_every=LIVE_POLL_S if followers or interpreting else None)
+    def live_view():
+        for path, follower in list(followers.items()):# Followers finishing in their job threads drop out meanwhile
+            live = follower.snapshot()
+            draw_histograms(f"Live: {path} ({live['bytes'] / 1e6:.1f} MB)", live["hits"], live["clusters"], view(live, pixel_bin))
+        if os.path.exists(INTERPRETATION_SNAPSHOT):
+            hits, clusters, live = snapshot_view(INTERPRETATION_SNAPSHOT, os.path.getmtime(INTERPRETATION_SNAPSHOT), pixel_bin)
+            draw_histograms("Interpretation: interpreted.parquet", hits, clusters, live)
+
+    live_view()
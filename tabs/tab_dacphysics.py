@@ -1,5 +1,5 @@
 import streamlit as st
-from backend.dacphysics import vtp_to_electrons, electrons_to_vtp, thlDAC_to_electrons, electrons_to_thlDAC, vtpDAC_to_electrons
+from backend.dacphysics import vtp_to_electrons, electrons_to_vtp, thlDAC_to_electrons, electrons_to_thlDAC, vtpDAC_to_electrons, electrons_to_vtpFDAC
 from backend.dacphysics import VTP_DAC_STEP_MV, E_CHARGE
 
 def dacphysics_tab():
@@ -34,6 +34,7 @@ def dacphysics_tab():
     electrons_from_pulse = vtp_to_electrons(pulse_mV, capacitance_fF)
     electrons_from_thlDAC = thlDAC_to_electrons(thl_dac_value, slope=thl_per_electron, intercept=thl_intercept)
     electrons_from_vtpDAC = vtpDAC_to_electrons(vtpF_DAC=vtpF_dac_value, vtpC_DAC=vtpC_dac_value, C_fF=capacitance_fF)
+    vtpF_for_pulse, vtpF_out_of_range = electrons_to_vtpFDAC(electrons_from_pulse, vtpC_DAC=vtpC_dac_value, C_fF=capacitance_fF)
 
     st.markdown('''
         :red[Calculated values:]
@@ -41,4 +42,8 @@ def dacphysics_tab():
 
     st.markdown(f"**Test Pulse height** {pulse_mV} mV is {electrons_from_pulse:.1f} electrons")
     st.markdown(f"**THL Combined DAC** {thl_dac_value} is {electrons_from_thlDAC:.1f} electrons")
-    st.markdown(f"**VTP DACs** Fine: {vtpF_dac_value}, Coarse: {vtpC_dac_value} is {electrons_from_vtpDAC:.1f} electrons")
\ No newline at end of file
+    st.markdown(f"**VTP DACs** Fine: {vtpF_dac_value}, Coarse: {vtpC_dac_value} is {electrons_from_vtpDAC:.1f} electrons")
+    if vtpF_out_of_range:
+        st.markdown(f"**Test Pulse height** {pulse_mV} mV is out of the VTP Fine DAC range with Coarse {vtpC_dac_value}, consider changing VTP Coarse DAC value")
+    else:
+        st.markdown(f"**Test Pulse height** {pulse_mV} mV is VTP Fine DAC {vtpF_for_pulse} with Coarse {vtpC_dac_value}")
@@ -0,0 +1,40 @@
+#tabs/tab_interpret.py
+import streamlit as st
+
+from backend.jobs import start_job, INSTRUMENT
+from backend.interpretation import run_interpretation
+from backend.follow import followers, run_follow, stop_follow
+from tabs.tab_jobs import INSTRUMENT_LABELS
+
+
+def interpret_tab():
+    st.subheader("Data Interpretation")
+    instrument = st.selectbox("Instrumentation", INSTRUMENT, format_func=INSTRUMENT_LABELS.get, key="interpret_instrument")
+    if st.button("Run interpretation"):
+        start_job(
+            name="interpretation",
+            target=run_interpretation,
+            input_path="raw.dat",
+            output_path="interpreted.parquet",
+            hits_path="interpreted.hits",
+            resumable=True,
+            instrument=instrument
+        )
+
+    #Follow mode: decode the raw file while the DAQ is still writing it
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("▶ Follow running acquisition"):
+            if "raw.dat" in followers:
+                st.warning("raw.dat is already being followed")
+            else:
+                start_job(
+                    name="follow",
+                    target=run_follow,
+                    input_path="raw.dat",
+                    output_dir="interpreted_live",
+                    clustering_gap=50
+                )
+    with col2:
+        if st.button("■ Stop following"):
+            stop_follow("raw.dat")
@@ -0,0 +1,64 @@
+#tabs/tab_jobs.py
+import streamlit as st
+
+from backend.jobs import cancel_job, jobs, version, read_logs, format_record, LEVELS
+
+JOBS_POLL_S = 1.0 # How often the jobs/log panel checks backend.jobs.version()
+INSTRUMENT_LABELS = {None: "off", "timers": "stage timers + memory", "profile": "timers + cProfile"}
+
+
+#Only this fragment polls. The job rows and log text are rebuilt only when backend.jobs.version() or the log filter has moved.
+@st.fragment(run_every=JOBS_POLL_S)
+def jobs_panel():
+    log_filter = (st.session_state.get("log_level", "INFO"), st.session_state.get("log_job", "all"))
+    current = (version(), log_filter)
+    if st.session_state.get("jobs_panel_version") != current:
+        rows = []
+        for job_id, info in sorted(jobs.items(), reverse=True)[:10]:#Newest first
+            status = info["status"]
+            if status == "running":
+                status += f" {100 * info['progress']:.0f}%"
+            if info.get("message"):
+                status += f" ({info['message']})"
+            rows.append((job_id, f"**{info['name']} #{job_id}** → {status}", info["status"] in ("queued", "running")))
+        st.session_state.jobs_panel_rows = rows
+        level, job_filter = log_filter
+        records = read_logs(job_id=None if job_filter == "all" else job_filter, level=level, limit=15)
+        st.session_state.jobs_panel_log = "\n".join(format_record(r) for r in records)
+        st.session_state.jobs_panel_version = current
+
+    st.markdown("### Jobs")
+    if not st.session_state.jobs_panel_rows:
+        st.write("No jobs running.")
+    for job_id, text, active in st.session_state.jobs_panel_rows:
+        cols = st.columns([6, 1])
+        cols[0].write(text)
+        if active and cols[1].button("Cancel", key=f"cancel_{job_id}"):
+            cancel_job(job_id)
+
+    #Stage timers, counters, memory and profile of instrumented jobs
+    measured = [job_id for job_id, info in sorted(jobs.items(), reverse=True) if info.get("stats")]
+    if measured:
+        st.markdown("### Job instrumentation")
+        job_id = st.selectbox("Job", measured, format_func=lambda i: f"{jobs[i]['name']} #{i}", key="stats_job")
+        stats = jobs[job_id]["stats"]
+        total = max(stats["seconds"], 1e-9)
+        st.dataframe(
+            [{"stage": name, "seconds": s["seconds"], "share": f"{100 * s['seconds'] / total:.0f}%", "calls": s["calls"]}
+             for name, s in sorted(stats["stages"].items(), key=lambda item: -item[1]["seconds"])],
+            hide_index=True
+        )
+        memory = f"peak traced {stats['peak_traced_mb']:.0f} MB, " if "peak_traced_mb" in stats else ""
+        counters = ", ".join(f"{name} {value:,}" for name, value in stats["counters"].items())
+        st.caption(f"{total:.2f} s total, {memory}process max RSS {stats['max_rss_mb']:.0f} MB. {counters}")
+        if "profile" in stats:
+            st.code(stats["profile"])
+
+    st.markdown("### Logs")
+    cols = st.columns(2)
+    cols[0].selectbox("Level", LEVELS, index=LEVELS.index("INFO"), key="log_level")
+    cols[1].selectbox("Job", ["all"] + sorted(jobs, reverse=True), key="log_job")
+    if st.session_state.jobs_panel_log:
+        st.code(st.session_state.jobs_panel_log)
+    else:
+        st.write("No logs yet.")
@@ -0,0 +1,40 @@
+import numpy as np
+
+from backend.analysis import Clusterer, label_hits, summarize_clusters
+from backend.interpretation import FTOA_PER_COARSE, sort_hits
+from benchmarks.synthetic import make_hits
+
+BATCH = 997 # Odd batch size, so events are cut at batch boundaries
+
+
+def synthetic_hits():
+    '''Tracks far apart in time (no noise) as decoded hits with their event number'''
+    truth = make_hits(50_000, hit_rate=1e4, max_track_length=40.0, noise_fraction=0.0, seed=2)
+    hits = {"col": truth["col"], "row": truth["row"], "tot": truth["tot"], "event": truth["event"],
+            "toa": truth["coarse"].astype(np.uint64) * FTOA_PER_COARSE - truth["ftoa"]}
+    return sort_hits(hits)
+
+
+def test_label_hits_recovers_the_synthetic_events():
+    hits = synthetic_hits()
+    cluster, n_clusters = label_hits(hits["col"], hits["row"], hits["toa"], 50 * FTOA_PER_COARSE)
+    n_events = len(np.unique(hits["event"]))
+    assert n_clusters == n_events
+    assert len(np.unique(cluster * n_events + hits["event"])) == n_events# Every cluster is exactly one event
+
+
+def test_streaming_clusterer_matches_a_single_pass():
+    hits = synthetic_hits()
+    clusterer = Clusterer(clustering_gap=50)
+    parts = [clusterer.push({name: values[start:start + BATCH] for name, values in hits.items()})
+             for start in range(0, len(hits["toa"]), BATCH)]
+    parts.append(clusterer.flush())
+    streamed = {name: np.concatenate([part[name] for part in parts if part is not None]) for name in ("cluster_id", "toa_start", "size", "tot_sum")}
+
+    cluster, n_clusters = label_hits(hits["col"], hits["row"], hits["toa"], 50 * FTOA_PER_COARSE)
+    single = summarize_clusters(cluster, n_clusters, hits["col"], hits["row"], hits["toa"], hits["tot"])
+    assert clusterer.n_clusters == n_clusters
+    np.testing.assert_array_equal(streamed["cluster_id"], np.arange(n_clusters))# Ids run on across batches
+    for name in ("toa_start", "size", "tot_sum"):
+        np.testing.assert_array_equal(np.sort(streamed[name]), np.sort(single[name]))
+    np.testing.assert_array_equal(np.sort(streamed["size"]), np.sort(np.bincount(hits["event"])))
@@ -0,0 +1,14 @@
+import numpy as np
+
+from backend.dacphysics import VTPF_DAC_MAX, electrons_to_vtpFDAC, vtpDAC_to_electrons
+
+
+def test_electrons_to_vtpFDAC_flags_out_of_range_values_instead_of_raising():
+    electrons = vtpDAC_to_electrons(np.array([0, 200, VTPF_DAC_MAX]), 100)
+    electrons = np.r_[electrons, 1e9, -1e9, np.nan, np.inf]
+    dac, out_of_range = electrons_to_vtpFDAC(electrons, vtpC_DAC=100)
+    assert dac.dtype == np.int64
+    np.testing.assert_array_equal(dac, [0, 200, VTPF_DAC_MAX, VTPF_DAC_MAX, 0, 0, VTPF_DAC_MAX])
+    np.testing.assert_array_equal(out_of_range, [False, False, False, True, True, True, True])
+    assert electrons_to_vtpFDAC(electrons[1]) == (200, False)
+    assert electrons_to_vtpFDAC(float("nan")) == (0, True)
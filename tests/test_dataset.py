@@ -0,0 +1,48 @@
+import numpy as np
+import pyarrow.parquet as pq
+
+from backend.dataset import find_runs, run_dataset_analysis
+from backend.follow import RunFollower
+from backend.interpretation import FTOA_PER_COARSE, hits_to_table, sort_hits
+from benchmarks.synthetic import encode_raw, make_hits
+
+
+def hit_table(n_hits, seed):
+    truth = make_hits(n_hits, hit_rate=1e5, seed=seed)
+    return hits_to_table(sort_hits({"chip": np.zeros(n_hits, dtype=np.uint8), "col": truth["col"], "row": truth["row"],
+                                    "toa": truth["coarse"].astype(np.uint64) * FTOA_PER_COARSE - truth["ftoa"],
+                                    "tot": truth["tot"], "ftoa": truth["ftoa"]}))
+
+
+def make_dataset(root):
+    '''Fe55/run1.parquet with its cluster file, a follow-mode directory Cu/live written in two passes, and a
+    result cache copy of run1 under the data root'''
+    (root / "Fe55").mkdir(parents=True)
+    pq.write_table(hit_table(5000, 1), root / "Fe55" / "run1.parquet")
+    pq.write_table(hit_table(100, 2), root / "Fe55" / "run1_clusters.parquet")
+    (root / "result_cache" / "0123abcd").mkdir(parents=True)
+    pq.write_table(hit_table(5000, 1), root / "result_cache" / "0123abcd" / "hits.parquet")
+    raw = str(root / "live.dat")
+    follower = RunFollower(raw, str(root / "Cu" / "live"))
+    for part in np.array_split(encode_raw(make_hits(8000, seed=3)), 2):
+        with open(raw, "ab") as f:
+            part.tofile(f)
+        follower.poll()
+    follower.finish()
+    return follower
+
+
+def test_find_runs_and_dataset_analysis(tmp_path):
+    root = tmp_path / "data"
+    follower = make_dataset(root)
+    assert len(list((root / "Cu" / "live").glob("hits-*.parquet"))) > 1
+    assert find_runs(str(root)) == [str(root / "Cu" / "live"), str(root / "Fe55" / "run1.parquet")]
+    assert find_runs(str(root / "**" / "*.parquet")) == find_runs(str(root))
+
+    result = run_dataset_analysis(str(root), output_dir=str(tmp_path / "out"))
+    runs = {row["run"]: row for row in result["runs"]}
+    assert set(runs) == {"live", "run1"}
+    assert runs["live"]["source"] == "Cu" and runs["live"]["hits"] == follower.n_hits == 8000
+    assert runs["live"]["clusters"] == follower.n_clusters
+    assert runs["run1"]["source"] == "Fe55" and runs["run1"]["hits"] == 5000
+    assert [row["source"] for row in result["sources"]] == ["Cu", "Fe55"]
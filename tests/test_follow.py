@@ -0,0 +1,51 @@
+import threading
+
+import numpy as np
+import pyarrow.dataset as ds
+import pytest
+
+from backend.follow import SNAPSHOT_NAME, RunFollower, followers, run_follow, stop_follow
+from benchmarks.synthetic import encode_raw, make_hits, write_raw
+
+
+def test_follower_is_dropped_when_done_and_duplicates_are_refused(tmp_path):
+    raw = str(tmp_path / "raw.dat")
+    write_raw(raw, 10_000)
+    results = {}
+    thread = threading.Thread(target=lambda: results.update(run_follow(raw, str(tmp_path / "live"), poll_interval=0.01, idle_timeout=30)))
+    thread.start()
+    try:
+        while raw not in followers:
+            assert thread.is_alive()
+            thread.join(0.01)
+        with pytest.raises(ValueError, match="already being followed"):
+            run_follow(raw, str(tmp_path / "other"))
+        with pytest.raises(ValueError, match="another follower"):
+            run_follow(str(tmp_path / "other.dat"), str(tmp_path / "live"))
+    finally:
+        stop_follow(raw)
+        thread.join(10)
+    assert not thread.is_alive()
+    assert results["hits"] == 10_000
+    assert raw not in followers
+
+
+def test_second_follow_into_the_same_directory_replaces_the_first(tmp_path):
+    live = tmp_path / "live"
+    live.mkdir()
+    (live / "notes.txt").write_text("kept")
+    first, second = str(tmp_path / "first.dat"), str(tmp_path / "second.dat")
+    words = encode_raw(make_hits(30_000, seed=1))
+    follower = RunFollower(first, str(live))
+    for part in np.array_split(words, 3):# The DAQ writes the first run in three goes: more parts than the second run
+        with open(first, "ab") as f:
+            part.tofile(f)
+        follower.poll()
+    follower.finish()
+    write_raw(second, 10_000, seed=2)
+    summary = run_follow(second, str(live), poll_interval=0.01, idle_timeout=0)
+
+    hits = ds.dataset(sorted(str(path) for path in live.glob("hits-*.parquet"))).to_table()
+    assert hits.num_rows == summary["hits"] == 10_000
+    assert int(np.load(str(live / SNAPSHOT_NAME))["hits"]) == 10_000
+    assert (live / "notes.txt").read_text() == "kept"
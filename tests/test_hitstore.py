@@ -0,0 +1,43 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from backend.analysis import CLUSTER_SCHEMA, label_hits, summarize_clusters
+from backend.hitstore import HIT_DTYPE, HitStore, HitWriter, read_cluster, to_records
+from backend.interpretation import FTOA_PER_COARSE, sort_hits
+from benchmarks.synthetic import make_hits
+
+CHUNK_HITS = 1000 # Small chunks: many tracks are split over two chunks
+GAP = 50 * FTOA_PER_COARSE
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_cluster_hits_round_trip(tmp_path, compress):
+    truth = make_hits(20_000, hit_rate=1e4, noise_fraction=0.0, seed=4)# Tracks far apart in time
+    hits = sort_hits({"col": truth["col"], "row": truth["row"], "tot": truth["tot"],
+                      "toa": truth["coarse"].astype(np.uint64) * FTOA_PER_COARSE - truth["ftoa"]})
+    cluster, n_clusters = label_hits(hits["col"], hits["row"], hits["toa"], GAP)
+    summary = summarize_clusters(cluster, n_clusters, hits["col"], hits["row"], hits["toa"], hits["tot"])
+    clusters_path = str(tmp_path / "run_clusters.parquet")
+    pq.write_table(pa.Table.from_pydict(summary, schema=CLUSTER_SCHEMA), clusters_path, row_group_size=64)
+
+    hits_path = str(tmp_path / "run.hits")
+    with HitWriter(hits_path, chunk_hits=CHUNK_HITS, compress=compress) as writer:
+        for start in range(0, len(hits["toa"]), 777):
+            writer.write({name: values[start:start + 777] for name, values in hits.items()})
+    store = HitStore(hits_path)
+    assert len(store) == len(hits["toa"]) and store.n_chunks == -(-len(hits["toa"]) // CHUNK_HITS)
+
+    records = to_records(hits)
+    chunk_of_hit = np.arange(len(records)) // CHUNK_HITS
+    on_boundary = 0
+    for i in range(n_clusters):
+        expected = records[cluster == i]
+        found = store.cluster_hits(read_cluster(clusters_path, i))
+        key = lambda r: np.sort(r, order=list(HIT_DTYPE.names))
+        np.testing.assert_array_equal(key(found), key(expected))
+        on_boundary += len(np.unique(chunk_of_hit[cluster == i])) > 1
+    assert on_boundary > 10
+    context = store.cluster_hits(read_cluster(clusters_path, 0), margin=2)# The cluster plus nearby hits of its window
+    assert set(records[cluster == 0].tolist()) <= set(context.tolist())
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from backend.hvarchive import HVArchive
+from backend.hvlog import HVLogWriter
+from backend.hvplan import default_plan
+
+CHANNELS = ("CH3", "CH2", "CH1")
+STEP_S = 30
+
+
+def write_session(log_dir, name, start):
+    '''Ramp up to step 18, one step every STEP_S seconds, with the UI's auto-checked rows for channels that keep
+    their voltage. Before step 9 the operator checks steps 17 and 18 by mistake (auto-checked channels only) and
+    unchecks them again; after step 18 a lone auto-checked CH3 of step 20 is logged.'''
+    plan = default_plan()
+    writer = HVLogWriter(str(log_dir / name), operator="test", setup_info="test", flush_interval=3600)
+
+    def row(step, channel, checked, t):
+        writer.log(step, channel, checked, *plan.voltages[step - 1].tolist(), timestamp=t)
+
+    for step in range(1, 19):
+        t = start + timedelta(seconds=STEP_S * step)
+        if step == 9:
+            for mistake in (18, 17):
+                for k, checked in enumerate((True, False)):
+                    row(mistake, "CH3", checked, t - timedelta(seconds=10 - k))
+        for k, channel in enumerate(CHANNELS):# Auto-checked channels come first, as in the UI
+            row(step, channel, True, t + timedelta(seconds=k))
+    row(20, "CH3", True, start + timedelta(seconds=STEP_S * 20))
+    writer.close()
+
+
+def test_time_per_step_and_max_step_use_operator_switch_ons(tmp_path):
+    write_session(tmp_path, "hv_log_2025-01-01_00-00-00.csv", datetime(2025, 1, 1))
+    write_session(tmp_path, "hv_log_2025-01-02_00-00-00.csv", datetime(2025, 1, 2))
+    archive = HVArchive(str(tmp_path))
+    assert archive.sessions["max_step"].to_pylist() == [18, 18]
+    steps, seconds, n_sessions = archive.time_per_step()
+    assert steps.tolist() == list(range(1, 18))
+    assert (n_sessions == 2).all()
+    np.testing.assert_allclose(seconds / n_sessions, STEP_S, atol=2)
+
+
+def test_archive_filters_sessions(tmp_path):
+    write_session(tmp_path, "hv_log_2025-01-01_00-00-00.csv", datetime(2025, 1, 1))
+    archive = HVArchive(str(tmp_path))
+    assert archive.find_sessions(setup="TEST").num_rows == 1
+    assert archive.find_sessions(min_step=19).num_rows == 0
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from backend.hvarchive import HVArchive
+from backend.hvlog import HVLogWriter
+
+
+def write_crashed_session(path):
+    '''A session of three rows whose last row was cut off mid-write'''
+    writer = HVLogWriter(str(path), operator="test", setup_info="test", flush_interval=3600)
+    for step in (1, 2, 3):
+        writer.log(step, "CH3", True, 50.0 * step, 50.0 * step, 50.0 * step + 50, timestamp=datetime(2025, 1, 1, 12, step))
+    writer.close()
+    text = path.read_bytes()
+    path.write_bytes(text[:-12])
+    return text[:text.rindex(b"\n", 0, len(text) - 1) + 1]# The file without its last row
+
+
+def test_new_session_recovers_a_crashed_log(tmp_path):
+    crashed = tmp_path / "hv_log_2025-01-01_12-00-00.csv"
+    intact = write_crashed_session(crashed)
+    writer = HVLogWriter(str(tmp_path / "hv_log_2025-01-02_12-00-00.csv"), operator="test", setup_info="test")
+    writer.close()
+    assert crashed.read_bytes() == intact
+    assert list(writer.recovered_logs) == [str(crashed)]
+
+
+def test_archive_ingest_recovers_a_crashed_log(tmp_path):
+    crashed = tmp_path / "hv_log_2025-01-01_12-00-00.csv"
+    intact = write_crashed_session(crashed)
+    archive = HVArchive(str(tmp_path))
+    assert crashed.read_bytes() == intact
+    assert archive.events["step"].to_pylist() == [1, 2]
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from backend.hvlog import HVLogWriter
+from backend.hvplan import default_plan
+from backend.hvramp import RampAborted, RampExecutor, SimulatedSupply, make_supply, run_hv_ramp
+
+FAST_SLEW = 1e4 # V/s, the charging current stays below the current limit
+FAST = {"poll_interval": 0.001, "settle_reads": 2, "step_timeout": 2.0}
+
+
+def small_plan():
+    plan = default_plan().to_dict()
+    return {key: values[:3] if isinstance(values, list) else values for key, values in plan.items()}
+
+
+class FailingSupply(SimulatedSupply):
+    '''Readback raises after `good` successful reads'''
+
+    def __init__(self, good):
+        super().__init__(slew_V_per_s=FAST_SLEW)
+        self.good = good
+
+    def read(self):
+        if self.good <= 0:
+            raise OSError("supply not responding")
+        self.good -= 1
+        return super().read()
+
+
+class StalledSupply(SimulatedSupply):
+    '''Readback blocks forever after the first read'''
+
+    def __init__(self):
+        super().__init__(slew_V_per_s=FAST_SLEW)
+        self.release = threading.Event()
+        self.calls = 0
+
+    def read(self):
+        self.calls += 1
+        if self.calls > 1:
+            self.release.wait()
+        return super().read()
+
+
+class RecordingSupply(SimulatedSupply):
+    '''Records every set_voltage call; calls made by off() are recorded separately'''
+
+    def __init__(self, fail_off=False, **kwargs):
+        super().__init__(slew_V_per_s=FAST_SLEW, **kwargs)
+        self.calls = []
+        self.off_calls = []
+        self.fail_off = fail_off
+        self._switching_off = False
+
+    def set_voltage(self, channel, volts):
+        (self.off_calls if self._switching_off else self.calls).append((channel, float(volts)))
+        super().set_voltage(channel, volts)
+
+    def off(self):
+        if self.fail_off:
+            raise OSError("supply not responding")
+        self._switching_off = True
+        super().off()
+
+
+def test_ramp_up_completes():
+    executor = RampExecutor(SimulatedSupply(slew_V_per_s=FAST_SLEW), small_plan(), **FAST)
+    summary = executor.run()
+    assert summary["moves"] == 9 # Every channel moves in each of the first three default steps
+
+
+def test_readback_error_aborts():
+    supply = FailingSupply(good=3)
+    with pytest.raises(RampAborted, match="readback failed"):
+        RampExecutor(supply, small_plan(), **FAST).run()
+    assert all(v == 0 for v in supply.setpoint.values())
+
+
+def test_stale_readback_does_not_settle():
+    supply = StalledSupply()
+    executor = RampExecutor(supply, small_plan(), **(FAST | {"step_timeout": 0.2}))
+    try:
+        with pytest.raises(RampAborted, match="did not settle"):
+            executor.run()
+    finally:
+        supply.release.set()
+
+
+def test_unknown_supply_refused(tmp_path):
+    with pytest.raises(ValueError, match="Unknown power supply"):
+        run_hv_ramp(small_plan(), log_dir=str(tmp_path), supply="caen")
+    assert isinstance(make_supply(lambda: SimulatedSupply()), SimulatedSupply)
+
+
+def test_plan_violating_limits_refused(tmp_path):
+    plan = small_plan()
+    plan["Vanode_CH2"] = [0, 50, 250] # 150 V across the grid at step 3
+    with pytest.raises(ValueError, match="Vanode - Vgrid above 100 V at step\\(s\\) 3"):
+        run_hv_ramp(plan, log_dir=str(tmp_path))
+    assert not list(tmp_path.iterdir()) # Refused before a log file was opened
+
+
+def test_cancel_sets_no_further_voltage():
+    supply = RecordingSupply()
+    with pytest.raises(RampAborted, match="stopped by operator"):
+        RampExecutor(supply, small_plan(), **FAST).run(cancelled=lambda: len(supply.calls) >= 2)
+    assert len(supply.calls) == 2
+    assert all(volts == 0 for _, volts in supply.off_calls)
+
+
+def test_trip_between_moves_sets_no_further_voltage():
+    supply = RecordingSupply(trip_at_V={"CH3": 50})# Trips once CH3 has reached step 2 (50 V)
+    executor = RampExecutor(supply, small_plan(), **(FAST | {"settle_reads": 1}))
+
+    def progress(fraction):# Let the poller see the trip before the next move
+        if supply.calls[-1] == ("CH3", 50.0):
+            deadline = time.monotonic() + 1.0
+            while executor.abort_reason is None and time.monotonic() < deadline:
+                time.sleep(0.001)
+
+    with pytest.raises(RampAborted, match="over-current on CH3"):
+        executor.run(progress=progress)
+    assert supply.calls[-1] == ("CH3", 50.0)
+    assert supply.off_calls
+
+
+def test_abort_logged_when_switching_off_fails(tmp_path):
+    writer = HVLogWriter(str(tmp_path / "hv_log.csv"), operator="test", setup_info="test")
+    supply = RecordingSupply(fail_off=True)
+    with pytest.raises(RampAborted, match="switching the supply off failed"):
+        RampExecutor(supply, small_plan(), writer, **FAST).run(cancelled=lambda: len(supply.calls) >= 1)
+    writer.close()
+    abort_rows = [line for line in (tmp_path / "hv_log.csv").read_text().splitlines() if ",ABORT," in line]
+    assert len(abort_rows) == 1 and "stopped by operator" in abort_rows[0]
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from backend.hvarchive import HVArchive
+from backend.hvlog import HVLogWriter
+from backend.hvplan import default_plan
+from backend.hvtimeline import HVTimeline, to_ns
+
+CHANNELS = ("CH3", "CH2", "CH1")
+STEP_S = 10
+TOP = 12 # Highest step of the test ramp
+
+
+def write_ramp(log_dir, start):
+    '''Ramp up to step TOP and back down as the UI logs it: check CH3, CH2, CH1 of every step, then uncheck
+    CH1, CH2, CH3 from the top step down to step 1. Returns the time of each step change (up, then down).'''
+    plan = default_plan()
+    writer = HVLogWriter(str(log_dir / f"hv_log_{start:%Y-%m-%d_%H-%M-%S}.csv"), operator="test", setup_info="test", flush_interval=3600)
+    times = []
+    steps = [(step, True) for step in range(1, TOP + 1)] + [(step, False) for step in range(TOP, 0, -1)]
+    for k, (step, checked) in enumerate(steps):
+        t = start + timedelta(seconds=STEP_S * (k + 1))
+        for n, channel in enumerate(CHANNELS if checked else CHANNELS[::-1]):
+            writer.log(step, channel, checked, *plan.voltages[step - 1].tolist(), timestamp=t + timedelta(seconds=n))
+        times.append(t)
+    writer.close()
+    return plan, times
+
+
+def test_ramp_down_and_session_end(tmp_path):
+    start = datetime(2025, 1, 1, 12)
+    plan, times = write_ramp(tmp_path, start)
+    write_ramp(tmp_path, start + timedelta(days=1))
+    timeline = HVTimeline.from_events(HVArchive(str(tmp_path)).events)
+
+    def state(t):
+        columns = timeline.lookup(timeline.index([to_ns(t)]))
+        return int(columns["hv_step"][0]), np.array([columns[name][0] for name in ("Vgrid", "Vanode", "Vcathode")])
+
+    settled = timedelta(seconds=len(CHANNELS) - 1)# All three channels of a step are set (the session ends right after its last row)
+    for step, t in zip(range(1, TOP + 1), times[:TOP]):
+        hv_step, voltages = state(t + settled)
+        assert hv_step == step
+        np.testing.assert_array_equal(voltages, plan.voltages[step - 1])
+    for step, t in zip(range(TOP, 0, -1), times[TOP:]):# Unchecking step i goes back to step i-1
+        hv_step, voltages = state(t + settled)
+        assert hv_step == step - 1
+        np.testing.assert_array_equal(voltages, plan.voltages[step - 2] if step > 1 else 0)
+        assert voltages[1] >= voltages[0]# Anode never below grid on the way down
+
+    hv_step, voltages = state(times[-1] + timedelta(minutes=1))# After the session: unknown, not the last state
+    assert hv_step == -1 and np.isnan(voltages).all()
+    hv_step, voltages = state(start + timedelta(days=1))# Before the next session starts
+    assert hv_step == -1 and np.isnan(voltages).all()
+    assert state(times[0] + timedelta(days=1) + settled)[0] == 1
@@ -0,0 +1,39 @@
+import numpy as np
+import pyarrow.parquet as pq
+
+from backend.interpretation import FTOA_PER_COARSE, run_interpretation
+from benchmarks.synthetic import write_raw
+
+CHUNK_WORDS = 1 << 14 # Small chunks, so that a test file is split into several ranges
+
+
+def canonical(columns):
+    '''Hit columns in ToA order, hits with equal ToA ordered by pixel and ToT (the decoder does not fix their order)'''
+    order = np.lexsort((columns["tot"], columns["row"], columns["col"], columns["toa"]))
+    return {name: np.asarray(columns[name])[order] for name in ("toa", "col", "row", "tot")}
+
+
+def test_serial_and_parallel_decoding_match_the_ground_truth(tmp_path):
+    raw = str(tmp_path / "run.raw")
+    truth = write_raw(raw, 200_000, hit_rate=5000, seed=1)# 40 s of data, so the coarse ToA rolls over once
+    tables = {}
+    for workers in (1, 2):
+        output = str(tmp_path / f"run_{workers}.parquet")
+        summary = run_interpretation(raw, output, chunk_words=CHUNK_WORDS, workers=workers, cache=False)
+        assert summary["hits"] == len(truth["coarse"])
+        tables[workers] = pq.read_table(output)
+        toa = tables[workers]["toa"].to_numpy()
+        assert (np.diff(toa.astype(np.int64)) >= 0).all()
+    assert tables[1].equals(tables[2])
+    serial, parallel = (np.load(str(tmp_path / f"run_{workers}_live.npz")) for workers in (1, 2))
+    assert int(parallel["hits"]) == len(truth["coarse"])
+    for name in serial.files:# Histograms merged from the workers' ranges equal those of the serial pass
+        np.testing.assert_array_equal(parallel[name], serial[name])
+
+    expected = canonical({
+        "toa": truth["coarse"].astype(np.uint64) * FTOA_PER_COARSE - truth["ftoa"],
+        "col": truth["col"], "row": truth["row"], "tot": truth["tot"],
+    })
+    decoded = canonical({name: tables[2][name].to_numpy() for name in ("toa", "col", "row", "tot")})
+    for name in expected:
+        np.testing.assert_array_equal(decoded[name], expected[name])
@@ -0,0 +1,33 @@
+import pytest
+
+from backend import jobs as jobs_module
+from backend.jobs import Scheduler, jobs
+
+
+def noop():
+    return None
+
+
+def test_restart_resumes_only_resumable_jobs(tmp_path):
+    db = str(tmp_path / "jobs.sqlite")
+    scheduler = Scheduler(db_path=db, max_running=0) # No workers: everything stays queued
+    resumable = scheduler.submit("interpretation", noop, resumable=True)
+    ramp = scheduler.submit("hv ramp up", noop)
+    running_ramp = scheduler.submit("hv ramp down", noop)
+    jobs[running_ramp]["status"] = "running"
+    scheduler._store(running_ramp, "status")
+
+    Scheduler(db_path=db, max_running=0) # Dashboard restart
+    assert jobs[resumable]["status"] == "queued"
+    assert jobs[ramp]["status"] == "interrupted"
+    assert jobs[running_ramp]["status"] == "interrupted"
+    assert "stopped" in jobs[running_ramp]["message"]
+
+
+def test_log_levels_are_normalized():
+    jobs_module.log("lower case", level="warning", job_id=-1)
+    jobs_module.log("logging name", level="CRITICAL", job_id=-1)
+    records = jobs_module.read_logs(job_id=-1, level="warn")
+    assert [r["level"] for r in records[-2:]] == ["WARNING", "ERROR"]
+    with pytest.raises(ValueError, match="Unknown log level"):
+        jobs_module.log("typo", level="INFOO")
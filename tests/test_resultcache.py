@@ -0,0 +1,44 @@
+import os
+
+from backend.resultcache import ResultCache
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_hit_miss_and_lru_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), budget_bytes=2500)
+    raw = write(tmp_path / "raw.dat", b"\x01" * 4096)
+    key = cache.key("interpretation", [raw], {"compress_hits": False}, "v1")
+    assert cache.key("interpretation", [raw], {"compress_hits": True}, "v1") != key
+    assert cache.key("interpretation", [raw], {"compress_hits": False}, "v2") != key
+    assert cache.get(key, {"hits.parquet": str(tmp_path / "out.parquet")}) is None
+
+    cache.put(key, {"hits.parquet": write(tmp_path / "out.parquet", b"a" * 1000)}, {"hits": 3})
+    os.remove(tmp_path / "out.parquet")
+    assert cache.get(key, {"hits.parquet": str(tmp_path / "out.parquet")}) == {"hits": 3}
+    assert (tmp_path / "out.parquet").read_bytes() == b"a" * 1000
+
+    write(raw, b"\x02" * 4096)# Changed input: new key
+    assert cache.key("interpretation", [raw], {"compress_hits": False}, "v1") != key
+
+    for name in ("b", "c"):# Over the budget with three entries: the least recently used one goes
+        cache.get(key, {"hits.parquet": str(tmp_path / "out.parquet")})
+        cache.put(name * 40, {"hits.parquet": write(tmp_path / f"{name}.parquet", name.encode() * 1000)}, {})
+    assert sorted(key for key, _ in cache.entries()) == sorted([key, "c" * 40])
+
+
+def test_entry_missing_an_output_is_replaced(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    raw = write(tmp_path / "raw.dat", b"\x01" * 4096)
+    key = cache.key("interpretation", [raw], {}, "v1")
+    cache.put(key, {"hits.parquet": write(tmp_path / "a.parquet", b"a")}, {"hits": 1})# First run without a .hits file
+    outputs = {"hits.parquet": str(tmp_path / "out.parquet"), "hits.hits": str(tmp_path / "out.hits")}
+    assert cache.get(key, outputs) is None
+    cache.put(key, {"hits.parquet": write(tmp_path / "b.parquet", b"b"), "hits.hits": write(tmp_path / "b.hits", b"h")}, {"hits": 2})
+    assert cache.get(key, outputs) == {"hits": 2}
+    assert (tmp_path / "out.hits").read_bytes() == b"h"
+    assert os.listdir(tmp_path / "cache") == [key]
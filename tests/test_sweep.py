@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+
+from backend import sweep
+from backend.analysis import run_analysis
+from backend.interpretation import FTOA_PER_COARSE, hits_to_table, sort_hits
+from backend.sweep import run_sweep
+from benchmarks.synthetic import make_hits
+
+GRID = {"clustering_gap": [10, 50], "radius": [3, 5], "min_tot": [0, 30]}
+
+
+def write_hits(path):
+    truth = make_hits(20_000, hit_rate=1e5, seed=3)
+    hits = sort_hits({"chip": np.zeros(len(truth["col"]), dtype=np.uint8), "col": truth["col"], "row": truth["row"],
+                      "toa": truth["coarse"].astype(np.uint64) * FTOA_PER_COARSE - truth["ftoa"], "tot": truth["tot"], "ftoa": truth["ftoa"]})
+    pq.write_table(hits_to_table(hits), path)
+    return hits
+
+
+def test_sweep_matches_serial_analysis(tmp_path):
+    parquet_path = str(tmp_path / "run.parquet")
+    hits = write_hits(parquet_path)
+    result = run_sweep(parquet_path, GRID, workers=2)
+    assert len(result["points"]) == 8
+    for row in result["points"]:
+        source = parquet_path
+        if row["min_tot"]:# The sweep's offline threshold, applied to a copy for the serial run
+            source = str(tmp_path / f"run_tot{row['min_tot']}.parquet")
+            keep = hits["tot"] >= row["min_tot"]
+            pq.write_table(hits_to_table({name: values[keep] for name, values in hits.items()}), source)
+        output = str(tmp_path / f"clusters_{row['clustering_gap']}_{row['radius']}_{row['min_tot']}.parquet")
+        serial = run_analysis(source, row["clustering_gap"], row["radius"], output_path=output, cache=False)
+        size = pq.read_table(output, columns=["size"])["size"].to_numpy()
+        assert row["hits"] == serial["hits"]
+        assert row["clusters"] == serial["clusters"]
+        assert row["hits_per_cluster"] == pytest.approx(size.mean())
+
+
+def test_failed_read_leaves_no_shared_memory(tmp_path, monkeypatch):
+    parquet_path = str(tmp_path / "run.parquet")
+    write_hits(parquet_path)
+    read_batches = sweep.iter_hit_batches
+
+    def failing_batches(path, batch_rows):# The file breaks after the first batch
+        yield next(read_batches(path, 1000))
+        raise OSError("read error")
+
+    monkeypatch.setattr(sweep, "iter_hit_batches", failing_batches)
+    before = set(os.listdir("/dev/shm"))
+    with pytest.raises(OSError, match="read error"):
+        run_sweep(parquet_path, GRID, workers=1)
+    assert set(os.listdir("/dev/shm")) <= before
@@ -0,0 +1,38 @@
+import numpy as np
+
+from backend.totcalib import fit_tot_calibration, hits_to_electrons
+
+
+def surrogate(charges, a, b, c, t):
+    return a * charges + b - c / (charges - t)
+
+
+def test_fit_round_trip():
+    '''Noise-free scans are fitted back to their parameters, pixel by pixel'''
+    rng = np.random.default_rng(0)
+    charges = np.linspace(1000, 20000, 20)
+    truth = np.stack([rng.normal(0.02, 0.002, (4, 4)), rng.normal(5, 1, (4, 4)), rng.normal(300, 30, (4, 4)),
+                      rng.uniform(100, 900, (4, 4))])
+    truth[:, 0, 0] = (0.02, 5, 300, 800)
+    tot = surrogate(charges[:, None, None], *truth)
+    params = fit_tot_calibration(charges, tot)
+    np.testing.assert_allclose(params, truth, rtol=1e-4)
+
+
+def test_fit_skips_dead_and_sparse_pixels():
+    '''Pixels without MIN_POINTS responses are NaN instead of breaking the whole fit'''
+    charges = np.linspace(1000, 20000, 10)
+    tot = np.repeat(surrogate(charges, 0.02, 5, 300, 800)[:, None, None], 3, axis=2)
+    tot[:, 0, 0] = np.nan
+    tot[3:, 0, 1] = np.nan
+    params = fit_tot_calibration(charges, tot)
+    assert np.isnan(params[:, 0, :2]).all()
+    np.testing.assert_allclose(params[:, 0, 2], (0.02, 5, 300, 800), rtol=1e-4)
+
+
+def test_hits_to_electrons_inverts_the_fit():
+    charges = np.linspace(1000, 20000, 20)
+    tot = surrogate(charges[:, None, None], 0.02, 5, 300, 800) * np.ones((1, 2, 2))
+    params = fit_tot_calibration(charges, tot)
+    electrons = hits_to_electrons(params, np.array([0, 1]), np.array([1, 0]), surrogate(np.array([5000.0, 12000.0]), 0.02, 5, 300, 800))
+    np.testing.assert_allclose(electrons, [5000, 12000], rtol=1e-3)